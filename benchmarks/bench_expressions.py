@@ -0,0 +1,66 @@
+# Micro-benchmarks for the numerical expression evaluation done on every string in a test file.
+# Compares the per-leaf cost of the original regex walker with src/expressions.py:
+#
+#   python benchmarks/bench_expressions.py [--number N]
+from pathlib import Path
+from argparse import ArgumentParser
+from re import compile, match
+from timeit import timeit
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from src.expressions import evaluate_avr_match, evaluate_expressions, evaluate_normal_match, find_unreplaced_wildcard
+
+# strings typical of generated test files, by kind
+LEAVES = {
+    "plain name": "flexgen_ess_01",
+    "id with digits": "test_site-ess-controller-02",
+    "coefficient": "issue a 7.5*10 kW cmd",
+    "avr": "100-.5*5*(12000+50)",
+    "wildcard": "{{UNREPLACED}}",
+    "long digits": "100-" + "1" * 2000 + "x",
+}
+
+
+# the string branch of Site.testfile_parsing_walker before the evaluator was compiled at module level
+def original_leaf(obj: str):
+    template_pattern = compile(r"(?:((?:-)?(?:\d*[.])?\d+)(?:\*))?((?:\d+)(?:[.]\d+)?)")
+    avr_pattern = compile(r"(?:100)([+-])(?:((?:\d*.)(?:\d+))(?:\*))?(\d+)(?:(?:\*\()(\d+)([+-])(\d+)(?:\)))?")
+    replacement_pattern = compile(r"{{\w+}}")
+    obj_to_try = obj
+    match(replacement_pattern, obj_to_try)
+    avr_replacement = avr_pattern.sub(evaluate_avr_match, obj_to_try)
+    if avr_replacement != obj:
+        try:
+            return float(avr_replacement)
+        except ValueError:
+            obj_to_try = avr_replacement
+    replacement = template_pattern.sub(evaluate_normal_match, obj_to_try)
+    if replacement != obj_to_try:
+        try:
+            replacement = float(replacement)
+        except ValueError:
+            pass
+    return replacement
+
+def compiled_leaf(obj: str):
+    find_unreplaced_wildcard(obj)
+    return evaluate_expressions(obj)
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("-n", "--number", type=int, default=20000, help="How many times each leaf is evaluated")
+    number = parser.parse_args().number
+
+    print(f"{'leaf':<16}{'before (us)':>14}{'after (us)':>14}{'speedup':>10}")
+    for kind, leaf in LEAVES.items():
+        assert original_leaf(leaf) == compiled_leaf(leaf), kind
+        # pathological inputs are slow enough that fewer runs still give a stable number
+        runs = number if len(leaf) < 100 else max(1, number // 1000)
+        before = timeit(lambda: original_leaf(leaf), number=runs) / runs * 1e6
+        after = timeit(lambda: compiled_leaf(leaf), number=runs) / runs * 1e6
+        print(f"{kind:<16}{before:>14.2f}{after:>14.2f}{before / after:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+# End-to-end benchmarks of variance.py on a synthetic fleet (see benchmarks/fleet.py for the fleet options).
+# Times a full generation, a rerun with nothing changed and each pipeline stage on its own, and compares the
+# results with a baseline recorded on the same machine:
+#
+#   python benchmarks/bench_fleet.py [fleet options] [--repeat N] [--baseline FILE [--save_baseline]] [--tolerance T]
+#
+# Timings depend on the machine, so no baseline is kept in the repo; record one with
+# `--baseline FILE --save_baseline` and pass the same `--baseline FILE` to later runs. Each case runs in a fresh
+# process so its peak RSS is its own. The baseline is only compared when it was saved for the same fleet options,
+# and any case slower than the baseline by more than the tolerance fails the run.
+from pathlib import Path
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from json import dumps, loads
+from logging import CRITICAL
+from os import chdir
+from resource import RUSAGE_SELF, getrusage
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from benchmarks.fleet import add_fleet_arguments, generate_fleet
+from src.cli import DEFAULT_STREAM_THRESHOLD, FLEXGEN_DEVICES, parse_testfiles, process_site
+from src.device import Device
+from src.site_obj import Site
+from src.staging import StagingTree
+from src.variant_overlay import get_source_scans, get_source_texts
+from src.logger import logger
+
+STAGES = ["copy", "expand", "replace", "parse", "write"]
+CASES = ["full", "rerun"] + STAGES
+
+
+@contextmanager
+def _timed(timings: dict, stage: str):
+    start = perf_counter()
+    yield
+    timings[stage] += perf_counter() - start
+
+# the steps of process_site() for a forced run, split into stages that are timed separately; stops after last_stage
+def run_stages(site_dirs: "list[Path]", last_stage: str = STAGES[-1]) -> "dict[str, float]":
+    timings = dict.fromkeys(STAGES, 0.0)
+    stages = STAGES[:STAGES.index(last_stage) + 1]
+    for site_dir in site_dirs:
+        current_site = Site(site_dir.name)
+        current_site.staging = StagingTree(source_texts=get_source_texts(), source_scans=get_source_scans())
+        site_variant_cfg = current_site.get_config_file()
+        devices = []
+        with _timed(timings, "copy"):
+            for device_dir in sorted(site_dir.iterdir()):
+                if device_dir.name not in FLEXGEN_DEVICES:
+                    continue
+                device = Device(device_dir.name, site_dir.name, site_variant_cfg.get(f"{device_dir.name}_variant", "root"))
+                device.staging = current_site.staging
+                device.clear_prev_files()
+                device.copy_all_files()
+                devices.append(device)
+        if "expand" in stages:
+            with _timed(timings, "expand"):
+                for device in devices:
+                    device.templates = site_variant_cfg.get(f"{device.get_type()}_templates", [])
+                    device.expand_templates()
+        if "replace" in stages:
+            with _timed(timings, "replace"):
+                current_site.set_replacements(site_variant_cfg.get("replacements", []))
+                current_site.replace_all_targets()
+        if "parse" in stages:
+            with _timed(timings, "parse"):
+                test_dirs = [device.get_directory() / "tests" for device in devices
+                             if current_site.staging.is_dir(device.get_directory() / "tests")]
+                parse_testfiles(current_site, test_dirs, DEFAULT_STREAM_THRESHOLD * 1024 * 1024)
+        if "write" in stages:
+            with _timed(timings, "write"):
+                current_site.staging.flush()
+    return timings
+
+def count_generated_files(fleet_dir: Path) -> int:
+    return sum(1 for path in (fleet_dir / "config").glob("*/*/*/**/*") if path.is_file())
+
+# runs in a fresh worker process for each case
+def run_case(fleet_dir: Path, case: str) -> "tuple[float, float]":
+    chdir(fleet_dir)
+    logger.setLevel(CRITICAL)
+    site_dirs = sorted(Path("config").iterdir())
+    if case in ("full", "rerun"):
+        if case == "rerun":
+            for site_dir in site_dirs:
+                process_site(site_dir, {"force": True})
+        start = perf_counter()
+        for site_dir in site_dirs:
+            process_site(site_dir, {"force": case == "full"})
+        seconds = perf_counter() - start
+    else:
+        seconds = run_stages(site_dirs, case)[case]
+    # ru_maxrss is in KiB on Linux
+    return seconds, getrusage(RUSAGE_SELF).ru_maxrss / 1024
+
+def main() -> None:
+    parser = ArgumentParser()
+    add_fleet_arguments(parser)
+    parser.add_argument("--repeat", type=int, default=3, help="How many times each case is run (the fastest run is kept)")
+    parser.add_argument("--baseline", type=Path, help="Baseline results to compare against (nothing is compared if not given)")
+    parser.add_argument("--save_baseline", action="store_true", help="Saves these results to the --baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="How much slower than the baseline a case may be (0.2 is 20%%)")
+    args = vars(parser.parse_args())
+    repeat = args.pop("repeat")
+    baseline_path = args.pop("baseline")
+    save_baseline = args.pop("save_baseline")
+    tolerance = args.pop("tolerance")
+    fleet = args
+    if save_baseline and baseline_path is None:
+        parser.error("--save_baseline needs the --baseline file to save the results to")
+
+    baseline = None
+    if baseline_path is not None and baseline_path.is_file():
+        baseline = loads(baseline_path.read_text())
+        if baseline["fleet"] != fleet:
+            print(f"Not comparing with {baseline_path}: it was saved for a different fleet")
+            baseline = None
+
+    results = {}
+    with TemporaryDirectory() as tmp_dir:
+        fleet_dir = Path(tmp_dir) / "fleet"
+        site_dirs = generate_fleet(fleet_dir, fleet)
+        for case in CASES:
+            runs = []
+            for _ in range(repeat):
+                with ProcessPoolExecutor(max_workers=1) as executor:
+                    runs.append(executor.submit(run_case, fleet_dir, case).result())
+            seconds = min(run[0] for run in runs)
+            results[case] = {"seconds": seconds, "peak_rss_mib": max(run[1] for run in runs)}
+        generated_files = count_generated_files(fleet_dir)
+
+    print(f"{len(site_dirs)} sites, {generated_files} generated files")
+    print(f"{'case':<10}{'wall (s)':>12}{'files/s':>12}{'peak RSS (MiB)':>16}{'vs baseline':>14}")
+    regressions = []
+    for case, result in results.items():
+        comparison = ""
+        if baseline is not None and case in baseline["results"]:
+            change = result["seconds"] / baseline["results"][case]["seconds"] - 1
+            comparison = f"{change:+.1%}"
+            if change > tolerance:
+                regressions.append(case)
+        files_per_second = generated_files / result["seconds"] if result["seconds"] else 0
+        print(f"{case:<10}{result['seconds']:>12.3f}{files_per_second:>12.0f}{result['peak_rss_mib']:>16.1f}{comparison:>14}")
+
+    if save_baseline:
+        baseline_path.write_text(dumps({"fleet": fleet, "results": results}, indent=4))
+        print(f"Saved baseline to {baseline_path}")
+    if regressions:
+        print(f"Slower than the baseline by more than {tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
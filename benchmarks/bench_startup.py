@@ -0,0 +1,76 @@
+# Startup benchmark of variance.py: times `variance.py --help` and a run with nothing to regenerate on a synthetic
+# fleet (see benchmarks/fleet.py for the fleet options), each in a fresh interpreter like CI scripts call it:
+#
+#   python benchmarks/bench_startup.py [fleet options] [--runs N] [--help_budget MS] [--noop_budget MS]
+#
+# Times are the median of the runs minus the startup of a bare interpreter, so the budgets only cover Variance's
+# own imports and work. Any case over its budget fails the run.
+from pathlib import Path
+from argparse import ArgumentParser
+from os import environ
+from statistics import median
+from subprocess import DEVNULL, run
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from benchmarks.fleet import add_fleet_arguments, generate_fleet
+
+VARIANCE_DIR = Path(__file__).resolve().parent.parent
+# budgets for `--help` and a run with nothing to regenerate, with room for noisy machines where the same no-op run
+# was measured anywhere between 90 and 140 ms
+DEFAULT_HELP_BUDGET = 150
+DEFAULT_NOOP_BUDGET = 200
+
+
+# median wall time in ms of running the command in fleet_dir
+def time_command(command: "list[str]", fleet_dir: Path, runs: int) -> float:
+    # bytecode is cached like it is for an installed copy of Variance
+    env = dict(environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    times = []
+    for _ in range(runs):
+        start = perf_counter()
+        run(command, cwd=fleet_dir, env=env, stdout=DEVNULL, stderr=DEVNULL, check=True)
+        times.append((perf_counter() - start) * 1000)
+    return median(times)
+
+def main() -> None:
+    parser = ArgumentParser()
+    add_fleet_arguments(parser)
+    parser.add_argument("--runs", type=int, default=20, help="How many times each case is run (the median is kept)")
+    parser.add_argument("--help_budget", type=float, default=DEFAULT_HELP_BUDGET, help="Budget in ms for `variance.py --help`")
+    parser.add_argument("--noop_budget", type=float, default=DEFAULT_NOOP_BUDGET,
+                        help="Budget in ms for a run with nothing to regenerate")
+    args = vars(parser.parse_args())
+    runs = args.pop("runs")
+    budgets = {"help": args.pop("help_budget"), "noop": args.pop("noop_budget")}
+    fleet = args
+
+    variance = [sys.executable, str(VARIANCE_DIR / "variance.py")]
+    with TemporaryDirectory() as tmp_dir:
+        fleet_dir = Path(tmp_dir) / "fleet"
+        site_dirs = generate_fleet(fleet_dir, fleet)
+        # generates every site once so the timed runs have nothing to do
+        time_command(variance, fleet_dir, 1)
+        interpreter = time_command([sys.executable, "-c", "pass"], fleet_dir, runs)
+        results = {
+            "help": time_command(variance + ["--help"], fleet_dir, runs) - interpreter,
+            "noop": time_command(variance, fleet_dir, runs) - interpreter,
+        }
+
+    print(f"{len(site_dirs)} sites, bare interpreter startup {interpreter:.1f} ms")
+    print(f"{'case':<10}{'wall (ms)':>12}{'budget (ms)':>14}")
+    over_budget = []
+    for case, milliseconds in results.items():
+        print(f"{case:<10}{milliseconds:>12.1f}{budgets[case]:>14.0f}")
+        if milliseconds > budgets[case]:
+            over_budget.append(case)
+    if over_budget:
+        print(f"Over the startup budget: {', '.join(over_budget)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# Generates a synthetic fleet laid out the way Variance expects it (config/<site>/<device> directories next to
+# <device>_variants/{root,<variant>} directories), sized by the options below:
+#
+#   python benchmarks/fleet.py <fleet_dir> [--sites N] [--devices N] [--variants N] ...
+from pathlib import Path
+from argparse import ArgumentParser
+from json import dumps
+from random import Random
+from shutil import rmtree
+import sys
+
+from yaml import safe_dump
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from src.cli import FLEXGEN_DEVICES
+
+# default size of a generated fleet; every option can be set from the command line
+FLEET_DEFAULTS = {
+    "sites": 20,
+    "devices": 3,
+    "variants": 2,
+    "files": 20,
+    "file_kib": 4,
+    "templates": 2,
+    "template_copies": 10,
+    "replacements": 20,
+    "test_files": 4,
+    "seed": 0,
+}
+
+
+# the replacement targets used in a device type's files: every third replacement only applies to one device type
+def _targets(fleet: dict, device_type: str) -> "list[str]":
+    device_types = FLEXGEN_DEVICES[:fleet["devices"]]
+    return [f"{{{{REPLACEMENT_{index}}}}}" for index in range(fleet["replacements"])
+            if index % 3 or device_types[index // 3 % len(device_types)] == device_type]
+
+def _write_json(filepath: Path, contents) -> None:
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    with open(filepath, "w") as file:
+        file.write(dumps(contents, indent=4))
+
+# a config file of about file_kib KiB that uses some of the site-wide replacement targets
+def _config_file(random: Random, fleet: dict, device_type: str, name: str) -> dict:
+    targets = _targets(fleet, device_type)
+    contents = {"name": name, "site": "{{SITE_ID}}", "registers": []}
+    size = 0
+    while size < fleet["file_kib"] * 1024:
+        register = {
+            "id": f"register_{len(contents['registers'])}",
+            "value": random.choice(targets) if targets else "value",
+            "scale": random.randint(1, 1000),
+            "description": "generated register " * random.randint(1, 4),
+        }
+        contents["registers"].append(register)
+        size += len(dumps(register, indent=4))
+    return contents
+
+def _test_file(random: Random, fleet: dict, device_type: str) -> dict:
+    targets = _targets(fleet, device_type) or ["1"]
+    steps = []
+    for step in range(max(1, fleet["file_kib"] * 4)):
+        steps.append({
+            "step": step,
+            "command": f"{random.choice(targets)}*{random.randint(1, 100)}",
+            "expected": "100-.5*5*(12000+50)",
+            "name": "step {{SITE_ID}}",
+        })
+    return {"steps": steps}
+
+def generate_fleet(fleet_dir: Path, fleet: dict = FLEET_DEFAULTS) -> "list[Path]":
+    fleet = dict(FLEET_DEFAULTS, **fleet)
+    random = Random(fleet["seed"])
+    if fleet_dir.exists():
+        rmtree(fleet_dir)
+    device_types = FLEXGEN_DEVICES[:fleet["devices"]]
+
+    for device_type in device_types:
+        variants_dir = fleet_dir / f"{device_type}_variants"
+        for file_index in range(fleet["files"]):
+            _write_json(variants_dir / "root" / f"group_{file_index % 4}" / f"file_{file_index}.json",
+                        _config_file(random, fleet, device_type, f"{device_type} file {file_index}"))
+        for template_index in range(fleet["templates"]):
+            template = _config_file(random, fleet, device_type, f"{device_type} template {template_index}")
+            template.update({"client_id": "{{CLIENT_ID}}", "ip_address": "{{CLIENT_IP}}"})
+            _write_json(variants_dir / "root" / "templates" / f"template_{template_index}.json", template)
+        for test_index in range(fleet["test_files"]):
+            _write_json(variants_dir / "root" / "tests" / f"test_{test_index}.json", _test_file(random, fleet, device_type))
+        for variant_index in range(fleet["variants"]):
+            _write_json(variants_dir / f"variant_{variant_index}" / "variant" / "variant_file.json",
+                        _config_file(random, fleet, device_type, f"{device_type} variant {variant_index}"))
+            _write_json(variants_dir / f"variant_{variant_index}" / "tests" / "variant_test.json", _test_file(random, fleet, device_type))
+
+    site_dirs = []
+    for site_index in range(fleet["sites"]):
+        site_dir = fleet_dir / "config" / f"site_{site_index}"
+        site_cfg = {"replacements": [{"target": "{{SITE_ID}}", "value": f"site_{site_index}", "include": ["**/*.json"]}]}
+        for device_type in device_types:
+            (site_dir / device_type).mkdir(parents=True)
+            if fleet["variants"]:
+                site_cfg[f"{device_type}_variant"] = f"variant_{site_index % fleet['variants']}"
+            copies = fleet["template_copies"]
+            site_cfg[f"{device_type}_templates"] = [{
+                "path": f"templates/template_{template_index}.json",
+                "filename_pattern": {"type": "sequential", "filename_template": f"client_{template_index}_{{{{target}}}}.json",
+                                     "from": 1, "to": copies},
+                "templated_replacements": [
+                    {"target": "{{CLIENT_ID}}"},
+                    {"target": "{{CLIENT_IP}}", "list": [f"10.{site_index % 256}.{template_index}.{copy}" for copy in range(copies)]},
+                ],
+            } for template_index in range(fleet["templates"])]
+        for replacement_index in range(fleet["replacements"]):
+            replacement = {"target": f"{{{{REPLACEMENT_{replacement_index}}}}}", "value": str(random.randint(1, 5000))}
+            # some replacements only apply to one device type, like they usually do in real sites
+            if replacement_index % 3 == 0:
+                replacement["include"] = [f"{device_types[replacement_index // 3 % len(device_types)]}/**/*.json"]
+            else:
+                replacement["include"] = ["**/*.json"]
+            site_cfg["replacements"].append(replacement)
+        with open(site_dir / "variance.yml", "w") as variance_cfg:
+            safe_dump(site_cfg, variance_cfg, sort_keys=False)
+        site_dirs.append(site_dir)
+    return site_dirs
+
+def add_fleet_arguments(parser: ArgumentParser) -> None:
+    for option, default in FLEET_DEFAULTS.items():
+        parser.add_argument(f"--{option}", type=int, default=default, help=f"Fleet size option (default {default})")
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("fleet_dir", type=Path, help="Directory to generate the fleet in (replaced if it exists)")
+    add_fleet_arguments(parser)
+    args = vars(parser.parse_args())
+    fleet_dir = args.pop("fleet_dir")
+    site_dirs = generate_fleet(fleet_dir, args)
+    print(f"Generated {len(site_dirs)} sites in {fleet_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+from pathlib import Path
+from re import sub
+from src.glob_match import compile_pathspec, match_pathspec
+from src.site_config import get_invalid_keys, load_config, save_config_cache
+from src.variant_overlay import get_root_layer, get_variant_layer
+
+# kinds of tasks, in the order they run for a site
+TASK_KINDS = ["copy", "expand_templates", "replacements", "test_parsing", "write"]
+
+# sizes of the root and variant files estimated in this run
+_file_sizes = {}
+
+
+# A step of a site's build: copying or expanding the templates of one of its devices, or one of the site-wide
+# stages. Its files and bytes are estimates of what it will read or write, made before any file is touched
+class Task():
+    def __init__(self, task_id: str, kind: str, site_id: str, device_type: str = None) -> None:
+        self.task_id = task_id
+        self.kind = kind
+        self.site_id = site_id
+        self.device_type = device_type
+        self.files = 0
+        self.bytes = 0
+
+
+# Everything a site needs to be built, resolved from its variance.yml before anything is generated
+class SitePlan():
+    def __init__(self, site_dir: Path, config: dict) -> None:
+        self.site_dir = site_dir
+        self.config = config
+        # device type: variant
+        self.devices = {}
+        # every file the site is built from (relative to the working directory): the device types built from it
+        self.sources = {site_dir / "variance.yml": set()}
+        self.tasks = []
+        self.errors = []
+
+    def get_id(self) -> str:
+        return self.site_dir.name
+
+    def _add_task(self, kind: str, device_type: str = None) -> Task:
+        task_id = f"{self.get_id()}:{kind}" if device_type is None else f"{self.get_id()}:{device_type}:{kind}"
+        task = Task(task_id, kind, self.get_id(), device_type)
+        self.tasks.append(task)
+        return task
+
+
+# The sites of a run and the tasks that build them, in the order Site runs them. The tasks are only used to
+# report the plan; sites are generated from their parsed configs. Sites don't depend on each other, so they can
+# be generated in parallel
+class BuildPlan():
+    def __init__(self, sites: "list[SitePlan]") -> None:
+        self.sites = sites
+        self._dependency_index = None
+
+    def get_tasks(self) -> "list[Task]":
+        return [task for site_plan in self.sites for task in site_plan.tasks]
+
+    def get_errors(self) -> "list[str]":
+        return [f"{site_plan.get_id()}: {error}" for site_plan in self.sites for error in site_plan.errors]
+
+    # the reverse of every site's sources: each root, variant, template and config file, and the sites and
+    # device types built from it
+    def get_dependency_index(self) -> "dict[Path, dict[Path, set[str]]]":
+        if self._dependency_index is None:
+            self._dependency_index = {}
+            for site_plan in self.sites:
+                for source, device_types in site_plan.sources.items():
+                    self._dependency_index.setdefault(source, {}).setdefault(site_plan.site_dir, set()).update(device_types)
+        return self._dependency_index
+
+    # the sites that depend on any of the changed paths (relative to the working directory), with the device
+    # types affected in each; a site whose variance.yml changed depends on it with every device
+    def get_affected_devices(self, changed_paths: "set[Path]") -> "dict[Path, set[str]]":
+        dependency_index = self.get_dependency_index()
+        affected_devices = {}
+        for changed_path in changed_paths:
+            if changed_path in dependency_index:
+                for site_dir, device_types in dependency_index[changed_path].items():
+                    affected_devices.setdefault(site_dir, set()).update(device_types)
+                continue
+            # files that are not in the index yet (added, removed or listed as their directory) affect every site
+            # using the variant they are in
+            parts = changed_path.parts
+            if parts and parts[0].endswith("_variants"):
+                device_type = parts[0][:-len("_variants")]
+                for site_plan in self.sites:
+                    if device_type not in site_plan.devices:
+                        continue
+                    # root files are in every variant, and adding or removing a variant can change which one is assumed
+                    if len(parts) <= 2 or parts[1] == "root" or str(site_plan.devices[device_type]) == parts[1]:
+                        affected_devices.setdefault(site_plan.site_dir, set()).add(device_type)
+        return affected_devices
+
+    # the plan of only the given sites
+    def select_sites(self, site_dirs: "set[Path]") -> "BuildPlan":
+        return BuildPlan([site_plan for site_plan in self.sites if site_plan.site_dir in site_dirs])
+
+    # the plan of only the sites that were planned without errors
+    def select_valid_sites(self) -> "BuildPlan":
+        return BuildPlan([site_plan for site_plan in self.sites if not site_plan.errors])
+
+    # the --plan view: task counts and estimated files and bytes, per site and in total
+    def format(self) -> str:
+        tasks = self.get_tasks()
+        lines = [f"Build plan for {len(self.sites)} site(s): {len(tasks)} tasks, ~{sum(task.files for task in tasks)} files, "
+                 f"~{_format_bytes(sum(task.bytes for task in tasks))}", ""]
+        lines.append(f"{'site':<24}{'devices':>9}{'tasks':>8}{'files':>9}{'bytes':>12}")
+        for site_plan in self.sites:
+            lines.append(f"{site_plan.get_id():<24}{len(site_plan.devices):>9}{len(site_plan.tasks):>8}"
+                         f"{sum(task.files for task in site_plan.tasks):>9}{_format_bytes(sum(task.bytes for task in site_plan.tasks)):>12}")
+        lines.append("")
+        lines.append(f"{'task':<24}{'count':>9}{'files':>17}{'bytes':>12}")
+        for kind in TASK_KINDS:
+            kind_tasks = [task for task in tasks if task.kind == kind]
+            lines.append(f"{kind:<24}{len(kind_tasks):>9}{sum(task.files for task in kind_tasks):>17}"
+                         f"{_format_bytes(sum(task.bytes for task in kind_tasks)):>12}")
+        errors = self.get_errors()
+        if errors:
+            lines.append("")
+            lines.append(f"{len(errors)} error(s):")
+            lines.extend(f"  {error}" for error in errors)
+        return "\n".join(lines)
+
+
+def _format_bytes(size: int) -> str:
+    for unit in ["B", "KiB", "MiB"]:
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+def _get_size(filepath: Path) -> int:
+    if filepath not in _file_sizes:
+        try:
+            _file_sizes[filepath] = filepath.stat().st_size
+        except OSError:
+            _file_sizes[filepath] = 0
+    return _file_sizes[filepath]
+
+# the values a (validated) template entry is expanded with, one per expanded file
+def _get_template_values(site_plan: SitePlan, device_type: str, template_entry: dict) -> "range | list":
+    pattern = template_entry["filename_pattern"]
+    values = range(pattern["from"], pattern["to"] + 1) if pattern["type"] == "sequential" else pattern["list"]
+    count = len(values)
+    for templated_replacement in template_entry.get("templated_replacements", []):
+        if "list" in templated_replacement and len(templated_replacement["list"]) != count:
+            site_plan.errors.append(f"the templated replacement '{templated_replacement['target']}' of the {device_type} template "
+                                    f"'{template_entry['path']}' has {len(templated_replacement['list'])} values for {count} expanded templates")
+    return values
+
+# adds a device's copy and template tasks, and returns its planned files (relative to the device directory) and their
+# sources; the files and bytes of the tasks are only estimated when estimate is set
+def _plan_device(site_plan: SitePlan, device_type: str, variant: str, estimate: bool) -> "dict[Path, Path]":
+    device_files = {}
+    for layer in [get_root_layer(device_type)] + ([] if variant == "root" else [get_variant_layer(device_type, variant)]):
+        device_files.update(layer.files)
+    copy_task = site_plan._add_task("copy", device_type)
+    if estimate:
+        copy_task.files = len(device_files)
+        copy_task.bytes = sum(_get_size(src_path) for src_path in device_files.values())
+
+    template_entries = site_plan.config.get(f"{device_type}_templates", [])
+    if not template_entries:
+        return device_files
+    expand_task = site_plan._add_task("expand_templates", device_type)
+    for template_entry in template_entries:
+        values = _get_template_values(site_plan, device_type, template_entry)
+        template_path = Path("config") / str(template_entry["path"])
+        site_template_path = site_plan.site_dir / device_type / template_path
+        if template_path not in device_files and not site_template_path.is_file():
+            site_plan.errors.append(f"template file '{site_template_path}' DNE or is not a file")
+            continue
+        template_source = device_files.get(template_path, site_template_path)
+        site_plan.sources.setdefault(template_source, set()).add(device_type)
+        if estimate:
+            expand_task.files += len(values)
+            expand_task.bytes += _get_size(template_source) * len(values)
+            # the expanded files replace the template and are about its size
+            filename_template = template_entry["filename_pattern"]["filename_template"]
+            device_files.pop(template_path, None)
+            device_files.update((template_path.with_name(sub("{{target}}", str(value), filename_template)), template_source) for value in values)
+    return device_files
+
+# checks that the patterns of a site-wide replacement can be used; patterns left to Path.glob (see
+# compile_pathspec()) are only rejected once they are globbed
+def _check_replacement_patterns(site_plan: SitePlan, index: int, replacement_entry: dict) -> None:
+    for pattern in list(replacement_entry.get("include", [])) + list(replacement_entry.get("exclude", [])):
+        if compile_pathspec(pattern) is None:
+            try:
+                next(site_plan.site_dir.glob(pattern), None)
+            except (ValueError, NotImplementedError) as err:
+                site_plan.errors.append(f"replacements[{index}] has a pattern '{pattern}' that can't be used: {err}")
+
+# the planned files a site-wide replacement would be made in, like TargetReplacement finds them; site_files holds
+# the planned files as (path, path parts) grouped by their first part, like FileIndex groups them
+def _match_replacement_files(replacement_entry: dict, site_files: "dict[str, list[tuple[Path, tuple[str, ...]]]]") -> "set[Path]":
+    inclusions = replacement_entry.get("include", ["config/**/*.json"])
+    exclusions = list(replacement_entry.get("exclude", [])) + ["variance.yml"]
+    matches = set()
+    for patterns, add in [(inclusions, True), (exclusions, False)]:
+        for pattern in patterns:
+            pathspec = compile_pathspec(pattern)
+            if pathspec is None:
+                continue
+            if isinstance(pathspec[0], str) and pathspec[0] != "**":
+                candidates = site_files.get(pathspec[0], [])
+            else:
+                candidates = [entry for entries in site_files.values() for entry in entries]
+            pattern_matches = [path for path, path_parts in candidates if match_pathspec(pathspec, path_parts, False)]
+            if add:
+                matches.update(pattern_matches)
+            else:
+                matches.difference_update(pattern_matches)
+    return matches
+
+# plans a site's build; the files and bytes of its tasks are only estimated (for --plan) when estimate is set,
+# the rest of the plan is the same either way
+def compile_site_plan(site_dir: Path, device_types: "list[str]", estimate: bool = False) -> SitePlan:
+    config, errors = load_config(site_dir)
+    site_plan = SitePlan(site_dir, config if isinstance(config, dict) else {})
+    site_plan.errors.extend(errors)
+    if not isinstance(config, dict):
+        return site_plan
+    # the rest of the plan relies on the config matching the schema, so keys with errors are left out of it
+    invalid_keys = get_invalid_keys(errors)
+
+    site_files = {}
+    for device_dir in sorted(site_dir.iterdir()):
+        if device_dir.name not in device_types:
+            continue
+        device_type = device_dir.name
+        if f"{device_type}_variant" in invalid_keys or f"{device_type}_templates" in invalid_keys:
+            continue
+        variants_dir = Path(f"{device_type}_variants")
+        if not variants_dir.is_dir():
+            site_plan.errors.append(f"the {variants_dir} dir of '{device_type}' does not exist")
+            continue
+        if f"{device_type}_variant" in config:
+            variant = config[f"{device_type}_variant"]
+        elif len(list(variants_dir.iterdir())) == 1:
+            variant = "root"
+        else:
+            site_plan.errors.append(f"{site_plan.get_id()}'s {device_type} has variants, but no variant key was found")
+            continue
+        if not (variants_dir / str(variant)).exists():
+            site_plan.errors.append(f"'{device_type}' is not a valid variant: the {variants_dir / str(variant)} dir does not exist")
+            continue
+        site_plan.devices[device_type] = variant
+        try:
+            device_files = _plan_device(site_plan, device_type, variant, estimate)
+        except NotADirectoryError as err:
+            site_plan.errors.append(str(err))
+            continue
+        if estimate:
+            site_files.update((Path(device_type) / path, src_path) for path, src_path in device_files.items())
+        for src_path in device_files.values():
+            site_plan.sources.setdefault(src_path, set()).add(device_type)
+        site_plan.sources[site_dir / "variance.yml"].add(device_type)
+
+    replacements_task = None
+    replacement_entries = config.get("replacements", [])
+    if replacement_entries and "replacements" not in invalid_keys:
+        replacements_task = site_plan._add_task("replacements")
+        for index, replacement_entry in enumerate(replacement_entries):
+            _check_replacement_patterns(site_plan, index, replacement_entry)
+    test_parsing_task = site_plan._add_task("test_parsing")
+    write_task = site_plan._add_task("write")
+    if not estimate:
+        return site_plan
+
+    site_files_by_first_part = {}
+    for path in site_files:
+        site_files_by_first_part.setdefault(path.parts[0], []).append((path, path.parts))
+    if replacements_task is not None:
+        replaced_files = set()
+        for replacement_entry in replacement_entries:
+            replaced_files.update(_match_replacement_files(replacement_entry, site_files_by_first_part))
+        replacements_task.files = len(replaced_files)
+        replacements_task.bytes = sum(_get_size(site_files[path]) for path in replaced_files)
+    test_files = [path for path in site_files if len(path.parts) > 1 and path.parts[1] == "tests"]
+    test_parsing_task.files = len(test_files)
+    test_parsing_task.bytes = sum(_get_size(site_files[path]) for path in test_files)
+    write_task.files = len(site_files)
+    write_task.bytes = sum(_get_size(src_path) for src_path in site_files.values())
+    return site_plan
+
+# loads every site's variance.yml and plans its build before any file is touched; estimating the files and bytes
+# of every task takes far longer than the rest of the plan, so it is only done when estimate is set
+def compile_plan(site_dirs: "list[Path]", device_types: "list[str]", estimate: bool = False) -> BuildPlan:
+    # files may have changed since the last plan (e.g. in watch mode)
+    _file_sizes.clear()
+    plan = BuildPlan([compile_site_plan(site_dir, device_types, estimate) for site_dir in site_dirs])
+    # the next run only parses the configs that changed
+    save_config_cache()
+    return plan
@@ -0,0 +1,479 @@
+from src.device import Device
+from src.site_obj import Site
+from src.manifest import Manifest, clear_file_caches
+from src.staging import LINK_MODES, StagingTree, wait_for_removals
+from src.report import SiteReport, timed, write_report
+from src.json_stream import DuplicateKeyError, transform_json_stream
+from src.variant_overlay import clear_layers, get_source_scans, get_source_texts
+from src.build_plan import BuildPlan, compile_plan
+from src.watcher import DEFAULT_DEBOUNCE, DEFAULT_POLL_INTERVAL, PollingWatcher, Watcher, create_watcher
+from pathlib import Path
+from json import load, loads, dumps
+from functools import partial
+from argparse import ArgumentParser
+from os import cpu_count
+from os.path import relpath
+from time import perf_counter
+from sys import exit
+from src.logger import logger, log_levels, RecordCollector, set_console_level, set_file_logging
+
+
+# Support for multiple types of ESS/Site Controller/TWINS devices
+FLEXGEN_DEVICES = ["twins", "ess-controller", "site-controller", "fleet-manager", "powercloud"]
+# test files at least this big (in MiB) are streamed through expression parsing instead of loaded whole
+DEFAULT_STREAM_THRESHOLD = 8
+# how many files each site reads or writes at the same time
+DEFAULT_IO_WORKERS = 8
+
+
+# parses numerical expressions in a test file while streaming it into its output file
+def stream_testfile(current_site: Site, testfile: Path, check_wildcards: bool, open_source, dest_file) -> None:
+    testfile_parsing_walker = partial(current_site.testfile_parsing_walker, check_wildcards=check_wildcards)
+    try:
+        try:
+            with open_source() as json_file:
+                transform_json_stream(json_file, dest_file, testfile_parsing_walker)
+        except DuplicateKeyError as dke:
+            # load() keeps the last value of a repeated key, which needs the whole file in memory
+            logger.info(f"   >>> '{testfile.name}' has a {dke}, parsing it in memory instead")
+            dest_file.seek(0)
+            dest_file.truncate()
+            with open_source() as json_file:
+                dest_file.write(dumps(testfile_parsing_walker(load(json_file)), indent=4))
+    except IOError as ioe:
+        logger.critical(f"unable to read testfile '{testfile.name}: {ioe}")
+        exit(1)
+    logger.info("   >>> Finished parsing numerical expressions in '%s'", testfile.name)
+
+
+# parses the numerical expressions leftover from replacements in every test file of the given test directories;
+# test files of at least stream_threshold bytes are streamed when the site's staging tree is flushed
+def parse_testfiles(current_site: Site, site_test_dirs: "list[Path]", stream_threshold: int) -> None:
+    site_staging = current_site.staging
+    testfiles_by_dir = {test_dir: site_staging.iterdir(test_dir) for test_dir in site_test_dirs}
+    # big test files are parsed while they are written so they are never held in memory whole
+    streamed_testfiles = set(testfile for testfiles in testfiles_by_dir.values() for testfile in testfiles
+                             if site_staging.is_file(testfile) and site_staging.get_size(testfile) >= stream_threshold)
+    site_staging.prefetch([testfile for testfiles in testfiles_by_dir.values() for testfile in testfiles
+                           if testfile not in streamed_testfiles], encoding='utf-8')
+    for test_dir, testfiles in testfiles_by_dir.items():
+        logger.debug("   Iterating through %s tests for '%s'...", test_dir.parent, current_site.get_id())
+        for testfile in testfiles:
+            # parses numerical expressions in test files leftover from replacements
+            logger.debug("  >>> Parsing numerical expressions in '%s'...", testfile.name)
+            # files whose scan found no '{{...}}' tokens (nor escapes that could spell one) have no wildcards left
+            testfile_scan = site_staging.get_scan(testfile, encoding='utf-8')
+            check_wildcards = testfile_scan is None or bool(testfile_scan.tokens) or testfile_scan.escaped
+            if testfile in streamed_testfiles:
+                site_staging.transform(testfile, partial(stream_testfile, current_site, testfile, check_wildcards), encoding='utf-8')
+                continue
+            try:
+                json_file = site_staging.read(testfile, encoding='utf-8')
+                file_contents_json = loads(json_file)
+            except IOError as ioe:
+                logger.critical(f"unable to read testfile '{testfile.name}: {ioe}")
+                exit(1)
+            parsed_file_contents = current_site.testfile_parsing_walker(file_contents_json, check_wildcards)
+            new_json_file = dumps(parsed_file_contents, indent=4)
+            # overwrites file with parsed file contents
+            if new_json_file != json_file:
+                site_staging.write(testfile, new_json_file)
+            logger.info("   >>> Finished parsing numerical expressions in '%s'", testfile.name)
+
+# generates a site, returning its stage timings and I/O counters; site_config is the site's variance.yml
+# as it was loaded when the run was planned, and is read again if not given
+def process_site(site_dir: Path, options: "dict | None" = None, site_config: dict = None) -> dict:
+    site_report = SiteReport(site_dir.name)
+    start = perf_counter()
+    generate_site(site_dir, options or {}, site_report, site_config)
+    site_report.wall_seconds = perf_counter() - start
+    return site_report.to_dict()
+
+def generate_site(site_dir: Path, options: dict, site_report: SiteReport, site_config: dict = None) -> None:
+    force = options.get("force", False)
+    stream_threshold = options.get("stream_threshold", DEFAULT_STREAM_THRESHOLD) * 1024 * 1024
+    # creates a Site obj
+    logger.info(f"\n\n                                   ------{site_dir.name}------\n")
+    current_site = Site(site_dir.name)
+    current_site_id = current_site.get_id()
+    # every generated file is built in memory and written once at the end
+    site_staging = StagingTree(options.get("link_mode", "copy"), options.get("io_workers", DEFAULT_IO_WORKERS), get_source_texts(),
+                               get_source_scans())
+    current_site.staging = site_staging
+    if site_config is None:
+        logger.debug(f"  Retrieving {current_site_id}'s config file...")
+        site_config = current_site.get_config_file()
+    site_variant_cfg = site_config
+    manifest = Manifest(current_site.get_directory())
+    manifest.hash_config_file()
+
+    site_test_dirs = []
+    built_devices = []
+    unchanged_device_dirs = []
+    # iterates over devices found in site
+    for device_dir in site_dir.iterdir():
+        if device_dir.name not in FLEXGEN_DEVICES:
+            if device_dir.is_dir():
+                logger.warning(f"'{device_dir.name}' is not a valid device type")
+            continue
+        current_device = Device(device_dir.name, site_dir.name)
+        current_device.staging = site_staging
+        current_device.report = site_report
+        site_report.add_device(device_dir.name)
+        current_site.devices.append(current_device)
+        current_device_type = current_device.get_type()
+
+        # finds the appropriate variant device dir for current device
+        variant_device_dir = Path(f"{current_device_type}_variants")
+
+        # checks that device with no variants corresponds to a device variant folder with
+        # ONLY a root directory
+        if f"{device_dir.name}_variant" not in site_variant_cfg.keys():
+            list_of_variants = list(variant_device_dir.iterdir())
+            if len(list_of_variants) == 1:
+                logger.warning(f"Assuming a root configuration for {current_site_id}'s {current_device_type}")
+            else:
+                logger.critical(f"{current_site_id}'s {current_device_type} has variants, but no variant key was found")
+                exit(1)
+        else:
+            current_device.variant = site_variant_cfg[f"{current_device_type}_variant"]
+
+        # skips devices whose variant files, config and link mode haven't changed since they were last generated
+        inputs_hash = manifest.hash_device_inputs(current_device_type, current_device.variant, site_variant_cfg,
+                                                  options.get("link_mode", "copy"))
+        if not force and manifest.is_device_unchanged(device_dir, inputs_hash):
+            logger.info(f"   No changes to {current_site_id}'s {current_device_type} since it was last generated")
+            manifest.keep_device(current_device_type)
+            site_report.skip_device(current_device_type)
+            unchanged_device_dirs.append(device_dir)
+            continue
+        manifest.discard()
+        with timed(site_report, "clear", current_device_type):
+            current_device.clear_prev_files(None if force else manifest.get_generated_files(current_device_type))
+            # the device's output directories are built next to them and swapped in once complete, so anything
+            # reading them never sees them half written
+            if not options.get("in_place", False):
+                for output_dir in [device_dir / "config", device_dir / "tests"]:
+                    site_staging.swap_dir(output_dir)
+        # files already in the device directory that Variance did not generate are not tracked as outputs
+        untracked_files = set(current_device.get_output_files())
+        built_devices.append((current_device, inputs_hash, untracked_files))
+
+        current_device.copy_all_files()
+
+        # runs templating first because there may be site-wide replacements in the templates
+        if f"{current_device_type}_templates" in site_variant_cfg.keys():
+            current_device.templates = site_variant_cfg[f"{current_device_type}_templates"]
+            logger.debug(f"  >>> Expanding templates in {current_device.get_directory()}...")
+            with timed(site_report, "expand_templates", current_device_type):
+                current_device.expand_templates()
+
+        device_test_dir = device_dir / "tests"
+        if site_staging.is_dir(device_test_dir):
+            site_test_dirs.append(device_test_dir)
+        else:
+            logger.info(f"   Found no tests for {current_site_id}'s {current_device_type}")
+
+    if not built_devices and manifest.is_config_unchanged() and not force:
+        logger.info(f"   No changes to {current_site_id} since it was last generated")
+        site_report.skipped = True
+        return
+
+    if "replacements" in site_variant_cfg.keys():
+        logger.debug(f"  Making replacements for {current_site_id}...")
+        with timed(site_report, "replacements"):
+            current_site.set_replacements(site_variant_cfg["replacements"])
+            current_site.exclude_from_replacements(unchanged_device_dirs)
+            current_site.replace_all_targets()
+        logger.info(f"   Finished making replacements for {current_site_id}")
+
+    # iterates through ever test file to parse numerical expressions leftover from replacements
+    with timed(site_report, "test_parsing"):
+        parse_testfiles(current_site, site_test_dirs, stream_threshold)
+
+    logger.debug(f"  Writing generated files for {current_site_id}...")
+    # streamed test files are parsed while they are written, so their parsing time is part of this stage
+    with timed(site_report, "write"):
+        site_staging.flush()
+    site_report.count(site_staging.counters)
+    for built_device, _, _ in built_devices:
+        site_report.count({"substitutions": built_device.substitutions})
+        site_report.unmatched_replacements.extend(built_device.unmatched_replacements)
+    for replacement in current_site.get_replacements():
+        site_report.count({"substitutions": replacement.substitutions})
+        if not replacement.substitutions:
+            site_report.unmatched_replacements.append(replacement.get_target())
+
+    for built_device, inputs_hash, untracked_files in built_devices:
+        outputs = [output for output in built_device.get_output_files() if output not in untracked_files]
+        manifest.record_device(built_device.get_type(), inputs_hash, outputs)
+    manifest.save()
+
+# Runs in each worker process: keeps the site's log records so the main process can emit them together
+def _init_site_worker(level: int) -> None:
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(RecordCollector())
+    # only keeps the records the main process would emit
+    logger.setLevel(level)
+
+# generates a site like process_site(), returning None instead of raising if it fails so the other sites still run
+def _try_process_site(site_dir: Path, options: dict, site_config: dict) -> "dict | None":
+    try:
+        return process_site(site_dir, options, site_config)
+    except SystemExit:
+        # the site has already logged why it stopped
+        pass
+    except Exception:
+        logger.critical(f"failed to generate '{site_dir.name}'", exc_info=True)
+    return None
+
+def _process_site_job(site_dir: Path, options: dict, site_config: dict) -> "tuple[dict | None, list]":
+    collector = logger.handlers[0]
+    site_report = _try_process_site(site_dir, options, site_config)
+    return site_report, collector.get_records()
+
+def print_site_header(site_dir: Path, log_level: str) -> None:
+    if log_level != "debug" and log_level != "info":
+        print(f"\n\n------{site_dir.name}------\n")
+
+# runs the plan's sites, which don't depend on each other, one at a time or on jobs worker processes;
+# returns the names of the sites that failed and the report of every site
+def run_sites(plan: BuildPlan, log_level: str, jobs: int, options: "dict | None" = None) -> "tuple[list[str], list[dict]]":
+    options = options or {}
+    failed_sites = []
+    site_reports = []
+    if jobs == 1:
+        for site_plan in plan.sites:
+            print_site_header(site_plan.site_dir, log_level)
+            site_report = _try_process_site(site_plan.site_dir, options, site_plan.config)
+            if site_report is None:
+                failed_sites.append(site_plan.get_id())
+                site_report = {"site": site_plan.get_id(), "failed": True}
+            site_reports.append(site_report)
+        return failed_sites, site_reports
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_site_worker, initargs=(logger.level,)) as executor:
+        site_jobs = [(site_plan.site_dir, executor.submit(_process_site_job, site_plan.site_dir, options, site_plan.config))
+                     for site_plan in plan.sites]
+        # emits each site's output as one block, in the same order as a serial run
+        for site_dir, site_job in site_jobs:
+            site_report, records = site_job.result()
+            print_site_header(site_dir, log_level)
+            for record in records:
+                logger.handle(record)
+            if site_report is None:
+                failed_sites.append(site_dir.name)
+                site_report = {"site": site_dir.name, "failed": True}
+            site_reports.append(site_report)
+    return failed_sites, site_reports
+
+def get_site_dirs() -> "list[Path]":
+    return [site_dir for site_dir in Path("./config").iterdir() if site_dir.is_dir()]
+
+# the paths (relative to the working directory) changed in the working tree since the given git revision,
+# including files that were removed or aren't tracked yet
+def get_changed_paths(revision: str) -> "set[Path]":
+    from subprocess import CalledProcessError, run
+    changed_paths = set()
+    for git_args in [["diff", "--name-only", "--relative", "--no-renames", revision, "--"], ["ls-files", "--others", "--exclude-standard"]]:
+        try:
+            git_output = run(["git"] + git_args, capture_output=True, text=True, check=True).stdout
+        except (OSError, CalledProcessError) as err:
+            logger.critical(f"unable to get the files changed since '{revision}' from git: {(getattr(err, 'stderr', '') or str(err)).strip()}")
+            exit(1)
+        changed_paths.update(Path(changed_path) for changed_path in git_output.splitlines() if changed_path)
+    return changed_paths
+
+# the --validate view: every error in every site, found without touching any generated file
+def print_validation(plan: BuildPlan, seconds: float) -> None:
+    errors = plan.get_errors()
+    for error in errors:
+        print(error)
+    print(f"Checked {len(plan.sites)} site(s) against their variant directories and template files in {seconds:.2f}s: "
+          f"{f'{len(errors)} error(s)' if errors else 'no errors'} found")
+
+# prints the sites and devices that depend on any of the given paths
+def print_impact(plan: BuildPlan, paths: "list[str]") -> None:
+    affected_devices = plan.get_affected_devices(set(Path(relpath(changed_path)) for changed_path in paths))
+    if not affected_devices:
+        print("No site depends on the given paths")
+        return
+    for site_plan in plan.sites:
+        if site_plan.site_dir in affected_devices:
+            print(f"{site_plan.get_id()}: {', '.join(sorted(affected_devices[site_plan.site_dir])) or 'config'}")
+    print(f"{len(affected_devices)} of {len(plan.sites)} site(s) affected")
+
+# watches the root/variant directories, the config directory (for sites being added or removed) and each site
+# directory (for its variance.yml; Variance's own output in it doesn't matter)
+def create_site_watcher(site_dirs: "list[Path]", options: dict) -> Watcher:
+    variant_dirs = [Path(f"{device_type}_variants") for device_type in FLEXGEN_DEVICES if Path(f"{device_type}_variants").is_dir()]
+    poll_interval = options.get("poll_interval", DEFAULT_POLL_INTERVAL)
+    if options.get("poll"):
+        return PollingWatcher(variant_dirs, [Path("config")] + site_dirs, poll_interval)
+    return create_watcher(variant_dirs, [Path("config")] + site_dirs, poll_interval)
+
+# logs every error found planning the sites, returning the names of the sites that have any; nothing is
+# generated if there are any, unless keep_going is set, in which case only those sites are left out like
+# sites that fail while they are generated
+def log_plan_errors(plan: BuildPlan, keep_going: bool) -> "list[str]":
+    errors = plan.get_errors()
+    for error in errors:
+        logger.critical(error)
+    failed_sites = [site_plan.get_id() for site_plan in plan.sites if site_plan.errors]
+    if failed_sites and keep_going:
+        logger.critical(f"Found {len(errors)} error(s) in the configs of {len(failed_sites)} site(s), which won't be generated: "
+                        f"{', '.join(failed_sites)}")
+    elif failed_sites:
+        logger.critical(f"Found {len(errors)} error(s) in the configs of {len(failed_sites)} site(s): {', '.join(failed_sites)}; "
+                        f"no site was generated (--keep_going generates the other sites)")
+    return failed_sites
+
+# generates the plan's sites, logging what went wrong instead of exiting so watching can go on
+def regenerate_sites(plan: BuildPlan, log_level: str, jobs: int, options: dict) -> None:
+    plan_failed_sites = log_plan_errors(plan, options.get("keep_going", False))
+    if plan_failed_sites and not options.get("keep_going", False):
+        return
+    try:
+        failed_sites, _ = run_sites(plan.select_valid_sites(), log_level, jobs, options)
+    except (Exception, SystemExit):
+        logger.critical("failed to regenerate the changed sites", exc_info=True)
+        return
+    finally:
+        wait_for_removals()
+    failed_sites = plan_failed_sites + failed_sites
+    if failed_sites:
+        logger.critical(f"Failed to generate {len(failed_sites)} site(s): {', '.join(failed_sites)}")
+        return
+    print("Finished!")
+
+# generates every site, then regenerates the sites that depend on a root/variant file or site config every time
+# one changes, until interrupted
+def watch_sites(log_level: str, jobs: int, options: dict) -> None:
+    site_dirs = get_site_dirs()
+    plan = compile_plan(site_dirs, FLEXGEN_DEVICES)
+    watcher = create_site_watcher(site_dirs, options)
+    try:
+        regenerate_sites(plan, log_level, jobs, options)
+        print("Watching for changes...")
+        while True:
+            changed_paths = watcher.wait_for_changes(options.get("debounce", DEFAULT_DEBOUNCE))
+            new_site_dirs = get_site_dirs()
+            if changed_paths is None:
+                affected_sites = new_site_dirs
+            else:
+                affected_devices = plan.get_affected_devices(changed_paths)
+                for site_dir, device_types in affected_devices.items():
+                    logger.info(f"   {site_dir.name}'s {', '.join(sorted(device_types)) or 'config'} depends on the changed files")
+                affected_sites = [site_dir for site_dir in new_site_dirs if site_dir in affected_devices or site_dir not in site_dirs]
+            if set(new_site_dirs) != set(site_dirs):
+                watcher.close()
+                watcher = create_site_watcher(new_site_dirs, options)
+                site_dirs = new_site_dirs
+            if not affected_sites:
+                logger.debug("   Nothing depends on the changed files")
+                continue
+
+            # root and variant files read for earlier builds may be out of date
+            clear_layers()
+            clear_file_caches()
+            # only the affected sites are planned again; unchanged devices in them are skipped as usual
+            rebuild_plan = compile_plan(affected_sites, FLEXGEN_DEVICES)
+            site_plans = {site_plan.site_dir: site_plan for site_plan in plan.sites + rebuild_plan.sites}
+            plan = BuildPlan([site_plans[site_dir] for site_dir in site_dirs if site_dir in site_plans])
+            print(f"Regenerating {len(affected_sites)} site(s): {', '.join(site_dir.name for site_dir in affected_sites)}")
+            regenerate_sites(rebuild_plan, log_level, jobs, options)
+            print("Watching for changes...")
+    except KeyboardInterrupt:
+        print("Stopped watching")
+    finally:
+        watcher.close()
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("-l", "--log_level", default="warning", help="What level of logs to print to console")
+    parser.add_argument("--log_file", type=Path, default=Path("variance.log"), help="File to write logs to")
+    parser.add_argument("--file_log_level", default="debug", help="What level of logs to write to the log file")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="How many sites to generate in parallel (0 uses every CPU)")
+    parser.add_argument("-f", "--force", action="store_true", help="Regenerate every site even if its inputs have not changed")
+    parser.add_argument("--keep_going", action="store_true",
+                        help="Generates the sites without config errors instead of stopping before any site is generated")
+    parser.add_argument("--stream_threshold", type=float, default=DEFAULT_STREAM_THRESHOLD,
+                        help="Size in MiB from which test files are streamed through expression parsing (0 streams every test file)")
+    parser.add_argument("--link_mode", choices=LINK_MODES, default="copy",
+                        help="How files that are not modified for a site are put in its device directories")
+    parser.add_argument("--in_place", action="store_true",
+                        help="Writes into device directories directly instead of building each one next to it and swapping it in")
+    parser.add_argument("--io_workers", type=int, default=DEFAULT_IO_WORKERS,
+                        help="How many files each site reads or writes at the same time (1 does all file I/O one file at a time)")
+    parser.add_argument("--validate", action="store_true",
+                        help="Checks every site's config against the variant directories and template files without generating anything")
+    parser.add_argument("--plan", action="store_true",
+                        help="Prints the tasks and estimated files and bytes of every site without generating anything")
+    parser.add_argument("--report", type=Path, help="Writes the time spent in each stage and I/O counters of every site to this JSON file")
+    parser.add_argument("--changed_since", metavar="REVISION",
+                        help="Only generates the sites that depend on files changed since this git revision")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    watch_parser = commands.add_parser("watch", help="Regenerates the sites that depend on a root/variant file or variance.yml whenever one changes")
+    watch_parser.add_argument("--debounce", type=float, default=DEFAULT_DEBOUNCE,
+                              help="Seconds without changes to wait for before regenerating, so a burst of saves is regenerated once")
+    watch_parser.add_argument("--poll", action="store_true", help="Polls for changes instead of using inotify")
+    watch_parser.add_argument("--poll_interval", type=float, default=DEFAULT_POLL_INTERVAL, help="Seconds between polls for changes")
+    impact_parser = commands.add_parser("impact", help="Lists the sites and devices that depend on the given files or directories")
+    impact_parser.add_argument("paths", nargs="+", help="Root, variant, template or variance.yml files or directories")
+    args = vars(parser.parse_args())
+    log_level = args["log_level"]
+    ## sets logging level of console logger
+    if log_level in log_levels:
+        set_console_level(log_levels[log_level])
+    else:
+        print(f"'{log_level}' is not a valid log level; console logging will be set to WARNING")
+    ## sets the log file and logging level of the file logger
+    file_log_level = args["file_log_level"]
+    if file_log_level not in log_levels:
+        print(f"'{file_log_level}' is not a valid log level; file logging will be set to DEBUG")
+        file_log_level = "debug"
+    set_file_logging(args["log_file"], log_levels[file_log_level])
+    jobs = args["jobs"] or cpu_count()
+
+    # Main code
+    if args["command"] == "watch":
+        watch_sites(log_level, jobs, args)
+        return
+    start = perf_counter()
+    # every site's config is loaded and checked before any file is touched
+    plan = compile_plan(get_site_dirs(), FLEXGEN_DEVICES, estimate=args["plan"])
+    if args["command"] == "impact":
+        print_impact(plan, args["paths"])
+        return
+    if args["validate"]:
+        print_validation(plan, perf_counter() - start)
+        exit(1 if plan.get_errors() else 0)
+    if args["changed_since"] is not None:
+        affected_devices = plan.get_affected_devices(get_changed_paths(args["changed_since"]))
+        logger.info(f"{len(affected_devices)} of {len(plan.sites)} site(s) depend on files changed since {args['changed_since']}")
+        plan = plan.select_sites(set(affected_devices))
+    if args["plan"]:
+        print(plan.format())
+        exit(1 if plan.get_errors() else 0)
+    plan_failed_sites = log_plan_errors(plan, args["keep_going"])
+    if plan_failed_sites and not args["keep_going"]:
+        exit(1)
+    try:
+        failed_sites, site_reports = run_sites(plan.select_valid_sites(), log_level, jobs, args)
+    finally:
+        # old device directories are deleted in the background while later sites are generated
+        wait_for_removals()
+    failed_sites = plan_failed_sites + failed_sites
+    site_reports.extend({"site": site_id, "failed": True} for site_id in plan_failed_sites)
+    if args["report"] is not None:
+        write_report(args["report"], site_reports, perf_counter() - start, jobs)
+    if failed_sites:
+        logger.critical(f"Failed to generate {len(failed_sites)} site(s): {', '.join(failed_sites)}")
+        exit(1)
+    print("Finished!")
+
+
+if __name__ == "__main__":
+    main()
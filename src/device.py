@@ -1,8 +1,16 @@
 from src.logger import logger
 from pathlib import Path
-from shutil import copy2, copytree, move, rmtree
 from re import sub
 from src.replacement import TemplatedReplacement
+from src.replacement_engine import is_literal_target
+from src.staging import StagingTree, staged
+from src.report import SiteReport, timed
+from src.variant_overlay import get_root_layer, get_variant_layer
+
+# files rendered from templates in this run, by template contents and templated replacements, so sites with the
+# same template entries reuse them; the oldest renders are dropped once there are more than RENDER_CACHE_SIZE
+RENDER_CACHE_SIZE = 32
+_render_cache = {}
 
 
 class Device():
@@ -11,6 +19,13 @@ class Device():
         self.templates = []
         self.variant = variant
         self._directory = Path(f"./config/{site}/{self._type}")
+        # when set, generated files are kept in memory until the staging tree is flushed
+        self.staging: StagingTree = None
+        # when set, the time spent copying files is added to the site's report
+        self.report: SiteReport = None
+        # how many templated replacements were made while expanding templates, and the targets that were never found
+        self.substitutions = 0
+        self.unmatched_replacements = []
     
     def get_type(self) -> str:
         return self._type
@@ -18,34 +33,63 @@ class Device():
     def get_directory(self) -> Path:
         return self._directory
     
-    def clear_prev_files(self):
+    def clear_prev_files(self, generated_files: "list[str]" = None):
+        # with a staging tree, files are only removed when it is flushed, and only if they aren't generated again
+        with staged(self.staging) as staging:
+            self._clear_prev_files(staging, generated_files)
+
+    def _clear_prev_files(self, staging: StagingTree, generated_files: "list[str]" = None):
+        # only removes the files Variance generated last time when they are known
+        if generated_files is not None:
+            self._remove_generated_files(staging, generated_files)
+            return
         cfg_dir = self._directory / "config"
         test_dir = self._directory / "tests"
         # removes config files
         if cfg_dir.exists():
-            rmtree(cfg_dir)
+            staging.remove_tree(cfg_dir)
             logger.info(f"\n                                   Old {self._directory.name} config files successfully removed")
         else:
             logger.info(f"\n                                   No old config files in '{self._directory.name}/config' to remove")
         # removes test files
         if test_dir.exists():
-            rmtree(test_dir)
+            staging.remove_tree(test_dir)
             logger.info(f"   Old {self._directory.name} test files successfully removed")
         else:
             logger.info(f"   No old test files in '{self._directory.name}/test' to remove")
+
+    def _remove_generated_files(self, staging: StagingTree, generated_files: "list[str]") -> None:
+        removed_dirs = set()
+        for generated_file in generated_files:
+            generated_filepath = self._directory / generated_file
+            staging.remove(generated_filepath)
+            removed_dirs.update(parent for parent in generated_filepath.parents if self._directory in parent.parents)
+        # removes directories left empty, deepest first
+        for removed_dir in sorted(removed_dirs, key=lambda path: len(path.parts), reverse=True):
+            if staging.is_dir(removed_dir) and not staging.iterdir(removed_dir):
+                staging.remove_dir(removed_dir)
+        logger.info(f"\n                                   Old {self._directory.name} generated files successfully removed")
+
+    # lists every file currently in the device's 'config' and 'tests' directories, relative to the device directory
+    def get_output_files(self) -> "list[str]":
+        output_files = []
+        for output_dir in [self._directory / "config", self._directory / "tests"]:
+            for output_filepath in output_dir.rglob("*"):
+                # files waiting to be removed when the staging tree is flushed aren't outputs anymore
+                if self.staging is not None and self.staging.is_removed(output_filepath):
+                    continue
+                if output_filepath.is_file():
+                    output_files.append(output_filepath.relative_to(self._directory).as_posix())
+        return output_files
     
     def _copy_root_files(self)-> None:
-        # moves all root device files to device config directory
-        dest_cfg_dir = self._directory / "config"
-        device_root_dir = Path(f"./{self._type}_variants/root")
-        copytree(device_root_dir, dest_cfg_dir, dirs_exist_ok=True)
-        
-        # moves 'tests' folder in 'config' (if present) to same level as 'config'
-        cfg_test_dir = dest_cfg_dir / "tests"
-        if cfg_test_dir.exists():
-            logger.debug(f"     >>> Found tests in root files, moving out of '{cfg_test_dir}")
-            dest_test_dir = self._directory / "tests"
-            move(cfg_test_dir, dest_test_dir)
+        # copies all root device files to device config directory, with the 'tests' folder (if present) on the
+        # same level as 'config'; the listing is shared by every site with this device type
+        root_layer = get_root_layer(self._type)
+        if root_layer.has_tests:
+            logger.debug(f"     >>> Found tests in root files, moving out of '{self._directory / 'config' / 'tests'}")
+        with staged(self.staging) as staging:
+            staging.copy_files(self._directory, root_layer.files, root_layer.dirs, shared=True)
     
     def _copy_variant_files(self)-> None:
         variant_dir = Path(f"./{self._type}_variants/{self.variant}")  
@@ -57,27 +101,55 @@ class Device():
             # No variant key found so only root structure needed
             return
         
-        variant_sub_dirs = variant_dir.iterdir()
-        # copies contents of each variant subdirectory to the device's corresponding subdirectory
-        for sub_dir in variant_sub_dirs:        
-            # puts tests in 'tests' folder on same level as destination config folder
-            if sub_dir.name == "tests":
-                dest_sub_dir = self._directory / "tests"
-                logger.debug(f"     >>> Found tests in variant files, moving all files to '{dest_sub_dir}'")
-            else: 
-                dest_sub_dir = self._directory / "config" / sub_dir.name
-            copytree(sub_dir, dest_sub_dir, dirs_exist_ok=True)
+        # copies contents of each variant subdirectory to the device's corresponding subdirectory, with tests in
+        # the 'tests' folder on same level as the config folder; the listing is shared by every site with this variant
+        variant_layer = get_variant_layer(self._type, self.variant)
+        if variant_layer.has_tests:
+            logger.debug(f"     >>> Found tests in variant files, moving all files to '{self._directory / 'tests'}'")
+        with staged(self.staging) as staging:
+            staging.copy_files(self._directory, variant_layer.files, variant_layer.dirs, shared=True)
     
     # Copies files from root folder and specified variant folder
     def copy_all_files(self)-> None: 
         logger.debug("  >>> Copying over root files...")
-        self._copy_root_files()
+        with timed(self.report, "copy_root", self._type):
+            self._copy_root_files()
         logger.info("   >>> Copied over root files")        
         logger.debug(f"  >>> Copying over variant files for variant {self._type}...")
-        self._copy_variant_files()
+        with timed(self.report, "copy_variant", self._type):
+            self._copy_variant_files()
         logger.info(f"   >>> Copied over variant files for variant {self._type}")
 
     def expand_templates(self):
+        with staged(self.staging) as staging:
+            self._expand_templates(staging)
+
+    # renders the template once for each of its expanded files, or reuses the files another site rendered from the
+    # same template contents with the same targets and values
+    @staticmethod
+    def _render_template(template_contents: str, templated_replacements: "list[TemplatedReplacement]") -> "list[str]":
+        # the template contents are part of the key; shared root and variant texts are the same str for every site
+        render_key = (template_contents, tuple((replacement.get_target(), tuple(str(value) for value in replacement.values))
+                                               for replacement in templated_replacements))
+        if render_key in _render_cache:
+            rendered_files, substitutions = _render_cache[render_key]
+            logger.debug("        >>> Reused %s files rendered from the same template", len(rendered_files))
+            for replacement, replacement_substitutions in zip(templated_replacements, substitutions):
+                replacement.substitutions += replacement_substitutions
+            return rendered_files
+
+        rendered_files = []
+        for index in range(len(templated_replacements[0].values)):
+            file_contents = template_contents
+            for replacement in templated_replacements:
+                file_contents = replacement.replace_in_contents(file_contents, index)
+            rendered_files.append(file_contents)
+        if len(_render_cache) >= RENDER_CACHE_SIZE:
+            del _render_cache[next(iter(_render_cache))]
+        _render_cache[render_key] = (rendered_files, [replacement.substitutions for replacement in templated_replacements])
+        return rendered_files
+
+    def _expand_templates(self, staging: StagingTree):
         # looks for '{{target}}' in filename when expanding templates
         filename_replacement_target = "{{target}}"
         
@@ -92,11 +164,11 @@ class Device():
                 raise KeyError(ke)
             
             # validates that the template file exists
-            if not full_template_path.is_file():
+            if not staging.is_file(full_template_path):
                 raise FileNotFoundError(f"template file '{full_template_path}' DNE or is not a file")
             
             # determines the list of values to be used in templating
-            logger.debug(f"     >>> Expanding template {filename}...")
+            logger.debug("     >>> Expanding template %s...", filename)
             generated_filenames = []
             if pattern_type == "sequential":
                 try:
@@ -117,17 +189,42 @@ class Device():
             for value in values_list:
                 # generates new file name with substituted value
                 new_filename = sub(filename_replacement_target, str(value), filename)
-                # copies file with new file name in the same directory
-                new_filename_path = full_template_path.with_name(new_filename)
-                copy2(full_template_path, new_filename_path)
-                generated_filenames.append(new_filename_path)
-                logger.debug(f"        >>> Expanded template to '{new_filename_path.name}'")
-                    
+                generated_filenames.append(full_template_path.with_name(new_filename))
+                logger.debug("        >>> Expanded template to '%s'", new_filename)
+
+            templated_replacements = []
             if "templated_replacements" in template_entry.keys():
                 for templated_replacement in template_entry["templated_replacements"]:
                     replacement = TemplatedReplacement(templated_replacement, generated_filenames)
-                    replacement.process_replacements()
+                    replacement.check_values()
+                    templated_replacements.append(replacement)
+
+            replacements_to_make = templated_replacements
+            if templated_replacements:
+                templated_targets = [replacement.get_target() for replacement in templated_replacements]
+                # a template without any of its templated targets (or a binary one) expands into plain copies of itself
+                if full_template_path not in staging.find_containing({full_template_path: templated_targets
+                                                                      if all(is_literal_target(target) for target in templated_targets) else None}):
+                    logger.debug("        >>> Found none of the templated targets in %s", full_template_path.name)
+                    replacements_to_make = []
+
+            if not replacements_to_make or len(set(generated_filenames)) != len(generated_filenames):
+                # copies the template to each new file name in the same directory; a file name generated more than once
+                # gets every one of its replacements made in turn, so those are made one file at a time
+                for new_filename_path in generated_filenames:
+                    staging.copy(full_template_path, new_filename_path)
+                for replacement in replacements_to_make:
+                    replacement.process_replacements(staging)
+            else:
+                # reads the template once and renders each new file with all of its replacements in memory
+                template_contents = staging.read(full_template_path)
+                for new_filename_path, file_contents in zip(generated_filenames, self._render_template(template_contents, replacements_to_make)):
+                    staging.write(new_filename_path, file_contents)
+            for replacement in templated_replacements:
+                self.substitutions += replacement.substitutions
+                if not replacement.substitutions:
+                    self.unmatched_replacements.append(replacement.get_target())
                     
             # deletes template file after succesful expansion and replacement
-            full_template_path.unlink()
+            staging.remove(full_template_path)
             logger.info(f"      >>> Template expansion complete. Removed {full_template_path.name}")
\ No newline at end of file
@@ -0,0 +1,92 @@
+from re import Match, compile
+
+# Numerical expressions left in test files after replacements are evaluated with these patterns,
+# compiled once for the whole run. They match exactly what the original patterns matched:
+#   coefficient multiplication: [<coefficient>*]<value>                      e.g. '.75*2000'
+#   AVR droop formula:          100<+|->[<coefficient>*]<droop>[*(<poi><+|-><deadband>)]   e.g. '100-.5*5*(12000+50)'
+# The AVR coefficient used to be '\d*.\d+', which backtracks over every way of splitting a run of
+# digits; the only two ways it can end in a '*' are spelled out here, each run of digits matched atomically
+# ('(?=(\d+))\3' can't give digits back, which possessive quantifiers would need Python 3.11 for) so a failed
+# match costs a single pass over the digits
+NORMAL_EXPRESSION_PATTERN = compile(r"(?:((?:-)?(?:\d*[.])?\d+)(?:\*))?((?:\d+)(?:[.]\d+)?)")
+AVR_EXPRESSION_PATTERN = compile(r"100([+-])(?:((?=(\d*))\3[^\d\n](?=(\d+))\4|(?=(\d{2,}))\5)\*)?(\d+)(?:\*\((\d+)([+-])(\d+)\))?")
+WILDCARD_PATTERN = compile(r"{{\w+}}")
+
+
+# the sign, coefficient, droop, POI voltage, second sign and deadband voltage of an AVR match; they are the first
+# two and the last four groups, the ones in between only hold the coefficient's digits
+def get_avr_groups(match: Match) -> "tuple[str | None, ...]":
+    groups = match.groups()
+    return groups[:2] + groups[-4:]
+
+def evaluate_avr_match(match: Match) -> str:
+    # only evaluates expressions if there is a match
+    if match:
+        # first_sign and droop_percent are required in match, second_sign is required if both poi_voltage and
+        # deadband_voltage are present
+        first_sign, coefficient, droop_percent, poi_voltage, second_sign, deadband_voltage = get_avr_groups(match)
+
+        if coefficient:
+            droop_percent = float(coefficient)*float(droop_percent)
+        if first_sign == "+":
+            percentage = 100+float(droop_percent)
+        else:
+            percentage = 100-float(droop_percent)
+
+        # calculates the actual voltage command if deadband and POI voltage are provided
+        if poi_voltage != None and deadband_voltage != None:
+            if second_sign == "+":
+                voltage_sum = int(poi_voltage) + int(deadband_voltage)
+            else:
+                voltage_sum = int(poi_voltage) - int(deadband_voltage)
+            return str((percentage/100)*voltage_sum)
+
+        # only evaluates the percentage of the voltage command
+        return str(percentage)
+
+def evaluate_normal_match(match: Match) -> str:
+    if match:
+        coefficient = match.group(1)
+        variable_value = match.group(2)
+        if coefficient:
+            return str(float(coefficient) * float(variable_value))
+        else:
+            return variable_value
+
+# returns the unreplaced wildcard at the start of the string, if there is one
+def find_unreplaced_wildcard(text: str) -> "str | None":
+    # cheap check first since almost no strings start with a wildcard
+    if not text.startswith("{{"):
+        return None
+    found_wildcard = WILDCARD_PATTERN.match(text)
+    return found_wildcard.string if found_wildcard else None
+
+# evaluates the numerical expressions in a string; if the whole string was an expression, the number is returned
+def evaluate_expressions(text: str) -> "str | float":
+    # an AVR expression always contains '100', and a normal expression only changes the string
+    # when there is a coefficient, so most strings (names, IDs, paths) are returned right away
+    has_avr = "100" in text
+    if not has_avr and "*" not in text:
+        return text
+
+    obj_to_try = text
+    ## first, tries special case for AVR
+    if has_avr:
+        avr_replacement = AVR_EXPRESSION_PATTERN.sub(evaluate_avr_match, text)
+        if avr_replacement != text:
+            ## checks if the entire string was a numerical expression
+            try:
+                return float(avr_replacement)
+            except ValueError:
+                obj_to_try = avr_replacement
+
+    if "*" not in obj_to_try:
+        return obj_to_try
+    replacement = NORMAL_EXPRESSION_PATTERN.sub(evaluate_normal_match, obj_to_try)
+    if replacement != obj_to_try:
+        ## checks if the entire string was a numerical expression
+        try:
+            replacement = float(replacement)
+        except ValueError:
+            pass
+    return replacement
@@ -0,0 +1,50 @@
+from pathlib import Path
+from os import walk
+from src.glob_match import compile_pathspec, match_pathspec
+from src.staging import StagingTree, staged
+
+# Every file and directory in a site, found with one walk of the site directory (plus the files that are only
+# staged so far), so that any number of include/exclude patterns are matched without globbing the disk again.
+# The same Path objects are handed out to every pattern that matches them
+class FileIndex():
+    def __init__(self, root_dir: Path, staging: StagingTree = None) -> None:
+        self._root_dir = root_dir
+        self._staging = staging
+        self._entries = {}
+        self._matches = {}
+        for dirpath, dirnames, filenames in walk(root_dir):
+            directory = Path(dirpath)
+            directory_parts = directory.relative_to(root_dir).parts
+            self._add_entry(directory, directory_parts, True)
+            for filename in filenames:
+                self._add_entry(directory / filename, directory_parts + (filename,), False)
+        if staging is not None:
+            for path in [path for path in self._entries if staging.is_removed(path)]:
+                del self._entries[path]
+            for path, is_dir in staging.get_staged_paths(root_dir):
+                self._add_entry(path, path.relative_to(root_dir).parts, is_dir)
+        # most patterns start with a device directory, so entries are grouped by their first segment
+        self._entries_by_first_part = {}
+        for entry in self._entries.values():
+            if entry[1]:
+                self._entries_by_first_part.setdefault(entry[1][0], []).append(entry)
+
+    def _add_entry(self, path: Path, path_parts: "tuple[str, ...]", is_dir: bool) -> None:
+        if path not in self._entries:
+            self._entries[path] = (path, path_parts, is_dir)
+
+    # same results as Path.glob(pattern) from the root directory
+    def glob(self, pattern: str) -> "list[Path]":
+        if pattern not in self._matches:
+            pathspec = compile_pathspec(pattern)
+            if pathspec is None:
+                with staged(self._staging) as staging:
+                    matches = staging.glob(self._root_dir, pattern)
+            else:
+                if isinstance(pathspec[0], str) and pathspec[0] != "**":
+                    candidates = self._entries_by_first_part.get(pathspec[0], [])
+                else:
+                    candidates = self._entries.values()
+                matches = [path for path, path_parts, is_dir in candidates if match_pathspec(pathspec, path_parts, is_dir)]
+            self._matches[pattern] = matches
+        return self._matches[pattern]
@@ -0,0 +1,37 @@
+from fnmatch import translate
+from functools import lru_cache
+from re import compile
+
+# characters that make a pathspec segment a wildcard instead of a literal file or directory name
+_WILDCARD_CHARACTERS = frozenset("*?[")
+
+
+# Compiles a glob pattern (same syntax as Path.glob) into one matcher per path segment: '**', a literal name or
+# a compiled wildcard. Returns None for the patterns this can't reproduce exactly ('..' segments, a trailing '/',
+# absolute or empty patterns), which are left to Path.glob
+@lru_cache(maxsize=None)
+def compile_pathspec(pattern: str) -> "tuple | None":
+    if not pattern or pattern.startswith("/") or pattern.endswith("/"):
+        return None
+    pattern_parts = [part for part in pattern.split("/") if part not in ("", ".")]
+    if not pattern_parts or any(part == ".." or (part != "**" and "**" in part) for part in pattern_parts):
+        return None
+    return tuple(part if part == "**" or not _WILDCARD_CHARACTERS.intersection(part) else compile(translate(part))
+                 for part in pattern_parts)
+
+def match_pathspec(pathspec: tuple, path_parts: "tuple[str, ...]", is_dir: bool) -> bool:
+    if not pathspec:
+        return not path_parts
+    pattern_part = pathspec[0]
+    if pattern_part == "**":
+        # a trailing '**' only matches directories
+        if len(pathspec) == 1:
+            return is_dir
+        return any(match_pathspec(pathspec[1:], path_parts[index:], is_dir) for index in range(len(path_parts) + 1))
+    if not path_parts:
+        return False
+    if isinstance(pattern_part, str):
+        matched = pattern_part == path_parts[0]
+    else:
+        matched = pattern_part.match(path_parts[0]) is not None
+    return matched and match_pathspec(pathspec[1:], path_parts[1:], is_dir)
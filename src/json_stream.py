@@ -0,0 +1,201 @@
+from json import JSONDecodeError
+from json.decoder import scanstring
+from json.encoder import encode_basestring_ascii
+from re import compile
+from collections.abc import Callable
+from io import TextIOBase
+
+# Streams a JSON document from one text file to another, transforming every leaf value on the way,
+# so that memory use stays the same no matter how big the document is. The output is exactly what
+# dumps(transform(load(src)), indent=4) would produce for the same document.
+
+CHUNK_SIZE = 1 << 16
+INDENT = "    "
+
+_WHITESPACE = compile(r"[ \t\n\r]*")
+# same number syntax as the json module's scanner
+_NUMBER = compile(r"(-?(?:0|[1-9]\d*))(\.\d+)?([eE][-+]?\d+)?")
+_CONSTANTS = {"true": True, "false": False, "null": None, "NaN": float("nan"), "Infinity": float("inf"), "-Infinity": float("-inf")}
+_INFINITY = float("inf")
+
+
+# json.load keeps the last value of a repeated key at the position of the first one, which can't be
+# reproduced without holding the whole object in memory
+class DuplicateKeyError(ValueError):
+    pass
+
+
+def _encode_scalar(value) -> str:
+    # encodes a leaf the same way json.dumps does
+    if isinstance(value, str):
+        return encode_basestring_ascii(value)
+    if value is None:
+        return "null"
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    if isinstance(value, int):
+        return int.__repr__(value)
+    if isinstance(value, float):
+        if value != value:
+            return "NaN"
+        if value == _INFINITY:
+            return "Infinity"
+        if value == -_INFINITY:
+            return "-Infinity"
+        return float.__repr__(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class _JSONStreamReader():
+    def __init__(self, src: TextIOBase) -> None:
+        self._src = src
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+        self._read_size = CHUNK_SIZE
+
+    def _read_more(self) -> bool:
+        if self._eof:
+            return False
+        chunk = self._src.read(self._read_size)
+        if not chunk:
+            self._eof = True
+            return False
+        # drops everything already consumed so only the unread part of the document is held
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def error(self, message: str) -> JSONDecodeError:
+        return JSONDecodeError(message, self._buffer, self._pos)
+
+    # returns the next non-whitespace character without consuming it ('' at the end of the document)
+    def peek(self) -> str:
+        while True:
+            self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._read_more():
+                return ""
+
+    def expect(self, character: str) -> None:
+        if self.peek() != character:
+            raise self.error(f"Expecting '{character}' delimiter")
+        self._pos += 1
+
+    def read_string(self) -> str:
+        while True:
+            try:
+                value, end = scanstring(self._buffer, self._pos + 1)
+                break
+            except JSONDecodeError:
+                # the string may continue in the next chunk; long strings are read in bigger chunks
+                self._read_size *= 2
+                if not self._read_more():
+                    raise
+        self._read_size = CHUNK_SIZE
+        self._pos = end
+        return value
+
+    def read_scalar(self):
+        if self.peek() == '"':
+            return self.read_string()
+        # makes sure a number or constant isn't cut off at the end of the buffer
+        while len(self._buffer) - self._pos < 64 and self._read_more():
+            pass
+        number = _NUMBER.match(self._buffer, self._pos)
+        # '-Infinity' starts like a number, but is a constant
+        if number and not self._buffer.startswith("-Infinity", self._pos):
+            while number.end() == len(self._buffer) and self._read_more():
+                number = _NUMBER.match(self._buffer, self._pos)
+            self._pos = number.end()
+            integer, fraction, exponent = number.groups()
+            if fraction or exponent:
+                return float(integer + (fraction or "") + (exponent or ""))
+            return int(integer)
+        for constant, value in _CONSTANTS.items():
+            if self._buffer.startswith(constant, self._pos):
+                self._pos += len(constant)
+                return value
+        raise self.error("Expecting value")
+
+
+def transform_json_stream(src: TextIOBase, dest: TextIOBase, transform_leaf: Callable) -> None:
+    reader = _JSONStreamReader(src)
+    output = []
+    # one entry per open container: [closing bracket, whether it has no items yet, keys seen in an object]
+    containers = []
+
+    def write_item_prefix() -> None:
+        # starts the next item of the innermost array
+        container = containers[-1]
+        output.append(("[\n" if container[1] else ",\n") + INDENT * len(containers))
+        container[1] = False
+
+    def read_key() -> None:
+        container = containers[-1]
+        if reader.peek() != '"':
+            raise reader.error("Expecting property name enclosed in double quotes")
+        key = reader.read_string()
+        if key in container[2]:
+            raise DuplicateKeyError(f"duplicate key '{key}'")
+        container[2].add(key)
+        indent = INDENT * len(containers)
+        if container[1]:
+            output.append("{\n" + indent)
+            container[1] = False
+        else:
+            output.append(",\n" + indent)
+        output.append(encode_basestring_ascii(key) + ": ")
+        reader.expect(":")
+
+    # reads values until the top-level value is complete
+    while True:
+        next_character = reader.peek()
+        if next_character in ("{", "["):
+            reader.expect(next_character)
+            if containers and containers[-1][0] == "]":
+                write_item_prefix()
+            containers.append(["}" if next_character == "{" else "]", True, set()])
+            closing = containers[-1][0]
+            if reader.peek() == closing:
+                # empty containers are written on one line
+                reader.expect(closing)
+                containers.pop()
+                output.append("{}" if closing == "}" else "[]")
+            elif closing == "}":
+                read_key()
+                continue
+            else:
+                continue
+        else:
+            if containers and containers[-1][0] == "]":
+                write_item_prefix()
+            value = reader.read_scalar()
+            output.append(_encode_scalar(transform_leaf(value) if isinstance(value, str) else value))
+
+        # closes every container that ends after this value and moves on to the next item
+        while containers:
+            closing = containers[-1][0]
+            next_character = reader.peek()
+            if next_character == ",":
+                reader.expect(",")
+                if closing == "}":
+                    read_key()
+                break
+            if next_character != closing:
+                raise reader.error("Expecting ',' delimiter")
+            reader.expect(closing)
+            containers.pop()
+            output.append("\n" + INDENT * len(containers) + closing)
+        if len(output) > 1024:
+            dest.write("".join(output))
+            output.clear()
+        if not containers:
+            break
+
+    if reader.peek() != "":
+        raise reader.error("Extra data")
+    dest.write("".join(output))
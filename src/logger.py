@@ -1,5 +1,4 @@
 import logging
-from logging.config import fileConfig
 from pathlib import Path
 
 # Logging Setup
@@ -17,9 +16,88 @@ current_file_path = Path(__file__).resolve()
 # Goes oustide 'src' directory
 config_file_path = current_file_path.parent.parent / 'logging.conf'
 
-# Check if the config file exists
-if not config_file_path.exists():
-    raise FileNotFoundError(f"logging.conf not found at '{config_file_path}'")
+# nothing is configured until configure_logging() is called, so importing this module has no side effects
+logger = logging.getLogger()
+_console_handler = None
+_file_queue_handler = None
+_file_listener = None
 
-fileConfig(config_file_path)
-logger = logging.getLogger()
\ No newline at end of file
+
+# sets up the console and log file handlers from logging.conf; only the first call does anything
+def configure_logging() -> None:
+    global _console_handler, _file_queue_handler, _file_listener
+    if _file_queue_handler is not None:
+        return
+    from atexit import register
+    from logging.config import fileConfig
+    from logging.handlers import QueueHandler, QueueListener
+    from queue import SimpleQueue
+
+    # Hands records to the queue as they are; the message is only formatted on the background thread
+    class _RecordQueueHandler(QueueHandler):
+        def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+            return record
+
+    # Check if the config file exists
+    if not config_file_path.exists():
+        raise FileNotFoundError(f"logging.conf not found at '{config_file_path}'")
+    fileConfig(config_file_path)
+    # the file handler from logging.conf writes on a background thread so that logging never waits on the disk
+    file_handler = next(handler for handler in logger.handlers if isinstance(handler, logging.FileHandler))
+    logger.removeHandler(file_handler)
+    _file_listener = QueueListener(SimpleQueue(), file_handler, respect_handler_level=True)
+    _file_queue_handler = _RecordQueueHandler(_file_listener.queue)
+    _file_queue_handler.setLevel(file_handler.level)
+    logger.addHandler(_file_queue_handler)
+    _file_listener.start()
+    register(_file_listener.stop)
+    _console_handler = next(handler for handler in logger.handlers if handler is not _file_queue_handler)
+    _update_logger_level()
+
+# records below the level of both the console and the file are dropped by the logger before they are even created
+def _update_logger_level() -> None:
+    logger.setLevel(min(_console_handler.level, _file_queue_handler.level))
+
+# sets the level of the console logger
+def set_console_level(level: int) -> None:
+    configure_logging()
+    _console_handler.setLevel(level)
+    _update_logger_level()
+
+# writes the log file to log_filepath from now on, keeping records of at least level
+def set_file_logging(log_filepath: Path, level: int) -> None:
+    configure_logging()
+    listener = _file_listener
+    file_handler = listener.handlers[0]
+    if Path(log_filepath).resolve() != Path(file_handler.baseFilename):
+        new_file_handler = logging.FileHandler(log_filepath, "w", delay=True)
+        new_file_handler.setFormatter(file_handler.formatter)
+        # waits for the records already queued so none of them end up in the new file
+        listener.stop()
+        file_handler.close()
+        file_handler = new_file_handler
+        listener.handlers = (file_handler,)
+        listener.start()
+    file_handler.setLevel(level)
+    _file_queue_handler.setLevel(level)
+    _update_logger_level()
+
+# Holds on to log records instead of emitting them so they can be sent to another process
+class RecordCollector(logging.Handler):
+    def __init__(self) -> None:
+        super().__init__(logging.DEBUG)
+        self.records = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # formats the message and traceback now since their arguments may not be picklable
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        self.records.append(record)
+
+    def get_records(self) -> "list[logging.LogRecord]":
+        records = self.records
+        self.records = []
+        return records
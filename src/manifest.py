@@ -0,0 +1,156 @@
+from src.logger import logger
+from src.version import VARIANCE_VERSION
+from pathlib import Path
+from hashlib import sha256
+from json import JSONDecodeError, dump, dumps, load
+
+MANIFEST_FILENAME = ".variance_manifest.json"
+
+# file listings and hashes of the variant directories, shared by every site processed in this run
+_variant_files_cache = {}
+_file_hash_cache = {}
+# digest of the hashes of a device type's root and variant files, and the files, by (device type, variant)
+_variant_digest_cache = {}
+
+
+# forgets the listings and hashes of the variant files, for when they may have changed since they were hashed
+def clear_file_caches() -> None:
+    _variant_files_cache.clear()
+    _file_hash_cache.clear()
+    _variant_digest_cache.clear()
+
+
+# Records the hashes of everything a site's generated files were built from, so that devices whose
+# inputs have not changed since the last run can be skipped
+class Manifest():
+    def __init__(self, site_dir: Path) -> None:
+        self._path = site_dir / MANIFEST_FILENAME
+        self._config_filepath = site_dir / "variance.yml"
+        self.config_hash = ""
+        self.devices = {}
+        # size, mtime and hash of every input file so unchanged files don't need to be hashed again
+        self.file_stats = {}
+        # the site-wide replacements last hashed, and their hash
+        self._replacements_hash = None
+        self._previous = self._load()
+        self._previous_file_stats = self._previous.get("files", {})
+
+    def _load(self) -> dict:
+        if not self._path.is_file():
+            return {}
+        try:
+            with open(self._path, "r") as manifest_file:
+                previous = load(manifest_file)
+        except (OSError, JSONDecodeError) as err:
+            logger.warning(f"   >>> Ignoring unreadable manifest '{self._path}': {err}")
+            return {}
+        # every site is rebuilt after Variance itself changes
+        if previous.get("version") != VARIANCE_VERSION:
+            return {}
+        return previous
+
+    def get_path(self) -> Path:
+        return self._path
+
+    def hash_config_file(self) -> str:
+        if self._config_filepath.is_file():
+            self.config_hash = sha256(self._config_filepath.read_bytes()).hexdigest()
+        return self.config_hash
+
+    def is_config_unchanged(self) -> bool:
+        return self.config_hash != "" and self.config_hash == self._previous.get("config_hash")
+
+    def _hash_file(self, filepath: Path) -> str:
+        key = filepath.as_posix()
+        if key in _file_hash_cache:
+            self.file_stats[key] = _file_hash_cache[key]
+            return _file_hash_cache[key][2]
+        stat = filepath.stat()
+        previous_stat = self._previous_file_stats.get(key)
+        if previous_stat and previous_stat[0] == stat.st_size and previous_stat[1] == stat.st_mtime_ns:
+            file_hash = previous_stat[2]
+        else:
+            file_hash = sha256(filepath.read_bytes()).hexdigest()
+        _file_hash_cache[key] = [stat.st_size, stat.st_mtime_ns, file_hash]
+        self.file_stats[key] = _file_hash_cache[key]
+        return file_hash
+
+    @staticmethod
+    def _get_variant_files(variant_dir: Path) -> "list[Path]":
+        key = variant_dir.as_posix()
+        if key not in _variant_files_cache:
+            _variant_files_cache[key] = sorted(path for path in variant_dir.rglob("*") if path.is_file())
+        return _variant_files_cache[key]
+
+    # hashes the root and variant files used by the device (which include its template files), the
+    # parts of the site config that affect it, how unmodified files are put in its directories (see
+    # StagingTree) and the Variance version
+    def hash_device_inputs(self, device_type: str, variant: str, site_cfg: dict, link_mode: str = "copy") -> str:
+        # the site-wide replacements are the same for every device of the site, so they are only serialized once
+        replacements = site_cfg.get("replacements")
+        if self._replacements_hash is None or self._replacements_hash[0] is not replacements:
+            self._replacements_hash = (replacements, sha256(dumps(replacements, sort_keys=True, default=str).encode()).hexdigest())
+        device_inputs = {
+            "version": VARIANCE_VERSION,
+            "variant": variant,
+            "link_mode": link_mode,
+            "templates": site_cfg.get(f"{device_type}_templates"),
+            "replacements": self._replacements_hash[1],
+            "files": self._hash_variant_files(device_type, variant)
+        }
+        return sha256(dumps(device_inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+    # one hash of every root and variant file of the device type and variant, which every site using them shares
+    def _hash_variant_files(self, device_type: str, variant: str) -> str:
+        key = (device_type, str(variant))
+        if key not in _variant_digest_cache:
+            file_hashes = {}
+            for variant_name in dict.fromkeys(["root", variant]):
+                variant_dir = Path(f"{device_type}_variants/{variant_name}")
+                for filepath in self._get_variant_files(variant_dir):
+                    file_hashes[filepath.as_posix()] = self._hash_file(filepath)
+            _variant_digest_cache[key] = (sha256(dumps(file_hashes, sort_keys=True).encode()).hexdigest(), list(file_hashes))
+        digest, file_keys = _variant_digest_cache[key]
+        for file_key in file_keys:
+            self.file_stats[file_key] = _file_hash_cache[file_key]
+        return digest
+
+    def is_device_unchanged(self, device_dir: Path, inputs_hash: str) -> bool:
+        previous_device = self._previous.get("devices", {}).get(device_dir.name)
+        if previous_device is None or previous_device["inputs"] != inputs_hash:
+            return False
+        # the device has to be regenerated if its output directories were removed since the last run
+        # outputs are POSIX paths relative to the device directory
+        for output_dir in {output.split("/", 1)[0] for output in previous_device["outputs"]}:
+            if not (device_dir / output_dir).is_dir():
+                return False
+        return True
+
+    # files generated for the device in the previous run, relative to the device directory
+    def get_generated_files(self, device_type: str) -> "list[str] | None":
+        previous_device = self._previous.get("devices", {}).get(device_type)
+        if previous_device is None:
+            return None
+        return previous_device["outputs"]
+
+    def keep_device(self, device_type: str) -> None:
+        self.devices[device_type] = self._previous["devices"][device_type]
+
+    def record_device(self, device_type: str, inputs_hash: str, outputs: "list[str]") -> None:
+        self.devices[device_type] = {"inputs": inputs_hash, "outputs": sorted(outputs)}
+
+    # removes the manifest while a site is being regenerated so an interrupted run is never skipped
+    def discard(self) -> None:
+        self._path.unlink(missing_ok=True)
+
+    def save(self) -> None:
+        # replacements may include the config file itself, so its hash is taken again after they ran
+        self.hash_config_file()
+        manifest = {
+            "version": VARIANCE_VERSION,
+            "config_hash": self.config_hash,
+            "devices": self.devices,
+            "files": self.file_stats
+        }
+        with open(self._path, "w") as manifest_file:
+            dump(manifest, manifest_file, indent=4, sort_keys=True)
@@ -2,6 +2,8 @@ from src.logger import logger
 from abc import ABC, abstractmethod
 from pathlib import Path
 from re import compile
+from src.staging import StagingTree, staged
+from src.file_index import FileIndex
 
 # Abstract class for ContentReplacement and TargetReplacement to inherit from
 class Replacement(ABC):
@@ -13,9 +15,14 @@ class Replacement(ABC):
             raise KeyError(f"error when creating replacement object: {ke}")
         self.values = []
         self.files_to_check = []
+        # how many times the target was replaced
+        self.substitutions = 0
+
+    def get_target(self) -> str:
+        return self._target
     
     @abstractmethod
-    def process_replacements(self):
+    def process_replacements(self, staging: StagingTree = None):
         pass
 
 class TemplatedReplacement(Replacement):
@@ -28,31 +35,37 @@ class TemplatedReplacement(Replacement):
             self.values = list(range(1, len(files)+1)) 
         self.files_to_check = files
     
-    def process_replacements(self):
-        target_pattern = compile(self._target)
-        
-        # checks that the number of values provided corresponds to the number of expanded templates
+    # checks that the number of values provided corresponds to the number of expanded templates
+    def check_values(self) -> None:
         if len(self.values) != len(self.files_to_check):
                 raise ValueError("the number of values provided is not the same as the number of templates expanded. "
                                 f"Number of provided values is {len(self.values)} and number of expanded templates is {len(self.files_to_check)}")
+
+    # replaces all instances of target in the contents of the index-th expanded template with its list entry
+    def replace_in_contents(self, file_contents: str, index: int) -> str:
+        new_file_contents, num_subs = compile(self._target).subn(str(self.values[index]), file_contents)
+        self.substitutions += num_subs
+        logger.debug("        >>> Replaced %s with %s in %s", self._target, self.values[index], self.files_to_check[index].name)
+        return new_file_contents
+
+    def process_replacements(self, staging: StagingTree = None):
+        self.check_values()
         
         # replaces all instances of target in each file with the appropriate list entry
-        for replacement_value, replacement_filepath in zip(self.values, self.files_to_check):
-            try:
-                with open(replacement_filepath, "r") as replacement_file:
-                    file_contents = replacement_file.read()
-            except FileNotFoundError as fe:
-                raise FileNotFoundError(f"{fe}: used in templated replacement {self._target}")
-            # overwrites file with new replacements
-            with open(replacement_filepath, "w") as replacement_file:
-                new_file_contents = target_pattern.sub(str(replacement_value), file_contents)
-                replacement_file.write(new_file_contents)
-            logger.debug(f"        >>> Replaced {self._target} with {replacement_value} in {replacement_filepath.name}") 
+        with staged(staging) as staging:
+            for index, replacement_filepath in enumerate(self.files_to_check):
+                try:
+                    file_contents = staging.read(replacement_filepath)
+                except FileNotFoundError as fe:
+                    raise FileNotFoundError(f"{fe}: used in templated replacement {self._target}")
+                # overwrites file with new replacements
+                staging.write(replacement_filepath, self.replace_in_contents(file_contents, index))
         
 class TargetReplacement(Replacement):
-    def __init__(self, target_replacement:dict, site_dir:Path) -> None:
+    def __init__(self, target_replacement:dict, site_dir:Path, staging: StagingTree = None, file_index: FileIndex = None) -> None:
         super().__init__(target_replacement)
-        self.values.append(target_replacement["value"])
+        # the value may be a number when it isn't quoted in variance.yml
+        self.values.append(str(target_replacement["value"]))
         self._site_dir = site_dir
         files_set = set()
         inclusions = ["config/**/*.json"]
@@ -68,27 +81,29 @@ class TargetReplacement(Replacement):
             exclusions.append("variance.yml")
         except KeyError:
             logger.info(f"   >>> Did not find 'exclude' for replacement with target: '{self._target}'; will assume default configuration")
-        # aggregates full set of files to check for replacements
+        # aggregates full set of files to check for replacements from the site's files, which are
+        # usually indexed once for all of the site's replacements
+        if file_index is None:
+            file_index = FileIndex(site_dir, staging)
         for pathspec in inclusions:
-            files_set.update(list(site_dir.glob(pathspec)))
+            files_set.update(file_index.glob(pathspec))
         for pathspec in exclusions:
-            files_set.difference_update(list(site_dir.glob(pathspec)))
+            files_set.difference_update(file_index.glob(pathspec))
         self.files_to_check = list(files_set)
     
-    def process_replacements(self):
+    def process_replacements(self, staging: StagingTree = None):
         target_pattern = compile(self._target)
         value = self.values[0]
         
         # iterates over all files to check and overwrites their contents
-        for file in self.files_to_check:        
-            if file.is_file():
-                with open(file, "r") as replacement_file:
-                    file_contents = replacement_file.read()
-                with open(file, "w") as replacement_file:
+        with staged(staging) as staging:
+            for file in self.files_to_check:        
+                if staging.is_file(file):
+                    file_contents = staging.read(file)
                     new_file_contents = target_pattern.sub(value, file_contents)
-                    replacement_file.write(new_file_contents)
-                # only log if a replacement occured
-                if new_file_contents != file_contents:
-                    logger.debug("     >>> Replaced all '%s's in %s with '%s'", self._target, file, value)
-            elif not file.is_dir():
-                logger.warning(f" >>> {file} was not found")
\ No newline at end of file
+                    # only writes and logs if a replacement occured
+                    if new_file_contents != file_contents:
+                        staging.write(file, new_file_contents)
+                        logger.debug("     >>> Replaced all '%s's in %s with '%s'", self._target, file, value)
+                elif not staging.is_dir(file):
+                    logger.warning(f" >>> {file} was not found")
\ No newline at end of file
@@ -0,0 +1,164 @@
+from src.logger import logger
+from pathlib import Path
+from re import compile, escape
+from src.replacement import TargetReplacement
+from src.staging import StagingTree, staged
+
+# a target with none of these characters is matched as a plain string instead of a regex
+_REGEX_SPECIAL_CHARS = compile(r"[.^$*+?\[\]\\|()]")
+# '{' and '}' are only special when they form a repetition like '{3}' or '{1,2}', so targets
+# such as '{{SITE_ID}}' still take the literal fast path
+_REGEX_REPETITION = compile(r"\{\d*(?:,\d*)?\}")
+
+
+def is_literal_target(target: str) -> bool:
+    return not _REGEX_SPECIAL_CHARS.search(target) and not _REGEX_REPETITION.search(target)
+
+def _overlaps(first: str, second: str) -> bool:
+    # true if the two strings could share characters when found next to each other in a file
+    if first in second or second in first:
+        return True
+    shortest = min(len(first), len(second))
+    for length in range(1, shortest):
+        if first.endswith(second[:length]) or second.endswith(first[:length]):
+            return True
+    return False
+
+
+# One step of the replacement pipeline for a file: either a single regex replacement or a group of
+# literal replacements that can be made in one scan without changing the sequential result
+class _ReplacementPass():
+    def __init__(self, replacement: TargetReplacement) -> None:
+        self.replacements = [replacement]
+        self._literal = is_literal_target(replacement._target)
+        self._lookup = {}
+        if self._literal:
+            self._pattern = None
+            self._lookup[replacement._target] = self._expand_value(replacement)
+        else:
+            self._pattern = compile(replacement._target)
+
+    @staticmethod
+    def _expand_value(replacement: TargetReplacement) -> str:
+        # expands the value the same way re.sub would (escapes, group references to the match)
+        target = replacement._target
+        return compile(escape(target)).sub(replacement.values[0], target)
+
+    # checks whether a literal replacement can join this pass and still produce the same output as
+    # running it after every replacement already in the pass
+    def accepts(self, replacement: TargetReplacement) -> bool:
+        target = replacement._target
+        if not self._literal or not is_literal_target(target):
+            return False
+        for earlier_target, earlier_value in self._lookup.items():
+            # an earlier value could create new occurrences of this target
+            if earlier_value == "" or _overlaps(earlier_value, target):
+                return False
+            # an identical target has no occurrences left once the earlier replacement ran
+            if earlier_target != target and _overlaps(earlier_target, target):
+                return False
+        return True
+
+    def add(self, replacement: TargetReplacement) -> None:
+        # repeated targets are already fully replaced by the first occurrence in the pass
+        if replacement._target not in self._lookup:
+            self.replacements.append(replacement)
+            self._lookup[replacement._target] = self._expand_value(replacement)
+            self._pattern = compile("|".join(escape(target) for target in self._lookup))
+
+    # makes the replacements of this pass, counting how many times each one matched
+    def apply(self, file_contents: str, matched: "dict[TargetReplacement, int]") -> str:
+        if not self._literal:
+            new_file_contents, num_subs = self._pattern.subn(self.replacements[0].values[0], file_contents)
+            if num_subs:
+                matched[self.replacements[0]] = num_subs
+            return new_file_contents
+        if self._pattern is None:
+            target = self.replacements[0]._target
+            num_subs = file_contents.count(target)
+            if num_subs:
+                matched[self.replacements[0]] = num_subs
+                return file_contents.replace(target, self._lookup[target])
+            return file_contents
+
+        found_targets = {}
+        def substitute(match) -> str:
+            found_targets[match.group()] = found_targets.get(match.group(), 0) + 1
+            return self._lookup[match.group()]
+        new_file_contents = self._pattern.sub(substitute, file_contents)
+        for replacement in self.replacements:
+            if replacement._target in found_targets:
+                matched[replacement] = found_targets[replacement._target]
+        return new_file_contents
+
+
+# Makes every target replacement of a site while reading and writing each file only once
+class ReplacementEngine():
+    def __init__(self, replacements: "list[TargetReplacement]") -> None:
+        self.replacements = replacements
+        # compiled passes are shared between files that need the same set of replacements
+        self._compiled_passes = {}
+
+    # groups replacements by file, keeping the order they were listed in for each file
+    def get_replacements_by_file(self) -> "dict[Path, tuple[int, ...]]":
+        replacements_by_file = {}
+        for index, replacement in enumerate(self.replacements):
+            for file in replacement.files_to_check:
+                replacements_by_file.setdefault(file, []).append(index)
+        return {file: tuple(indices) for file, indices in replacements_by_file.items()}
+
+    def compile_passes(self, replacement_indices: "tuple[int, ...]") -> "list[_ReplacementPass]":
+        if replacement_indices in self._compiled_passes:
+            return self._compiled_passes[replacement_indices]
+        passes = []
+        for index in replacement_indices:
+            replacement = self.replacements[index]
+            if passes and passes[-1].accepts(replacement):
+                passes[-1].add(replacement)
+            else:
+                passes.append(_ReplacementPass(replacement))
+        self._compiled_passes[replacement_indices] = passes
+        return passes
+
+    # the targets to look for in a file before reading it, or None if one of its replacements is a regex and
+    # the file has to be read to tell whether it matches
+    def get_literal_targets(self, replacement_indices: "tuple[int, ...]") -> "list[str] | None":
+        passes = self.compile_passes(replacement_indices)
+        if not all(replacement_pass._literal for replacement_pass in passes):
+            return None
+        return [replacement._target for replacement_pass in passes for replacement in replacement_pass.replacements]
+
+    def replace_in_contents(self, file_contents: str, replacement_indices: "tuple[int, ...]") -> "tuple[str, dict[TargetReplacement, int]]":
+        matched = {}
+        for replacement_pass in self.compile_passes(replacement_indices):
+            file_contents = replacement_pass.apply(file_contents, matched)
+        return file_contents, matched
+
+    def process_replacements(self, staging: StagingTree = None) -> None:
+        with staged(staging) as staging:
+            replacements_by_file = self.get_replacements_by_file()
+            # files are scanned for their targets first; the ones without any of them can't be changed by the
+            # replacements, and binary files can't be replaced in, so those are never read or decoded
+            found_files = staging.find_containing({file: self.get_literal_targets(replacement_indices)
+                                                   for file, replacement_indices in replacements_by_file.items()})
+            for file in [file for file in replacements_by_file if file not in found_files]:
+                if staging.is_binary(file):
+                    logger.debug("     >>> Skipped %s, which is not a text file", file)
+                del replacements_by_file[file]
+            # only the reads overlap, replacements are still made one file at a time in the same order
+            staging.prefetch(list(replacements_by_file))
+            for file, replacement_indices in replacements_by_file.items():
+                if staging.is_file(file):
+                    file_contents = staging.read(file)
+                    new_file_contents, matched = self.replace_in_contents(file_contents, replacement_indices)
+                    # files without any of the targets stay unmodified, so they can still be linked
+                    if matched:
+                        staging.write(file, new_file_contents)
+                    # only log the replacements that occured
+                    for index in replacement_indices:
+                        replacement = self.replacements[index]
+                        if replacement in matched:
+                            replacement.substitutions += matched[replacement]
+                            logger.debug("     >>> Replaced all '%s's in %s with '%s'", replacement._target, file, replacement.values[0])
+                elif not staging.is_dir(file):
+                    logger.warning(f" >>> {file} was not found")
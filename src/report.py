@@ -0,0 +1,83 @@
+from src.version import VARIANCE_VERSION
+from contextlib import contextmanager
+from json import dump
+from pathlib import Path
+from time import perf_counter
+
+# stages timed for each device, then for the whole site
+DEVICE_STAGES = ["clear", "copy_root", "copy_variant", "expand_templates"]
+SITE_STAGES = ["replacements", "test_parsing", "write"]
+COUNTERS = ["files_read", "files_written", "files_unchanged", "files_linked", "bytes_read", "bytes_written", "files_scanned",
+            "bytes_scanned", "substitutions"]
+
+
+# Stage timings and I/O counters of one site, as written to the --report file
+class SiteReport():
+    def __init__(self, site_id: str) -> None:
+        self.site_id = site_id
+        self.wall_seconds = 0.0
+        self.skipped = False
+        self.stages = dict.fromkeys(SITE_STAGES, 0.0)
+        self.devices = {}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.unmatched_replacements = []
+
+    def add_device(self, device_type: str) -> None:
+        self.devices[device_type] = {"skipped": False, "stages": dict.fromkeys(DEVICE_STAGES, 0.0)}
+
+    def skip_device(self, device_type: str) -> None:
+        self.devices[device_type]["skipped"] = True
+
+    def add_time(self, stage: str, seconds: float, device_type: str = None) -> None:
+        stages = self.stages if device_type is None else self.devices[device_type]["stages"]
+        stages[stage] += seconds
+
+    def count(self, counters: dict) -> None:
+        for counter, amount in counters.items():
+            self.counters[counter] += amount
+
+    def to_dict(self) -> dict:
+        return {
+            "site": self.site_id,
+            "wall_seconds": self.wall_seconds,
+            "skipped": self.skipped,
+            "stages": self.stages,
+            "devices": self.devices,
+            "counters": dict(self.counters, bytes_moved=self.counters["bytes_read"] + self.counters["bytes_written"]),
+            "unmatched_replacements": self.unmatched_replacements,
+        }
+
+# Times a stage of a site or one of its devices when there is a report to add it to
+@contextmanager
+def timed(report: "SiteReport | None", stage: str, device_type: str = None):
+    if report is None:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        report.add_time(stage, perf_counter() - start, device_type)
+
+# Writes the reports of every site plus totals across the run
+def write_report(report_filepath: Path, site_reports: "list[dict]", wall_seconds: float, jobs: int) -> None:
+    stage_totals = dict.fromkeys(DEVICE_STAGES + SITE_STAGES, 0.0)
+    counter_totals = dict.fromkeys(COUNTERS + ["bytes_moved"], 0)
+    for site_report in site_reports:
+        if site_report.get("failed"):
+            continue
+        for stage, seconds in site_report["stages"].items():
+            stage_totals[stage] += seconds
+        for device_report in site_report["devices"].values():
+            for stage, seconds in device_report["stages"].items():
+                stage_totals[stage] += seconds
+        for counter, amount in site_report["counters"].items():
+            counter_totals[counter] += amount
+    with open(report_filepath, "w") as report_file:
+        dump({
+            "version": VARIANCE_VERSION,
+            "wall_seconds": wall_seconds,
+            "jobs": jobs,
+            "totals": {"stages": stage_totals, "counters": counter_totals},
+            "sites": site_reports,
+        }, report_file, indent=4)
@@ -0,0 +1,207 @@
+from src.logger import logger
+from src.version import VARIANCE_VERSION
+from pathlib import Path
+from hashlib import sha256
+from json import JSONDecodeError, dump, dumps, load, loads
+from re import compile
+
+# parsed and validated site configs from earlier runs, by the hash of their variance.yml
+CONFIG_CACHE_DIR = Path(".variance_cache")
+CONFIG_CACHE_FILENAME = "configs.json"
+# how many configs are kept in the cache; the ones used least recently are dropped first
+CONFIG_CACHE_SIZE = 4096
+
+# The keys of a variance.yml and what their values must be. A value's schema lists the types it can have and,
+# for mappings, the schema of each key and the keys that are required (always, or depending on another key's
+# value), for lists the schema of their items, and for strings the values they can take. Keys of the config
+# itself that end with a device type's suffix ('twins_variant', 'ess-controller_templates') are matched by suffix
+_SCALAR = (str, int, float)
+TEMPLATED_REPLACEMENT_SCHEMA = {
+    "types": (dict,),
+    "required": ["target"],
+    "keys": {
+        "target": {"types": (str,)},
+        "list": {"types": (list,), "items": {"types": _SCALAR}},
+    },
+}
+FILENAME_PATTERN_SCHEMA = {
+    "types": (dict,),
+    "required": ["type", "filename_template"],
+    "required_by": {"type": {"sequential": ["from", "to"], "list": ["list"]}},
+    "keys": {
+        "type": {"types": (str,), "choices": ["sequential", "list"]},
+        "filename_template": {"types": (str,)},
+        "from": {"types": (int,)},
+        "to": {"types": (int,)},
+        "list": {"types": (list,), "items": {"types": _SCALAR}},
+    },
+}
+TEMPLATE_SCHEMA = {
+    "types": (dict,),
+    "required": ["path", "filename_pattern"],
+    "keys": {
+        "path": {"types": (str,)},
+        "filename_pattern": FILENAME_PATTERN_SCHEMA,
+        "templated_replacements": {"types": (list,), "items": TEMPLATED_REPLACEMENT_SCHEMA},
+    },
+}
+REPLACEMENT_SCHEMA = {
+    "types": (dict,),
+    "required": ["target", "value"],
+    "keys": {
+        "target": {"types": (str,)},
+        # numbers (e.g. an unquoted port) are put in the files the way str() writes them
+        "value": {"types": _SCALAR},
+        "include": {"types": (list, str), "items": {"types": (str,)}},
+        "exclude": {"types": (list, str), "items": {"types": (str,)}},
+    },
+}
+CONFIG_SCHEMA = {
+    "types": (dict,),
+    "keys": {
+        "replacements": {"types": (list,), "items": REPLACEMENT_SCHEMA},
+    },
+    "key_suffixes": {
+        "_variant": {"types": (str, int)},
+        "_templates": {"types": (list,), "items": TEMPLATE_SCHEMA},
+    },
+}
+
+# the config key at the start of an error's path
+_ERROR_KEY = compile(r"[^.\[ ]*")
+
+# configs cached on disk and loaded in this run, by hash; None until the cache file is first needed
+_config_cache = None
+_config_cache_changed = False
+
+
+def _type_names(types: tuple) -> str:
+    names = {dict: "a mapping", list: "a list", str: "a string", int: "an integer", float: "a number"}
+    return " or ".join(names[value_type] for value_type in types)
+
+def _join(where: str, key) -> str:
+    return f"{where}.{key}" if where else str(key)
+
+# the errors in value (found at where in the config, e.g. 'replacements[0]') against its schema
+def validate(value, schema: dict, where: str = "") -> "list[str]":
+    # YAML booleans are ints to isinstance(), but never a valid value
+    if isinstance(value, bool) or not isinstance(value, schema["types"]):
+        return [f"{where} must be {_type_names(schema['types'])}, not {'null' if value is None else repr(value)}"]
+    if "choices" in schema and value not in schema["choices"]:
+        return [f"{where} '{value}' is not supported, must be one of {schema['choices']}"]
+    errors = []
+    if isinstance(value, dict):
+        required = list(schema.get("required", []))
+        for key, required_by_value in schema.get("required_by", {}).items():
+            if isinstance(value.get(key), str):
+                required.extend(required_by_value.get(value[key], []))
+        errors.extend(f"{where} is missing '{key}'" for key in required if key not in value)
+        for key, key_value in value.items():
+            key_schema = schema.get("keys", {}).get(key)
+            if key_schema is None:
+                key_schema = next((suffix_schema for suffix, suffix_schema in schema.get("key_suffixes", {}).items()
+                                   if isinstance(key, str) and key.endswith(suffix)), None)
+            if key_schema is not None:
+                errors.extend(validate(key_value, key_schema, _join(where, key)))
+    elif isinstance(value, list) and "items" in schema:
+        for index, item in enumerate(value):
+            errors.extend(validate(item, schema["items"], f"{where}[{index}]"))
+    return errors
+
+# the keys of a config that have errors, from the path each error starts with
+def get_invalid_keys(errors: "list[str]") -> "set[str]":
+    return set(_ERROR_KEY.match(error).group() for error in errors)
+
+def validate_config(config) -> "list[str]":
+    if not isinstance(config, dict):
+        return ["variance.yml does not hold a mapping of settings"]
+    return validate(config, CONFIG_SCHEMA)
+
+# a replacement's include or exclude may be a single pattern, which is used as a list of one pattern
+def _normalize_config(config) -> None:
+    if not isinstance(config, dict) or not isinstance(config.get("replacements"), list):
+        return
+    for replacement_entry in config["replacements"]:
+        if isinstance(replacement_entry, dict):
+            for key in ["include", "exclude"]:
+                if isinstance(replacement_entry.get(key), str):
+                    replacement_entry[key] = [replacement_entry[key]]
+
+def _parse_config(config_data: bytes) -> "tuple[dict | None, list[str]]":
+    # yaml takes a while to import, so it is only imported once there is a config file to parse; libyaml's
+    # loader parses the same documents as the pure Python one, many times faster
+    import yaml
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    try:
+        config = yaml.load(config_data, Loader=loader)
+    except yaml.YAMLError as err:
+        return None, [f"variance.yml could not be parsed: {err}"]
+    errors = validate_config(config)
+    _normalize_config(config)
+    return config, errors
+
+def _get_config_cache() -> dict:
+    global _config_cache
+    if _config_cache is None:
+        _config_cache = {}
+        try:
+            with open(CONFIG_CACHE_DIR / CONFIG_CACHE_FILENAME, "r") as cache_file:
+                cached = load(cache_file)
+            # configs are validated again after Variance (and so the schema) changes
+            if cached.get("version") == VARIANCE_VERSION:
+                _config_cache = cached["configs"]
+        except (OSError, JSONDecodeError, KeyError, AttributeError):
+            pass
+    return _config_cache
+
+# a site's parsed variance.yml and the errors found validating it, from the cache when the file was already
+# parsed in this or an earlier run
+def load_config(site_dir: Path) -> "tuple[dict | None, list[str]]":
+    global _config_cache_changed
+    config_filepath = site_dir / "variance.yml"
+    if not config_filepath.is_file():
+        logger.warning(f"no config file was found for {site_dir.name}")
+        return {}, []
+    config_data = config_filepath.read_bytes()
+    config_hash = sha256(config_data).hexdigest()
+    config_cache = _get_config_cache()
+    if config_hash in config_cache:
+        # moves the config to the end, where the most recently used configs are kept
+        cached = config_cache.pop(config_hash)
+        config_cache[config_hash] = cached
+        config = loads(cached["config"])
+        # configs may have been cached before their single patterns were made lists
+        _normalize_config(config)
+        return config, cached["errors"]
+
+    config, errors = _parse_config(config_data)
+    # configs with values JSON can't hold as they are (e.g. dates) are parsed every time instead
+    try:
+        config_json = dumps(config)
+    except (TypeError, ValueError):
+        config_json = None
+    if config_json is not None and loads(config_json) == config:
+        config_cache[config_hash] = {"config": config_json, "errors": errors}
+        _config_cache_changed = True
+    return config, errors
+
+# writes the configs parsed in this run to the cache, if there are any new ones
+def save_config_cache() -> None:
+    global _config_cache_changed
+    if not _config_cache_changed:
+        return
+    config_cache = _get_config_cache()
+    for config_hash in list(config_cache)[:-CONFIG_CACHE_SIZE]:
+        del config_cache[config_hash]
+    cache_filepath = CONFIG_CACHE_DIR / CONFIG_CACHE_FILENAME
+    try:
+        CONFIG_CACHE_DIR.mkdir(exist_ok=True)
+        # written to a temporary file first so a run that is interrupted can't leave half a cache behind
+        temp_filepath = cache_filepath.with_name(f"{CONFIG_CACHE_FILENAME}.tmp")
+        with open(temp_filepath, "w") as cache_file:
+            dump({"version": VARIANCE_VERSION, "configs": config_cache}, cache_file)
+        temp_filepath.replace(cache_filepath)
+    except OSError as err:
+        logger.warning(f"   >>> Could not write the config cache '{cache_filepath}': {err}")
+        return
+    _config_cache_changed = False
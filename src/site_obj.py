@@ -1,17 +1,26 @@
-from logger import logger
+from src.logger import logger
 from pathlib import Path
 from shutil import copytree, rmtree
-from re import Match, compile, match
-from yaml import safe_load, safe_dump
 from src.replacement import TargetReplacement
+from src.replacement_engine import ReplacementEngine
+from src.staging import StagingTree
+from src.file_index import FileIndex
+from src.site_config import load_config
+from src.expressions import evaluate_avr_match, evaluate_expressions, evaluate_normal_match, find_unreplaced_wildcard
 
 
+# reads a site's variance.yml, without creating the site directory like Site() does
+def load_config_file(site_dir: Path) -> dict:
+    return load_config(site_dir)[0]
+
 class Site():
     def __init__(self, site_id: str) -> None:
         self._id = site_id
         self.devices = [] 
         self.replacements = []
         self._directory = Path(f"./config/{site_id}")
+        # when set, replacements are made on the staged files instead of on disk
+        self.staging: StagingTree = None
         config_filepath = self._directory / "variance.yml"
         
         # creates site directory if it DNE
@@ -19,6 +28,7 @@ class Site():
             self._directory.mkdir()
         # creates variance config file if it DNE
         if not config_filepath.exists():
+            from yaml import safe_dump
             with open(config_filepath, 'w') as new_file:
                 safe_dump("", new_file)
     
@@ -43,109 +53,47 @@ class Site():
         rmtree(old_site_directory)
     
     def set_replacements(self, replacements_list: "list[dict]") -> None:
+        # walks the site directory once for every replacement's include and exclude patterns
+        file_index = FileIndex(self._directory, self.staging)
         for replacement_dict in replacements_list:
-            self.replacements.append(TargetReplacement(replacement_dict, self._directory))
+            self.replacements.append(TargetReplacement(replacement_dict, self._directory, self.staging, file_index))
+    
+    # leaves the files in the given directories (e.g. devices that were not regenerated) out of the replacements
+    def exclude_from_replacements(self, directories: "list[Path]") -> None:
+        for replacement in self.replacements:
+            replacement.files_to_check = [file for file in replacement.files_to_check
+                                          if not any(directory == file or directory in file.parents for directory in directories)]
     
     def get_config_file(self)-> dict:
-        config_filepath = self._directory / "variance.yml"
-        if config_filepath.is_file():
-            with open(config_filepath, 'r') as variance_cfg:
-                return safe_load(variance_cfg)
-        else:
-            logger.warning(f"no config file was found for {self._directory.name}")
-            return {}     
+        return load_config_file(self._directory)
     
     def replace_all_targets(self) -> None:
-        for replacement in self.replacements:
-            replacement.process_replacements()
+        # makes every replacement in a single read/write of each file, in the listed order
+        ReplacementEngine(self.replacements).process_replacements(self.staging)
     
-    @staticmethod
-    def _evaluate_avr_expressions(match: Match) -> str:
-        # only evaluates expressions if there is a match
-        if match:
-            # required in match
-            first_sign = match.group(1)
-            coefficient = match.group(2)
-            # required in match
-            droop_percent = match.group(3)
-            poi_voltage = match.group(4)
-            # required if both poi_voltage and deadband_voltage present
-            second_sign = match.group(5)
-            deadband_voltage = match.group(6)
-            
-            if coefficient:
-                droop_percent = float(coefficient)*float(droop_percent)
-            if first_sign == "+":
-                percentage = 100+float(droop_percent)
-            else:
-                percentage = 100-float(droop_percent)
-            
-            # calculates the actual voltage command if deadband and POI voltage are provided
-            if poi_voltage != None and deadband_voltage != None:
-                if second_sign == "+":
-                    voltage_sum = int(poi_voltage) + int(deadband_voltage)
-                else:
-                    voltage_sum = int(poi_voltage) - int(deadband_voltage)
-                return str((percentage/100)*voltage_sum)
-            
-            # only evaluates the percentage of the voltage command
-            return str(percentage)
-        
-    @staticmethod
-    def _evaluate_normal_expressions(match: Match) -> str:
-        if match:
-            coefficient = match.group(1)
-            variable_value = match.group(2)            
-            if coefficient:
-                return str(float(coefficient) * float(variable_value))
-            else:
-                return variable_value
-        
-    def testfile_parsing_walker(self, obj):
-        template_pattern = compile(r"(?:((?:-)?(?:\d*[.])?\d+)(?:\*))?((?:\d+)(?:[.]\d+)?)")
-        avr_pattern = compile(r"(?:100)([+-])(?:((?:\d*.)(?:\d+))(?:\*))?(\d+)(?:(?:\*\()(\d+)([+-])(\d+)(?:\)))?")
-        replacement_pattern = compile(r"{{\w+}}")
+    # kept on Site for callers that evaluate their own matches
+    _evaluate_avr_expressions = staticmethod(evaluate_avr_match)
+    _evaluate_normal_expressions = staticmethod(evaluate_normal_match)
         
+    # check_wildcards can be turned off for files known to have no '{{...}}' tokens left
+    def testfile_parsing_walker(self, obj, check_wildcards: bool = True):
         # iterates through each dictionary value
         if type(obj) == dict:
             replacement_dict = {}
             for key in obj:
                 entry = obj[key]
-                replacement_dict[key] = self.testfile_parsing_walker(entry)
+                replacement_dict[key] = self.testfile_parsing_walker(entry, check_wildcards)
             return replacement_dict
         # iterates through each list item
         elif type(obj) == list:
-            index = 0
-            replacement_list = [None] * len(obj)
-            for entry in obj:
-                replacement_list[index] = self.testfile_parsing_walker(entry)
-                index = index + 1
-            return replacement_list
+            return [self.testfile_parsing_walker(entry, check_wildcards) for entry in obj]
         elif type(obj) == str:
-            obj_to_try = obj
             ## first, looks for un-replaced wildcards
-            found_wildcard = match(replacement_pattern, obj_to_try)
+            found_wildcard = find_unreplaced_wildcard(obj) if check_wildcards else None
             if found_wildcard != None:
-                logger.warning(f"   >>> Found an unreplaced wildcard '{found_wildcard.string}'")
-                
-            ## next, tries special case for AVR
-            avr_replacement = avr_pattern.sub(self._evaluate_avr_expressions, obj_to_try)
-            if avr_replacement != obj:
-                ## checks if the entire string was a numerical expression
-                try:
-                    avr_replacement = float(avr_replacement)
-                    return avr_replacement
-                except ValueError:
-                    obj_to_try = avr_replacement
-                    
-            replacement = template_pattern.sub(self._evaluate_normal_expressions, obj_to_try)
-            if replacement != obj_to_try:    
-                ## checks if the entire string was a numerical expression            
-                try:
-                    replacement = float(replacement)
-                except ValueError:
-                    pass
-            return replacement
+                logger.warning(f"   >>> Found an unreplaced wildcard '{found_wildcard}'")
+            ## then evaluates AVR and coefficient expressions
+            return evaluate_expressions(obj)
         # doesn't attempt to iterate over or replace other types
         else:
-            return obj
\ No newline at end of file
+            return obj
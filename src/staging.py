@@ -0,0 +1,688 @@
+from src.logger import logger
+from pathlib import Path
+from shutil import copy2, copystat, rmtree
+from filecmp import cmp
+from contextlib import contextmanager
+from locale import getpreferredencoding
+from codecs import lookup
+from mmap import ACCESS_READ, mmap
+from os import fsencode, fstat, link, linesep, readlink, walk
+from os.path import relpath, samefile
+from stat import S_ISLNK
+from io import StringIO
+from collections.abc import Callable
+from threading import Lock
+from re import compile
+from src.glob_match import compile_pathspec, match_pathspec
+from src.expressions import WILDCARD_PATTERN
+
+
+# A file in the staging tree: either an untouched copy of a source file or new text content
+class _StagedFile():
+    def __init__(self, source: Path = None, text: str = None, shared: bool = False) -> None:
+        self.source = source
+        self.text = text
+        # the source is a root or variant file, which is only read once for every tree that shares source texts
+        self.shared = shared
+        # only files that were written to need their text written out, the rest are copied byte for byte
+        self.modified = text is not None
+        # streamed from the staged content into the output file when the tree is flushed
+        self.transform = None
+        self.encoding = None
+
+    def open_source(self):
+        if self.text is not None:
+            return StringIO(self.text)
+        return open(self.source, "r", encoding=self.encoding)
+
+
+# how files that no stage modified are put in place: copied, or linked to the root/variant file they come from
+LINK_MODES = ["copy", "hardlink", "reflink", "symlink"]
+# ioctl that makes a file share the blocks of another one (Linux, on filesystems like Btrfs and XFS)
+_FICLONE = 0x40049409
+# link modes that already fell back to copying in this process, so the warning is only logged once
+_unsupported_link_modes = set()
+# WILDCARD_PATTERN's tokens in UTF-8 bytes: word characters are widened to every non-ASCII byte, so each token
+# found in the decoded text is found with the same span (plus a few that aren't tokens, which no target is)
+_TOKEN_PATTERN = compile(rb"{{[\w\x80-\xff]+}}")
+# renameat2() arguments that swap two paths in one step (Linux 3.15+, on most local filesystems)
+_AT_FDCWD = -100
+_RENAME_EXCHANGE = 2
+# libc's renameat2(), loaded the first time directories are swapped; False if it isn't available
+_renameat2 = None
+# deletes the directories swapped out of the output one after another, in the background
+_removal_executor = None
+
+
+# the files (as relative path: source path) and directories (as relative paths) under src_dir, in the order
+# copy_tree() stages them
+def list_tree(src_dir: Path) -> "tuple[dict[Path, Path], list[Path]]":
+    if not src_dir.is_dir():
+        raise NotADirectoryError(f"'{src_dir}' is not a directory")
+    files = {}
+    dirs = []
+    # os.walk() lists each directory once and knows which entries are directories without a stat() per entry,
+    # which Path.rglob() and Path.is_dir() take
+    for dir_path, dir_names, file_names in walk(src_dir):
+        rel_dir = Path(dir_path).relative_to(src_dir)
+        dirs.extend(rel_dir / dir_name for dir_name in dir_names)
+        files.update((rel_dir / file_name, Path(dir_path, file_name)) for file_name in file_names)
+    return files, dirs
+
+# true if the path is a symlink or shares its inode with another file, so writing into it would change that file too
+def _is_link(path: Path) -> bool:
+    try:
+        path_stat = path.lstat()
+    except OSError:
+        return False
+    return S_ISLNK(path_stat.st_mode) or path_stat.st_nlink > 1
+
+def _reflink(source: Path, path: Path) -> None:
+    try:
+        from fcntl import ioctl
+    except ImportError:
+        raise OSError("reflinks are not supported on this platform")
+    with open(source, "rb") as source_file, open(path, "wb") as new_file:
+        ioctl(new_file.fileno(), _FICLONE, source_file.fileno())
+    copystat(source, path)
+
+# files are only scanned as bytes when they are read as UTF-8, the only encoding their tokens are searched in
+def _is_utf8(encoding: str = None) -> bool:
+    return lookup(encoding or getpreferredencoding(False)).name == "utf-8"
+
+# the targets as the bytes they are found as in a file in the given encoding, or None if finding them in the
+# file's bytes could give a different answer than finding them in its text: only UTF-8 is decoded one
+# character at a time without ambiguity, and text mode turns '\r\n' and '\r' into '\n'
+def _encode_targets(targets: "list[str]", encoding: str = None) -> "list[bytes] | None":
+    if not _is_utf8(encoding):
+        return None
+    if any("\r" in target or "\n" in target or not target for target in targets):
+        return None
+    return [target.encode("utf-8") for target in targets]
+
+# What one scan of a file found: the '{{...}}' tokens in it, whether it is binary (holds a NUL byte), and whether
+# it has JSON '\u' escapes, which could spell out a token that isn't in the file as is
+class _FileScan():
+    def __init__(self, tokens: "frozenset[str]", binary: bool, escaped: bool) -> None:
+        self.tokens = tokens
+        self.binary = binary
+        self.escaped = escaped
+
+    @classmethod
+    def from_text(cls, text: str) -> "_FileScan":
+        return cls(frozenset(WILDCARD_PATTERN.findall(text)), "\0" in text, "\\u" in text)
+
+    @classmethod
+    def from_bytes(cls, data) -> "_FileScan":
+        tokens = frozenset(token.decode("utf-8", "replace") for token in _TOKEN_PATTERN.findall(data))
+        return cls(tokens, data.find(b"\0") != -1, data.find(b"\\u") != -1)
+
+# swaps two paths in one step, returning False if the platform or filesystem can't
+def _exchange(path: Path, other_path: Path) -> bool:
+    global _renameat2
+    if _renameat2 is None:
+        try:
+            from ctypes import CDLL, c_char_p, c_int, c_uint
+            from ctypes.util import find_library
+            _renameat2 = CDLL(find_library("c"), use_errno=True).renameat2
+            _renameat2.argtypes = [c_int, c_char_p, c_int, c_char_p, c_uint]
+            _renameat2.restype = c_int
+        except (OSError, AttributeError):
+            _renameat2 = False
+    if not _renameat2:
+        return False
+    return _renameat2(_AT_FDCWD, fsencode(path), _AT_FDCWD, fsencode(other_path), _RENAME_EXCHANGE) == 0
+
+# the hidden directories a directory's replacement is built in, and its old contents are moved to
+def _get_swap_paths(directory: Path) -> "tuple[Path, Path]":
+    return directory.with_name(f".{directory.name}.variance-new"), directory.with_name(f".{directory.name}.variance-old")
+
+def _remove_swapped_out(directory: Path) -> None:
+    try:
+        rmtree(directory)
+    except OSError as err:
+        logger.warning(f"   >>> Could not remove '{directory}': {err}")
+
+def _remove_in_background(directory: Path) -> None:
+    global _removal_executor
+    if _removal_executor is None:
+        from concurrent.futures import ThreadPoolExecutor
+        _removal_executor = ThreadPoolExecutor(max_workers=1)
+    _removal_executor.submit(_remove_swapped_out, directory)
+
+# waits for every directory swapped out of the output so far to be deleted
+def wait_for_removals() -> None:
+    global _removal_executor
+    if _removal_executor is not None:
+        _removal_executor.shutdown(wait=True)
+        _removal_executor = None
+
+# puts new_dir in place of directory, whose old contents are deleted in the background. On Linux the two are
+# swapped in one step, so readers of the directory never find it missing or half written; elsewhere the
+# directory is only missing between two renames
+def _replace_dir(new_dir: Path, directory: Path) -> None:
+    if not directory.exists():
+        new_dir.rename(directory)
+        return
+    if _exchange(new_dir, directory):
+        _remove_in_background(new_dir)
+        return
+    old_dir = _get_swap_paths(directory)[1]
+    directory.rename(old_dir)
+    new_dir.rename(directory)
+    _remove_in_background(old_dir)
+
+# true if the file at path already holds exactly these bytes
+def _has_contents(path: Path, data: bytes) -> bool:
+    try:
+        if path.stat().st_size != len(data):
+            return False
+        with open(path, "rb") as existing_file:
+            return existing_file.read() == data
+    except OSError:
+        return False
+
+
+# Builds a set of output files in memory so every file is written to disk exactly once when the tree
+# is flushed, no matter how many stages (copying, templating, replacements, test parsing) touch it.
+# Removing files and directories is also deferred to the flush, and files whose contents are already on
+# disk are not written again, so regenerating a site only touches (and changes the mtime of) files that changed
+class StagingTree():
+    def __init__(self, link_mode: str = "copy", io_workers: int = 1, source_texts: dict = None, source_scans: dict = None) -> None:
+        if link_mode not in LINK_MODES:
+            raise ValueError(f"link mode '{link_mode}' is not supported, must be one of {LINK_MODES}")
+        self.link_mode = link_mode
+        # how many files are read or written at the same time when the tree is flushed or files are prefetched
+        self.io_workers = io_workers
+        # texts of shared source files by (source, encoding), which may be the same dict for every site's tree
+        self._source_texts = {} if source_texts is None else source_texts
+        # scans of shared source files by source, shared like their texts, and of every other file by source
+        self._source_scans = {} if source_scans is None else source_scans
+        self._scans = {}
+        self._lock = Lock()
+        self._files = {}
+        self._dirs = set()
+        self._removed = set()
+        self._removed_dirs = set()
+        # directories that are built next to where they belong and swapped in whole, with where each one is built
+        self._swapped = {}
+        # I/O done by this tree over its lifetime, for run reports
+        self.counters = {"files_read": 0, "files_written": 0, "files_unchanged": 0, "files_linked": 0,
+                         "bytes_read": 0, "bytes_written": 0, "files_scanned": 0, "bytes_scanned": 0}
+
+    def _count(self, **amounts: int) -> None:
+        with self._lock:
+            for counter, amount in amounts.items():
+                self.counters[counter] += amount
+
+    # calls function(*arguments) for each item, on up to io_workers threads, returning the results in order
+    def _run_io(self, function: Callable, items: list) -> list:
+        if self.io_workers <= 1 or len(items) <= 1:
+            return [function(*arguments) for arguments in items]
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=self.io_workers) as executor:
+            return list(executor.map(lambda arguments: function(*arguments), items))
+
+    def _add_dir(self, directory: Path) -> None:
+        self._dirs.add(directory)
+        self._dirs.update(directory.parents)
+
+    def copy_tree(self, src_dir: Path, dest_dir: Path) -> None:
+        # same behavior as copytree(src_dir, dest_dir, dirs_exist_ok=True)
+        files, dirs = list_tree(src_dir)
+        self._add_dir(dest_dir)
+        self.copy_files(dest_dir, files, dirs)
+
+    # stages files and directories listed relative to dest_dir (see list_tree()); files with shared sources
+    # are only read once across every tree that was given the same source texts
+    def copy_files(self, dest_dir: Path, files: "dict[Path, Path]", dirs: "list[Path]", shared: bool = False) -> None:
+        for directory in dirs:
+            self._add_dir(dest_dir / directory)
+        for path, src_path in files.items():
+            dest_path = dest_dir / path
+            self._files[dest_path] = _StagedFile(source=src_path, shared=shared)
+            self._removed.discard(dest_path)
+
+    def move_tree(self, src_dir: Path, dest_dir: Path) -> None:
+        for staged_path in [path for path in self._files if src_dir in path.parents]:
+            dest_path = dest_dir / staged_path.relative_to(src_dir)
+            self._files[dest_path] = self._files.pop(staged_path)
+            self._removed.discard(dest_path)
+        for staged_dir in [directory for directory in self._dirs if directory == src_dir or src_dir in directory.parents]:
+            self._dirs.discard(staged_dir)
+            self._add_dir(dest_dir / staged_dir.relative_to(src_dir))
+
+    def copy(self, src_path: Path, dest_path: Path) -> None:
+        if src_path in self._files:
+            staged_file = self._files[src_path]
+            self._files[dest_path] = _StagedFile(staged_file.source, staged_file.text, staged_file.shared)
+            self._files[dest_path].modified = staged_file.modified
+        elif self.is_file(src_path):
+            self._files[dest_path] = _StagedFile(source=src_path)
+        else:
+            raise FileNotFoundError(f"No such file: '{src_path}'")
+        self._removed.discard(dest_path)
+        self._add_dir(dest_path.parent)
+
+    def remove(self, path: Path) -> None:
+        self._files.pop(path, None)
+        self._removed.add(path)
+
+    # removes a directory once everything in it has been removed, unless files are staged in it again
+    def remove_dir(self, directory: Path) -> None:
+        self._removed_dirs.add(directory)
+
+    # same as rmtree(directory), when the tree is flushed
+    def remove_tree(self, directory: Path) -> None:
+        for path in [path for path in self._files if directory in path.parents]:
+            self.remove(path)
+        self._dirs.difference_update([path for path in self._dirs if path == directory or directory in path.parents])
+        if directory.is_dir():
+            for path in directory.rglob("*"):
+                if path.is_dir():
+                    self._removed_dirs.add(path)
+                else:
+                    self._removed.add(path)
+            self._removed_dirs.add(directory)
+
+    # builds the directory next to where it belongs when the tree is flushed and swaps it in once it is complete,
+    # instead of writing into it; files already in it that aren't staged or removed are kept
+    def swap_dir(self, directory: Path) -> None:
+        # clears what an interrupted run may have left next to it
+        for swap_path in _get_swap_paths(directory):
+            if swap_path.is_dir() and not swap_path.is_symlink():
+                rmtree(swap_path)
+        self._swapped[directory] = _get_swap_paths(directory)[0]
+
+    def is_removed(self, path: Path) -> bool:
+        return path in self._removed or (path in self._removed_dirs and path not in self._dirs)
+
+    def is_file(self, path: Path) -> bool:
+        if path in self._files:
+            return True
+        return path not in self._removed and path.is_file()
+
+    def is_dir(self, path: Path) -> bool:
+        return path in self._dirs or (path not in self._removed_dirs and path.is_dir())
+
+    def exists(self, path: Path) -> bool:
+        return self.is_file(path) or self.is_dir(path)
+
+    def read(self, path: Path, encoding: str = None) -> str:
+        staged_file = self._files.get(path)
+        if staged_file is None:
+            if path in self._removed:
+                raise FileNotFoundError(f"No such file: '{path}'")
+            staged_file = _StagedFile(source=path)
+            self._files[path] = staged_file
+        if staged_file.text is None:
+            staged_file.text = self._source_texts.get((staged_file.source, encoding)) if staged_file.shared else None
+        if staged_file.text is None:
+            with open(staged_file.source, "r", encoding=encoding) as source_file:
+                staged_file.text = source_file.read()
+                self._count(files_read=1, bytes_read=fstat(source_file.fileno()).st_size)
+            if staged_file.shared:
+                self._source_texts[(staged_file.source, encoding)] = staged_file.text
+        return staged_file.text
+
+    # reads files that will be needed next concurrently so read() doesn't wait on them one at a time; files
+    # that can't be read are skipped and left for read() to report
+    def prefetch(self, paths: "list[Path]", encoding: str = None) -> None:
+        sources = []
+        for path in paths:
+            staged_file = self._files.get(path)
+            if staged_file is None and path not in self._removed:
+                sources.append((path, path))
+            elif staged_file is not None and staged_file.text is None:
+                if staged_file.shared and (staged_file.source, encoding) in self._source_texts:
+                    staged_file.text = self._source_texts[(staged_file.source, encoding)]
+                else:
+                    sources.append((path, staged_file.source))
+
+        def read_source(path: Path, source: Path) -> "tuple[str, int] | None":
+            try:
+                with open(source, "r", encoding=encoding) as source_file:
+                    return source_file.read(), fstat(source_file.fileno()).st_size
+            except (OSError, ValueError):
+                return None
+
+        for (path, source), contents in zip(sources, self._run_io(read_source, sources)):
+            if contents is None:
+                continue
+            staged_file = self._files.setdefault(path, _StagedFile(source=source))
+            staged_file.text = contents[0]
+            self._count(files_read=1, bytes_read=contents[1])
+            if staged_file.shared:
+                self._source_texts[(source, encoding)] = staged_file.text
+
+    def _get_scans(self, staged_file: "_StagedFile | None") -> dict:
+        return self._source_scans if staged_file is not None and staged_file.shared else self._scans
+
+    # what a scan of the file found, or None if it can't be scanned (it doesn't exist, or the encoding isn't
+    # UTF-8). Staged text is scanned as is, files on disk are memory-mapped and scanned as bytes once
+    def get_scan(self, path: Path, encoding: str = None) -> "_FileScan | None":
+        staged_file = self._files.get(path)
+        if staged_file is None and path in self._removed:
+            return None
+        text = None if staged_file is None else staged_file.text
+        if text is None and staged_file is not None and staged_file.shared:
+            text = self._source_texts.get((staged_file.source, encoding))
+        if text is not None:
+            return _FileScan.from_text(text)
+        source = path if staged_file is None else staged_file.source
+        scans = self._get_scans(staged_file)
+        if source not in scans:
+            if not _is_utf8(encoding):
+                return None
+            scans[source] = self._scan_source(source)
+        return scans[source]
+
+    def is_binary(self, path: Path) -> bool:
+        file_scan = self.get_scan(path)
+        return file_scan is not None and file_scan.binary
+
+    # scans the files that aren't staged as text yet, several at a time, so get_scan() doesn't map them one by one
+    def scan(self, paths: "list[Path]", encoding: str = None) -> None:
+        if not _is_utf8(encoding):
+            return
+        sources = {}
+        for path in paths:
+            staged_file = self._files.get(path)
+            if (staged_file is None and path in self._removed) or (staged_file is not None and staged_file.text is not None):
+                continue
+            source = path if staged_file is None else staged_file.source
+            if source not in self._get_scans(staged_file):
+                sources[source] = self._get_scans(staged_file)
+        for (source, scans), file_scan in zip(sources.items(), self._run_io(self._scan_source, [(source,) for source in sources])):
+            scans[source] = file_scan
+
+    def _scan_source(self, source: Path) -> "_FileScan | None":
+        try:
+            with open(source, "rb") as source_file:
+                size = fstat(source_file.fileno()).st_size
+                self._count(files_scanned=1, bytes_scanned=size)
+                # empty files can't be mapped, and can't contain anything either
+                if size == 0:
+                    return _FileScan(frozenset(), False, False)
+                with mmap(source_file.fileno(), 0, access=ACCESS_READ) as source_bytes:
+                    return _FileScan.from_bytes(source_bytes)
+        except (OSError, ValueError):
+            return None
+
+    # the paths that may contain any of their targets (None standing for a regex, which anything may match).
+    # Tokens like '{{SITE_ID}}' are looked up in each file's scan; other targets are searched for in staged text,
+    # or in the memory-mapped bytes of the file. Binary files never contain any target, so they are never decoded,
+    # and files that can't be scanned are returned to be read as usual
+    def find_containing(self, targets_by_path: "dict[Path, list[str] | None]", encoding: str = None) -> "set[Path]":
+        self.scan(list(targets_by_path), encoding)
+        found_paths = set()
+        searches = []
+        for path, targets in targets_by_path.items():
+            file_scan = self.get_scan(path, encoding)
+            if file_scan is None or (targets is None and not file_scan.binary):
+                found_paths.add(path)
+                continue
+            if file_scan.binary:
+                continue
+            if any(target in file_scan.tokens for target in targets):
+                found_paths.add(path)
+                continue
+            other_targets = [target for target in targets if not WILDCARD_PATTERN.fullmatch(target)]
+            if not other_targets:
+                continue
+            staged_file = self._files.get(path)
+            if staged_file is not None and staged_file.text is not None:
+                if any(target in staged_file.text for target in other_targets):
+                    found_paths.add(path)
+                continue
+            needles = _encode_targets(other_targets, encoding)
+            if needles is None:
+                found_paths.add(path)
+            else:
+                searches.append((path, (path if staged_file is None else staged_file.source, needles)))
+        for (path, _), found in zip(searches, self._run_io(self._search_source, [search for _, search in searches])):
+            if found:
+                found_paths.add(path)
+        return found_paths
+
+    def _search_source(self, source: Path, needles: "list[bytes]") -> bool:
+        try:
+            with open(source, "rb") as source_file:
+                size = fstat(source_file.fileno()).st_size
+                self._count(files_scanned=1, bytes_scanned=size)
+                if size == 0:
+                    return False
+                with mmap(source_file.fileno(), 0, access=ACCESS_READ) as source_bytes:
+                    return any(source_bytes.find(needle) != -1 for needle in needles)
+        except (OSError, ValueError):
+            return True
+
+    def get_size(self, path: Path) -> int:
+        staged_file = self._files.get(path)
+        if staged_file is not None and staged_file.text is not None:
+            return len(staged_file.text)
+        return (staged_file.source if staged_file is not None else path).stat().st_size
+
+    # defers rewriting a file until the tree is flushed, where stream_transform(open_source, dest_file)
+    # streams it from its staged content straight into the output file instead of building it in memory
+    def transform(self, path: Path, stream_transform: Callable, encoding: str = None) -> None:
+        if path not in self._files:
+            self._files[path] = _StagedFile(source=path)
+        self._files[path].transform = stream_transform
+        self._files[path].encoding = encoding
+
+    def write(self, path: Path, text: str) -> None:
+        self._files[path] = _StagedFile(text=text)
+        self._removed.discard(path)
+        self._add_dir(path.parent)
+
+    # lists the files and directories directly inside a directory, like Path.iterdir()
+    def iterdir(self, directory: Path) -> "list[Path]":
+        children = set()
+        if directory.is_dir():
+            children.update(path for path in directory.iterdir() if not self.is_removed(path))
+        children.update(path for path in self._files if path.parent == directory)
+        children.update(path for path in self._dirs if path.parent == directory and path != directory)
+        return sorted(children)
+
+    # same results as directory.glob(pattern), including files that are only staged
+    def glob(self, directory: Path, pattern: str) -> "list[Path]":
+        matches = set(path for path in directory.glob(pattern) if not self.is_removed(path))
+        pathspec = compile_pathspec(pattern)
+        if pathspec is not None:
+            for path in self._files:
+                if directory in path.parents and match_pathspec(pathspec, path.relative_to(directory).parts, False):
+                    matches.add(path)
+        return list(matches)
+
+    # the staged files and directories inside a directory, as (path, is_dir) pairs
+    def get_staged_paths(self, directory: Path) -> "list[tuple[Path, bool]]":
+        staged_paths = [(path, False) for path in self._files if directory in path.parents]
+        staged_paths.extend((path, True) for path in self._dirs if path == directory or directory in path.parents)
+        return staged_paths
+
+    # writes every staged file to disk
+    def flush(self) -> None:
+        kept_dirs, kept_files = self._list_kept_paths()
+        for staged_dir in sorted(set(self._get_flush_path(directory) for directory in self._dirs) | set(kept_dirs)):
+            staged_dir.mkdir(parents=True, exist_ok=True)
+        self._run_io(self._flush_file, [(path, staged_file) for path, staged_file in self._files.items() if staged_file.transform is None])
+        self._run_io(self._carry_over, kept_files)
+        # streamed files are parsed as they are written, one at a time so their logs stay in order
+        for path, staged_file in self._files.items():
+            if staged_file.transform is not None:
+                self._flush_transformed(path, staged_file)
+        # removes files last since staged copies may still need to be made from them; files in swapped
+        # directories are removed by leaving them out
+        self._run_io(self._remove_file, [(removed_path,) for removed_path in self._removed
+                                         if self._get_flush_path(removed_path) == removed_path])
+        # then the removed directories that were left empty, deepest first
+        for removed_dir in sorted(self._removed_dirs - self._dirs, key=lambda path: len(path.parts), reverse=True):
+            if self._get_flush_path(removed_dir) == removed_dir and removed_dir.is_dir() and not any(removed_dir.iterdir()):
+                removed_dir.rmdir()
+        self._swap_dirs()
+        logger.debug(f"     >>> Wrote {self.counters['files_written']} staged files, {self.counters['files_unchanged']} were unchanged")
+        self._files.clear()
+        self._dirs.clear()
+        self._removed.clear()
+        self._removed_dirs.clear()
+        self._swapped.clear()
+
+    # where a path is written when the tree is flushed: inside a swapped directory, the same place in the
+    # directory built next to it
+    def _get_flush_path(self, path: Path) -> Path:
+        if self._swapped:
+            for directory in [path, *path.parents]:
+                if directory in self._swapped:
+                    return self._swapped[directory] / path.relative_to(directory)
+        return path
+
+    # the directories and files in swapped directories that are kept as they are: every one that isn't
+    # staged or removed, as the directories to create and (path, flush path) pairs to carry over
+    def _list_kept_paths(self) -> "tuple[list[Path], list[tuple[Path, Path]]]":
+        kept_dirs = []
+        kept_files = []
+        for directory, swap_path in self._swapped.items():
+            if not directory.is_dir() or directory.is_symlink():
+                continue
+            if directory not in self._removed_dirs:
+                kept_dirs.append(swap_path)
+            for path in directory.rglob("*"):
+                if path.is_dir() and not path.is_symlink():
+                    if path not in self._removed_dirs:
+                        kept_dirs.append(self._get_flush_path(path))
+                elif path not in self._files and path not in self._removed and not path.name.endswith(".variance-tmp"):
+                    kept_files.append((path, self._get_flush_path(path)))
+        return kept_dirs, kept_files
+
+    def _swap_dirs(self) -> None:
+        for directory, swap_path in self._swapped.items():
+            if swap_path.is_dir():
+                _replace_dir(swap_path, directory)
+            elif directory.is_dir() and not directory.is_symlink():
+                # everything in it was removed
+                old_dir = _get_swap_paths(directory)[1]
+                directory.rename(old_dir)
+                _remove_in_background(old_dir)
+
+    # puts a file that is already in the output in the directory built to replace it, without copying its contents
+    @staticmethod
+    def _carry_over(path: Path, flush_path: Path) -> None:
+        try:
+            link(path, flush_path, follow_symlinks=False)
+        except OSError:
+            copy2(path, flush_path, follow_symlinks=False)
+
+    def _flush_file(self, path: Path, staged_file: _StagedFile) -> None:
+        flush_path = self._get_flush_path(path)
+        if staged_file.modified:
+            self._flush_text(path, staged_file.text, flush_path)
+        elif staged_file.source != path:
+            self._flush_source(path, staged_file.source, flush_path)
+        elif flush_path != path:
+            self._carry_over(path, flush_path)
+
+    @staticmethod
+    def _remove_file(path: Path) -> None:
+        if path.is_file() or path.is_symlink():
+            path.unlink()
+
+    @staticmethod
+    def _is_up_to_date(path: Path, source: Path, link_mode: str) -> bool:
+        if link_mode == "symlink":
+            return path.is_symlink() and readlink(path) == relpath(source, path.parent)
+        if link_mode == "hardlink":
+            return path.is_file() and not path.is_symlink() and samefile(source, path)
+        # copies keep the source's mtime, so a matching size and mtime means the copy is up to date
+        return path.is_file() and not _is_link(path) and cmp(source, path, shallow=True)
+
+    # puts an unmodified file in place (at flush_path, when it is in a swapped directory) by copying or linking
+    # it, depending on the link mode
+    def _flush_source(self, path: Path, source: Path, flush_path: Path = None) -> None:
+        flush_path = flush_path or path
+        link_mode = self.link_mode
+        if self._is_up_to_date(path, source, link_mode):
+            self._count(files_unchanged=1)
+            if flush_path != path:
+                self._carry_over(path, flush_path)
+            return
+        # never writes through a link left by a previous run, which would change the root or variant file
+        if flush_path.is_symlink() or flush_path.exists():
+            flush_path.unlink()
+        if link_mode != "copy" and self._link(source, flush_path, link_mode):
+            self._count(files_linked=1)
+            return
+        copy2(source, flush_path)
+        self._count(files_written=1, bytes_written=flush_path.stat().st_size)
+
+    def _link(self, source: Path, path: Path, link_mode: str) -> bool:
+        try:
+            if link_mode == "hardlink":
+                link(source, path)
+            elif link_mode == "symlink":
+                path.symlink_to(relpath(source, path.parent))
+            else:
+                _reflink(source, path)
+            return True
+        except OSError as err:
+            # e.g. the output is on another filesystem, or the filesystem has no reflinks
+            message = f"     >>> Could not {link_mode} '{path}' to '{source}', copying files instead: {err}"
+            with self._lock:
+                if link_mode in _unsupported_link_modes:
+                    logger.debug(message)
+                else:
+                    logger.warning(message)
+                    _unsupported_link_modes.add(link_mode)
+                self.link_mode = "copy"
+            path.unlink(missing_ok=True)
+            return False
+
+    def _flush_text(self, path: Path, text: str, flush_path: Path = None) -> None:
+        flush_path = flush_path or path
+        # encodes the text the same way open(path, "w") would, to compare it with the file on disk
+        if linesep != "\n":
+            text = text.replace("\n", linesep)
+        data = text.encode(getpreferredencoding(False))
+        if _is_link(path):
+            # modified files get their own copy instead of writing into the file they are linked to
+            flush_path.unlink(missing_ok=True)
+        elif _has_contents(path, data):
+            self._count(files_unchanged=1)
+            if flush_path != path:
+                self._carry_over(path, flush_path)
+            return
+        with open(flush_path, "wb") as new_file:
+            new_file.write(data)
+        self._count(files_written=1, bytes_written=len(data))
+
+    def _flush_transformed(self, path: Path, staged_file: _StagedFile) -> None:
+        flush_path = self._get_flush_path(path)
+        # writes next to the output first since the source may be the output file itself
+        tmp_path = flush_path.with_name(f".{path.name}.variance-tmp")
+        try:
+            with open(tmp_path, "w") as new_file:
+                staged_file.transform(staged_file.open_source, new_file)
+                written_bytes = new_file.tell()
+            if path.is_file() and not _is_link(path) and cmp(tmp_path, path, shallow=False):
+                self._count(files_unchanged=1)
+                if flush_path != path:
+                    self._carry_over(path, flush_path)
+            else:
+                tmp_path.replace(flush_path)
+                self._count(files_written=1, bytes_written=written_bytes)
+            if staged_file.text is None:
+                self._count(files_read=1, bytes_read=staged_file.source.stat().st_size)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+
+# Uses the given staging tree, or a temporary one that is flushed once the block finishes so that
+# callers without a staging tree read and write straight through to disk
+@contextmanager
+def staged(staging: "StagingTree | None"):
+    if staging is not None:
+        yield staging
+        return
+    staging = StagingTree()
+    yield staging
+    staging.flush()
@@ -0,0 +1,72 @@
+from pathlib import Path
+from os import getcwd
+from src.staging import list_tree
+
+# root and variant layers resolved in this run, shared by every site that uses them, by working directory and
+# layer directory (which is much cheaper than resolving the layer directory every time one is looked up)
+_layers = {}
+# texts of the root and variant files read in this run, shared by every site's staging tree
+_source_texts = {}
+# token scans of the root and variant files, shared the same way
+_source_scans = {}
+
+
+# The files a device gets from its root directory or from one of its variant directories, relative to the
+# device directory. Each layer is only listed once per run, however many sites use it
+class VariantLayer():
+    def __init__(self) -> None:
+        self.files = {}
+        self.dirs = []
+        # whether the layer puts files in the device's 'tests' directory
+        self.has_tests = False
+
+    def _add_tree(self, src_dir: Path, dest_dir: Path) -> None:
+        files, dirs = list_tree(src_dir)
+        self.dirs.append(dest_dir)
+        self.dirs.extend(dest_dir / directory for directory in dirs)
+        self.files.update((dest_dir / path, src_path) for path, src_path in files.items())
+
+
+# root files go in 'config', except for a 'tests' folder which goes to the same level as 'config'
+def get_root_layer(device_type: str) -> VariantLayer:
+    root_dir = Path(f"./{device_type}_variants/root")
+    key = (getcwd(), root_dir)
+    if key not in _layers:
+        layer = VariantLayer()
+        layer._add_tree(root_dir, Path("config"))
+        cfg_test_dir = Path("config/tests")
+        if (root_dir / "tests").is_dir():
+            layer.has_tests = True
+            layer.files = {(Path("tests", *path.parts[2:]) if path.parts[:2] == cfg_test_dir.parts else path): src_path
+                           for path, src_path in layer.files.items()}
+            layer.dirs = [Path("tests", *directory.parts[2:]) if directory.parts[:2] == cfg_test_dir.parts else directory
+                          for directory in layer.dirs]
+        _layers[key] = layer
+    return _layers[key]
+
+# each subdirectory of a variant goes in the device's 'config' directory, except for 'tests' which goes next to it
+def get_variant_layer(device_type: str, variant: str) -> VariantLayer:
+    variant_dir = Path(f"./{device_type}_variants/{variant}")
+    key = (getcwd(), variant_dir)
+    if key not in _layers:
+        layer = VariantLayer()
+        for sub_dir in variant_dir.iterdir():
+            if sub_dir.name == "tests":
+                layer.has_tests = True
+                layer._add_tree(sub_dir, Path("tests"))
+            else:
+                layer._add_tree(sub_dir, Path("config") / sub_dir.name)
+        _layers[key] = layer
+    return _layers[key]
+
+def get_source_texts() -> dict:
+    return _source_texts
+
+def get_source_scans() -> dict:
+    return _source_scans
+
+# forgets every layer, text and scan, for when root or variant files may have changed since they were read
+def clear_layers() -> None:
+    _layers.clear()
+    _source_texts.clear()
+    _source_scans.clear()
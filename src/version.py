@@ -0,0 +1,2 @@
+# Bumped whenever a change to Variance could change the files it generates
+VARIANCE_VERSION = "1.1.0"
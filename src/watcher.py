@@ -0,0 +1,167 @@
+from src.logger import logger
+from abc import ABC, abstractmethod
+from pathlib import Path
+from os import read, walk
+from select import select
+from struct import calcsize, unpack_from
+from time import monotonic, sleep
+
+# inotify event flags (see inotify(7))
+_IN_MODIFY = 0x2
+_IN_ATTRIB = 0x4
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_DELETE_SELF = 0x400
+_IN_MOVE_SELF = 0x800
+_IN_Q_OVERFLOW = 0x4000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_WATCH_MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+               | _IN_DELETE_SELF | _IN_MOVE_SELF)
+# struct inotify_event without its name: wd, mask, cookie, len
+_EVENT_FORMAT = "iIII"
+_EVENT_SIZE = calcsize(_EVENT_FORMAT)
+
+# how long to wait for more changes after one is seen, so a burst of saves is rebuilt once
+DEFAULT_DEBOUNCE = 0.3
+# how often the polling watcher looks for changes
+DEFAULT_POLL_INTERVAL = 1.0
+
+
+# Reports changes to the files under some directories (watched recursively) and to the files directly in
+# others (e.g. a site directory, where only variance.yml matters and Variance's own output is ignored)
+class Watcher(ABC):
+    def __init__(self, recursive_dirs: "list[Path]", flat_dirs: "list[Path]") -> None:
+        self._recursive_dirs = recursive_dirs
+        self._flat_dirs = flat_dirs
+
+    # blocks until something changes, then until nothing has changed for debounce seconds, and returns every
+    # changed path; None means changes may have been missed, so everything should be considered changed
+    def wait_for_changes(self, debounce: float = DEFAULT_DEBOUNCE) -> "set[Path] | None":
+        changes = self._read_changes(None)
+        while changes is not None:
+            more_changes = self._read_changes(debounce)
+            if more_changes is None:
+                return None
+            if not more_changes:
+                break
+            changes.update(more_changes)
+        return changes
+
+    # the paths changed within timeout seconds (or until there is a change, if timeout is None)
+    @abstractmethod
+    def _read_changes(self, timeout: "float | None") -> "set[Path] | None":
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+# Uses Linux's inotify through ctypes, so changes are seen as soon as they happen without scanning anything
+class InotifyWatcher(Watcher):
+    def __init__(self, recursive_dirs: "list[Path]", flat_dirs: "list[Path]") -> None:
+        super().__init__(recursive_dirs, flat_dirs)
+        from ctypes import CDLL, get_errno
+        from ctypes.util import find_library
+        self._get_errno = get_errno
+        self._libc = CDLL(find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(self._get_errno(), "inotify_init1 failed")
+        # watch descriptor: (directory, whether its subdirectories are watched too)
+        self._watches = {}
+        for directory in recursive_dirs:
+            self._add_watches(directory)
+        for directory in flat_dirs:
+            self._add_watch(directory, False)
+
+    def _add_watch(self, directory: Path, recursive: bool) -> None:
+        watch_descriptor = self._libc.inotify_add_watch(self._fd, bytes(directory), _WATCH_MASK)
+        if watch_descriptor < 0:
+            raise OSError(self._get_errno(), f"could not watch '{directory}'")
+        self._watches[watch_descriptor] = (directory, recursive)
+
+    def _add_watches(self, directory: Path) -> None:
+        for dirpath, _, _ in walk(directory):
+            self._add_watch(Path(dirpath), True)
+
+    def _read_changes(self, timeout: "float | None") -> "set[Path] | None":
+        readable, _, _ = select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        changes = set()
+        data = read(self._fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            watch_descriptor, mask, _, name_length = unpack_from(_EVENT_FORMAT, data, offset)
+            name = data[offset + _EVENT_SIZE:offset + _EVENT_SIZE + name_length].rstrip(b"\0").decode()
+            offset += _EVENT_SIZE + name_length
+            if mask & _IN_Q_OVERFLOW:
+                logger.warning("   >>> Too many changes at once to tell them apart; treating everything as changed")
+                return None
+            if watch_descriptor not in self._watches:
+                continue
+            directory, recursive = self._watches[watch_descriptor]
+            path = directory / name if name else directory
+            if mask & (_IN_DELETE_SELF | _IN_MOVE_SELF):
+                del self._watches[watch_descriptor]
+            # new directories under a recursively watched one are watched too
+            if recursive and mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO) and path.is_dir():
+                self._add_watches(path)
+                changes.update(Path(dirpath) / filename for dirpath, _, filenames in walk(path) for filename in filenames)
+            changes.add(path)
+        return changes
+
+    def close(self) -> None:
+        from os import close
+        close(self._fd)
+
+
+# Compares the size and mtime of every watched file every poll_interval seconds, for platforms without inotify
+class PollingWatcher(Watcher):
+    def __init__(self, recursive_dirs: "list[Path]", flat_dirs: "list[Path]", poll_interval: float = DEFAULT_POLL_INTERVAL) -> None:
+        super().__init__(recursive_dirs, flat_dirs)
+        self._poll_interval = poll_interval
+        self._snapshot = self._take_snapshot()
+
+    def _take_snapshot(self) -> "dict[Path, tuple[int, int]]":
+        snapshot = {}
+        for directory in self._recursive_dirs:
+            for dirpath, _, filenames in walk(directory):
+                self._add_files(snapshot, Path(dirpath), filenames)
+        for directory in self._flat_dirs:
+            if directory.is_dir():
+                self._add_files(snapshot, directory, [path.name for path in directory.iterdir()])
+        return snapshot
+
+    @staticmethod
+    def _add_files(snapshot: dict, directory: Path, filenames: "list[str]") -> None:
+        for filename in filenames:
+            try:
+                file_stat = (directory / filename).stat()
+            except OSError:
+                continue
+            snapshot[directory / filename] = (file_stat.st_size, file_stat.st_mtime_ns)
+
+    def _read_changes(self, timeout: "float | None") -> "set[Path] | None":
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            sleep(self._poll_interval if deadline is None else max(0, min(self._poll_interval, deadline - monotonic())))
+            snapshot = self._take_snapshot()
+            changes = set(path for path in snapshot.keys() | self._snapshot.keys() if snapshot.get(path) != self._snapshot.get(path))
+            self._snapshot = snapshot
+            if changes or (deadline is not None and monotonic() >= deadline):
+                return changes
+
+
+# watches with inotify where it is available, and polls everywhere else
+def create_watcher(recursive_dirs: "list[Path]", flat_dirs: "list[Path]", poll_interval: float = DEFAULT_POLL_INTERVAL) -> Watcher:
+    try:
+        return InotifyWatcher(recursive_dirs, flat_dirs)
+    except (OSError, AttributeError) as err:
+        logger.info(f"   >>> inotify is not available ({err}); polling for changes every {poll_interval}s instead")
+        return PollingWatcher(recursive_dirs, flat_dirs, poll_interval)
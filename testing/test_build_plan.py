@@ -0,0 +1,121 @@
+from src.build_plan import compile_plan
+import pytest
+from pathlib import Path
+from yaml import safe_dump
+
+
+# Fixtures
+@pytest.fixture
+def plan_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    monkeypatch.chdir(tmp_path)
+    for filepath in ["twins_variants/root/modbus/a.json", "twins_variants/root/templates/client.json",
+                     "twins_variants/root/tests/test_a.json", "twins_variants/variant_1/modbus/b.json"]:
+        Path(filepath).parent.mkdir(parents=True, exist_ok=True)
+        Path(filepath).write_text('{"site": "{{SITE_ID}}"}')
+    return tmp_path
+
+def write_site(site_id: str, config: dict) -> Path:
+    site_dir = Path("config") / site_id
+    (site_dir / "twins").mkdir(parents=True)
+    with open(site_dir / "variance.yml", "w") as config_file:
+        safe_dump(config, config_file)
+    return site_dir
+
+# Actual testing
+
+# check that a site's tasks are planned in the order they run and that their files are estimated
+def test_compile_plan(plan_dir: Path):
+    site_dir = write_site("site_1", {
+        "twins_variant": "variant_1",
+        "twins_templates": [{"path": "templates/client.json",
+                             "filename_pattern": {"type": "sequential", "filename_template": "client_{{target}}.json", "from": 1, "to": 3}}],
+        "replacements": [{"target": "{{SITE_ID}}", "value": "site_1", "include": ["twins/**/*.json"]}],
+    })
+    plan = compile_plan([site_dir], ["twins"], estimate=True)
+    assert plan.get_errors() == []
+    tasks = plan.get_tasks()
+    assert [task.task_id for task in tasks] == ["site_1:twins:copy", "site_1:twins:expand_templates", "site_1:replacements",
+                                                "site_1:test_parsing", "site_1:write"]
+    assert [task.files for task in tasks] == [4, 3, 6, 1, 6]
+    assert tasks[0].bytes == 4 * len('{"site": "{{SITE_ID}}"}')
+    assert plan.sites[0].devices == {"twins": "variant_1"}
+
+    # only --plan needs the estimates, the rest of the plan is the same without them
+    unestimated_plan = compile_plan([site_dir], ["twins"])
+    assert [task.task_id for task in unestimated_plan.get_tasks()] == [task.task_id for task in tasks]
+    assert all(task.files == 0 and task.bytes == 0 for task in unestimated_plan.get_tasks())
+    assert unestimated_plan.sites[0].sources == plan.sites[0].sources
+
+## test cases
+## 0 - the device has variants but no variant key
+## 1 - the variant does not exist
+## 2 - the template's pattern type is not supported
+## 3 - a templated replacement has the wrong number of values
+## 4 - the template file does not exist
+## 5 - a replacement has no value
+## 6 - a replacement has a pattern Path.glob rejects
+@pytest.mark.parametrize("config, error", [
+    ({}, "has variants, but no variant key was found"),
+    ({"twins_variant": "variant_2"}, "is not a valid variant"),
+    ({"twins_variant": "root", "twins_templates": [{"path": "templates/client.json",
+                                                    "filename_pattern": {"type": "random", "filename_template": "c_{{target}}.json"}}]},
+     "twins_templates[0].filename_pattern.type 'random' is not supported"),
+    ({"twins_variant": "root", "twins_templates": [{"path": "templates/client.json",
+                                                    "filename_pattern": {"type": "list", "filename_template": "c_{{target}}.json", "list": ["a", "b"]},
+                                                    "templated_replacements": [{"target": "{{ID}}", "list": [1]}]}]},
+     "has 1 values for 2 expanded templates"),
+    ({"twins_variant": "root", "twins_templates": [{"path": "templates/dne.json",
+                                                    "filename_pattern": {"type": "list", "filename_template": "c_{{target}}.json", "list": ["a"]}}]},
+     "DNE or is not a file"),
+    ({"twins_variant": "root", "replacements": [{"target": "{{SITE_ID}}"}]}, "replacements[0] is missing 'value'"),
+    ({"twins_variant": "root", "replacements": [{"target": "{{SITE_ID}}", "value": "site_2", "include": ["/abs/*.json"]}]},
+     "replacements[0] has a pattern '/abs/*.json' that can't be used"),
+])
+def test_compile_plan_errors(plan_dir: Path, config: dict, error: str):
+    valid_site_dir = write_site("site_1", {"twins_variant": "root"})
+    invalid_site_dir = write_site("site_2", config)
+    plan = compile_plan([valid_site_dir, invalid_site_dir], ["twins"])
+    assert len(plan.get_errors()) == 1
+    assert plan.get_errors()[0].startswith("site_2: ") and error in plan.get_errors()[0]
+    assert error in plan.format()
+
+# check that an error in one part of a config doesn't hide the errors in the others
+def test_compile_plan_reports_every_error(plan_dir: Path):
+    site_dir = write_site("site_1", {
+        "twins_variant": "variant_2",
+        "replacements": [{"target": "{{SITE_ID}}"}],
+    })
+    plan = compile_plan([site_dir], ["twins"])
+    assert len(plan.get_errors()) == 2
+    assert "replacements[0] is missing 'value'" in plan.get_errors()[0]
+    assert "is not a valid variant" in plan.get_errors()[1]
+
+## test cases
+## 0 - a root file affects every site with the device
+## 1 - a variant file only affects the sites using that variant
+## 2 - a site's variance.yml affects all of its devices
+## 3 - Variance's own output and unrelated files affect nothing
+@pytest.mark.parametrize("changed_paths, affected_devices", [
+    ({Path("twins_variants/root/modbus/a.json")}, {"site_1": {"twins"}, "site_2": {"twins"}}),
+    ({Path("twins_variants/variant_1/modbus/b.json")}, {"site_2": {"twins"}}),
+    ({Path("config/site_1/variance.yml")}, {"site_1": {"twins"}}),
+    ({Path("config/site_1/twins/config/modbus/a.json"), Path("README.md")}, {}),
+])
+def test_get_affected_devices(plan_dir: Path, changed_paths: "set[Path]", affected_devices: dict):
+    plan = compile_plan([write_site("site_1", {"twins_variant": "root"}), write_site("site_2", {"twins_variant": "variant_1"})], ["twins"])
+    assert plan.get_affected_devices(changed_paths) == {Path("config") / site_id: device_types
+                                                         for site_id, device_types in affected_devices.items()}
+
+# check that every root, variant and template file maps back to the sites and devices built from it
+def test_get_dependency_index(plan_dir: Path):
+    site_1_dir = write_site("site_1", {"twins_variant": "root"})
+    site_2_dir = write_site("site_2", {"twins_variant": "variant_1",
+                                       "twins_templates": [{"path": "templates/client.json",
+                                                            "filename_pattern": {"type": "list", "filename_template": "c_{{target}}.json", "list": ["a"]}}]})
+    plan = compile_plan([site_1_dir, site_2_dir], ["twins"])
+    dependency_index = plan.get_dependency_index()
+    assert dependency_index[Path("twins_variants/root/modbus/a.json")] == {site_1_dir: {"twins"}, site_2_dir: {"twins"}}
+    assert dependency_index[Path("twins_variants/root/templates/client.json")] == {site_1_dir: {"twins"}, site_2_dir: {"twins"}}
+    assert dependency_index[Path("twins_variants/variant_1/modbus/b.json")] == {site_2_dir: {"twins"}}
+    assert dependency_index[site_2_dir / "variance.yml"] == {site_2_dir: {"twins"}}
+    assert [site_plan.site_dir for site_plan in plan.select_sites({site_2_dir}).sites] == [site_2_dir]
@@ -0,0 +1,78 @@
+from src.build_plan import compile_plan
+from src.cli import FLEXGEN_DEVICES, main, process_site, run_sites
+from src.manifest import clear_file_caches
+from src.variant_overlay import clear_layers
+import pytest
+import sys
+from pathlib import Path
+from yaml import safe_dump
+
+
+# Fixtures
+@pytest.fixture
+def fleet_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    monkeypatch.chdir(tmp_path)
+    # layers and file hashes are cached by relative path, which every test's fleet shares
+    clear_layers()
+    clear_file_caches()
+    for filepath in ["twins_variants/root/modbus/a.json", "twins_variants/root/tests/test_a.json"]:
+        Path(filepath).parent.mkdir(parents=True, exist_ok=True)
+        Path(filepath).write_text('{"file": "a"}')
+    yield tmp_path
+    clear_layers()
+    clear_file_caches()
+
+def write_site(site_id: str, config: dict) -> Path:
+    site_dir = Path("config") / site_id
+    (site_dir / "twins").mkdir(parents=True)
+    with open(site_dir / "variance.yml", "w") as config_file:
+        safe_dump(config, config_file)
+    return site_dir
+
+# Actual testing
+
+# check that a device is regenerated when the link mode changes, so its files are copies after switching to "copy"
+def test_link_mode_change(fleet_dir: Path):
+    site_dir = write_site("site_1", {"replacements": []})
+    output_file = site_dir / "twins" / "config" / "modbus" / "a.json"
+    process_site(site_dir, {"link_mode": "symlink"})
+    assert output_file.is_symlink()
+
+    site_report = process_site(site_dir, {"link_mode": "copy"})
+    assert not site_report["skipped"]
+    assert output_file.is_file() and not output_file.is_symlink()
+    assert output_file.read_text() == '{"file": "a"}'
+
+    # nothing changed since the copies were made
+    assert process_site(site_dir, {"link_mode": "copy"})["skipped"]
+
+# check that no site is generated when a site has errors in its config, unless --keep_going is set, in which case
+# the other sites are; the run fails either way
+## test cases
+## 0, 1 - stops before generating anything, with one job and in worker processes
+## 2, 3 - generates the healthy site with --keep_going, with one job and in worker processes
+@pytest.mark.parametrize("jobs, keep_going", [("1", False), ("2", False), ("1", True), ("2", True)])
+def test_main_plan_errors(fleet_dir: Path, monkeypatch: pytest.MonkeyPatch, jobs: str, keep_going: bool):
+    healthy_site_dir = write_site("site_1", {"replacements": []})
+    broken_site_dir = write_site("site_2", {"twins_variant": "variant_dne"})
+    argv = ["variance.py", "--jobs", jobs, "--log_file", str(fleet_dir / "variance.log")] + (["--keep_going"] if keep_going else [])
+    monkeypatch.setattr(sys, "argv", argv)
+    with pytest.raises(SystemExit) as exit_info:
+        main()
+    assert exit_info.value.code == 1
+    assert (healthy_site_dir / "twins" / "config" / "modbus" / "a.json").is_file() == keep_going
+    assert not (broken_site_dir / "twins" / "config").exists()
+
+# check that every site is generated when one of them fails, one at a time or in worker processes, and that the
+# failed site is reported in the order of the sites
+@pytest.mark.parametrize("jobs", [(1), (2)])
+def test_run_sites_jobs(fleet_dir: Path, jobs: int):
+    site_dirs = [write_site("site_1", {"replacements": []}), write_site("site_2", {"twins_variant": "variant_dne"}),
+                 write_site("site_3", {"replacements": []})]
+    failed_sites, site_reports = run_sites(compile_plan(site_dirs, FLEXGEN_DEVICES), "warning", jobs)
+    assert failed_sites == ["site_2"]
+    assert [site_report["site"] for site_report in site_reports] == ["site_1", "site_2", "site_3"]
+    assert site_reports[1]["failed"]
+    for site_dir in [site_dirs[0], site_dirs[2]]:
+        assert (site_dir / "twins" / "config" / "modbus" / "a.json").is_file()
+    assert not (site_dirs[1] / "twins" / "config").exists()
@@ -1,4 +1,5 @@
-from src.device import Device
+from src.device import Device, _render_cache
+from src.staging import StagingTree
 import pytest
 from pathlib import Path
 import shutil
@@ -371,4 +372,87 @@ def test_expand_templates(expected_files: "list[Path]", template_objs: "list[dic
         full_templated_filepath = sc_config_path / template["path"]
         if full_templated_filepath.exists():
             assert False
-    assert True
\ No newline at end of file
+    assert True
+
+# check that only the previously generated files are removed when they are known
+def test_clear_prev_files_generated_only(sc_config_path: Path, sc_tests_path: Path, root_sc_device: Device):
+    if sc_config_path.exists():
+        shutil.rmtree(sc_config_path)
+    if sc_tests_path.exists():
+        shutil.rmtree(sc_tests_path)
+    (sc_config_path / "generated").mkdir(parents=True)
+    sc_tests_path.mkdir()
+    for filepath in [sc_config_path / "generated" / "gen.json", sc_config_path / "user.json", sc_tests_path / "test_gen.json"]:
+        with open(filepath, "w") as file:
+            file.write("test")
+    root_sc_device.clear_prev_files(["config/generated/gen.json", "tests/test_gen.json"])
+    assert (sc_config_path / "user.json").exists()
+    assert not (sc_config_path / "generated").exists()
+    assert not sc_tests_path.exists()
+    shutil.rmtree(sc_config_path)
+
+## test cases
+## 0 - every file rendered with all of its replacements
+## 1 - file name generated twice keeps the replacements made for its first value
+@pytest.mark.parametrize("filename_list, expected_contents", [
+    (["a", "b"], {"test_a.json": "ess_1 at 10.0.0.1, ess_1", "test_b.json": "ess_2 at 10.0.0.2, ess_2"}),
+    (["a", "a"], {"test_a.json": "ess_1 at 10.0.0.1, ess_1"}),
+])
+def test_expand_templates_contents(filename_list: "list[str]", expected_contents: "dict[str, str]", sc_config_path: Path, root_sc_device: Device):
+    template_path = sc_config_path / "contents" / "test_template.json"
+    template_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(template_path, "w") as file:
+        file.write("{{ESS_ID}} at {{ESS_IP}}, {{ESS_ID}}")
+    root_sc_device.templates = [{
+        "path": "contents/test_template.json",
+        "filename_pattern": {"type": "list", "filename_template": "test_{{target}}.json", "list": filename_list},
+        "templated_replacements": [
+            {"target": "{{ESS_ID}}", "list": ["ess_1", "ess_2"]},
+            {"target": "{{ESS_IP}}", "list": ["10.0.0.1", "10.0.0.2"]}
+        ]
+    }]
+    root_sc_device.expand_templates()
+    assert not template_path.exists()
+    assert {path.name: path.read_text() for path in template_path.parent.iterdir()} == expected_contents
+    shutil.rmtree(template_path.parent)
+
+# check that a second site expanding the same template entry reuses the first site's rendered files
+def test_expand_templates_render_cache(sc_config_path: Path):
+    template_entry = {
+        "path": "cached/test_template.json",
+        "filename_pattern": {"type": "sequential", "filename_template": "test_{{target}}.json", "from": 1, "to": 2},
+        "templated_replacements": [{"target": "{{ESS_ID}}"}]
+    }
+    devices = [Device("site-controller", "test_site"), Device("site-controller", "test_site_2")]
+    for device in devices:
+        template_path = device.get_directory() / "config" / "cached" / "test_template.json"
+        template_path.parent.mkdir(parents=True, exist_ok=True)
+        template_path.write_text("ess_{{ESS_ID}}: {{ESS_ID}}")
+        device.templates = [template_entry]
+        device.expand_templates()
+        assert {path.name: path.read_text() for path in template_path.parent.iterdir()} == {"test_1.json": "ess_1: 1", "test_2.json": "ess_2: 2"}
+        assert device.substitutions == 4
+        shutil.rmtree(template_path.parent)
+    shutil.rmtree(devices[1].get_directory().parent)
+    assert any(render_key[0] == "ess_{{ESS_ID}}: {{ESS_ID}}" for render_key in _render_cache)
+
+# check that a template without any of its templated targets is expanded into copies of itself without being read
+def test_expand_templates_without_targets(sc_config_path: Path):
+    template_entry = {
+        "path": "untargeted/test_template.json",
+        "filename_pattern": {"type": "list", "filename_template": "test_{{target}}.json", "list": ["a", "b"]},
+        "templated_replacements": [{"target": "{{ESS_ID}}"}]
+    }
+    device = Device("site-controller", "test_site")
+    template_path = device.get_directory() / "config" / "untargeted" / "test_template.json"
+    template_path.parent.mkdir(parents=True, exist_ok=True)
+    template_path.write_text("{{SITE_ID}}: no templated targets")
+    device.templates = [template_entry]
+    device.staging = StagingTree()
+    device.expand_templates()
+    device.staging.flush()
+    assert {path.name: path.read_text() for path in template_path.parent.iterdir()} == {
+        "test_a.json": "{{SITE_ID}}: no templated targets", "test_b.json": "{{SITE_ID}}: no templated targets"}
+    assert device.staging.counters["files_read"] == 0
+    assert device.unmatched_replacements == ["{{ESS_ID}}"]
+    shutil.rmtree(template_path.parent)
@@ -0,0 +1,67 @@
+from src.expressions import AVR_EXPRESSION_PATTERN, evaluate_expressions, find_unreplaced_wildcard, get_avr_groups
+import pytest
+from re import compile
+from time import perf_counter
+
+
+# Fixtures
+@pytest.fixture
+def original_avr_pattern():
+    return compile(r"(?:100)([+-])(?:((?:\d*.)(?:\d+))(?:\*))?(\d+)(?:(?:\*\()(\d+)([+-])(\d+)(?:\)))?")
+
+# Actual testing
+
+## test cases
+## 0 - plain string
+## 1 - string with digits but no expression
+## 2 - whole string is a coefficient expression
+## 3 - coefficient expression inside a sentence
+## 4 - whole string is an AVR expression
+## 5 - AVR expression with POI and deadband voltages
+## 6 - AVR expression inside a sentence
+## 7 - AVR expression without a coefficient
+## 8 - number with no coefficient
+## 9 - negative coefficient
+@pytest.mark.parametrize("search_string, expected_result", [
+    ("flexgen_ess_01"              , "flexgen_ess_01"       ),
+    ("site 1000 and 12.5"          , "site 1000 and 12.5"   ),
+    ("2.5*4"                       , 10.0                   ),
+    ("issue a 7.5*10 kW cmd"       , "issue a 75.0 kW cmd"  ),
+    ("100+.5*5"                    , 102.5                  ),
+    ("100-.5*5*(12000+50)"         , 11748.75               ),
+    ("set 100-.5*5 percent"        , "set 97.5 percent"     ),
+    ("100-5"                       , 95.0                   ),
+    ("2000"                        , "2000"                 ),
+    ("-.75*2000"                   , -1500.0                ),
+])
+def test_evaluate_expressions(search_string: str, expected_result):
+    assert evaluate_expressions(search_string) == expected_result
+
+## test cases
+## 0 - coefficient with a decimal point
+## 1 - multi-digit coefficient
+## 2 - coefficient with a non-digit in the middle
+## 3 - no coefficient
+## 4 - digits that are not followed by a '*'
+@pytest.mark.parametrize("search_string", [("100-.5*5"), ("100-25*3"), ("100+1e1*2"), ("100-7"), ("100-123x5")])
+def test_avr_pattern_matches_original(search_string: str, original_avr_pattern):
+    match = AVR_EXPRESSION_PATTERN.search(search_string)
+    original_match = original_avr_pattern.search(search_string)
+    assert get_avr_groups(match) == original_match.groups()
+    assert match.span() == original_match.span()
+
+# check that a long run of digits after an AVR prefix is matched without backtracking through every split of the digits
+def test_avr_pattern_no_backtracking():
+    search_string = "100-" + "1" * 20000 + "x"
+    start = perf_counter()
+    match = AVR_EXPRESSION_PATTERN.search(search_string)
+    assert perf_counter() - start < 0.5
+    assert get_avr_groups(match) == ("-", None, "1" * 20000, None, None, None)
+
+## test cases
+## 0 - string starting with a wildcard
+## 1 - wildcard that is not at the start of the string
+## 2 - no wildcard
+@pytest.mark.parametrize("search_string, expected_result", [("{{SITE_ID}}_ess", "{{SITE_ID}}_ess"), ("site {{SITE_ID}}", None), ("{{ not a wildcard", None)])
+def test_find_unreplaced_wildcard(search_string: str, expected_result):
+    assert find_unreplaced_wildcard(search_string) == expected_result
@@ -0,0 +1,59 @@
+from src.file_index import FileIndex
+from src.staging import StagingTree
+import pytest
+from pathlib import Path
+
+
+# Fixtures
+@pytest.fixture
+def index_site_dir(tmp_path: Path) -> Path:
+    site_dir = tmp_path / "site"
+    for filepath in ["variance.yml", "ess-controller/config/a.json", "ess-controller/config/sub/b.json", "ess-controller/tests/test_1.json",
+                     "site-controller/config/c.json", "site-controller/config/.hidden.json", "notes.txt"]:
+        (site_dir / filepath).parent.mkdir(parents=True, exist_ok=True)
+        with open(site_dir / filepath, "w") as file:
+            file.write(filepath)
+    (site_dir / "twins" / "empty_dir").mkdir(parents=True)
+    return site_dir
+
+# Actual testing
+
+## test cases
+## 0 - every file and directory
+## 1 - single wildcard
+## 2 - recursive wildcard with a literal directory first
+## 3 - recursive wildcard in the middle of the pattern
+## 4 - exact filename
+## 5 - wildcard directory
+## 6 - trailing recursive wildcard (directories only)
+## 7 - character ranges and single character wildcards
+## 8 - leading './' and doubled slashes
+## 9 - file that doesn't exist
+## 10 - '..' segment (left to Path.glob)
+@pytest.mark.parametrize("pattern", [("**/*"), ("*"), ("ess-controller/**/*.json"), ("**/config/*.json"), ("variance.yml"), ("*/config/*"),
+                                     ("ess-controller/**"), ("*-controller/config/[a-c].jso?"), ("./ess-controller//tests/*"),
+                                     ("missing.json"), ("twins/../notes.txt")])
+def test_glob_matches_pathlib(index_site_dir: Path, pattern: str):
+    assert sorted(FileIndex(index_site_dir).glob(pattern)) == sorted(index_site_dir.glob(pattern))
+
+def test_glob_includes_staged_files(index_site_dir: Path):
+    staging = StagingTree()
+    staging.write(index_site_dir / "twins" / "config" / "d.json", "d")
+    staging.remove(index_site_dir / "site-controller" / "config" / "c.json")
+    matches = FileIndex(index_site_dir, staging).glob("*/config/*.json")
+    assert sorted(path.relative_to(index_site_dir).as_posix() for path in matches) == ["ess-controller/config/a.json", "site-controller/config/.hidden.json",
+                                                                                             "twins/config/d.json"]
+
+def test_glob_shares_paths(index_site_dir: Path):
+    file_index = FileIndex(index_site_dir)
+    recursive_matches = {path: path for path in file_index.glob("**/*.json")}
+    for path in file_index.glob("ess-controller/config/*.json"):
+        assert recursive_matches[path] is path
+
+## test cases
+## 0 - absolute pattern
+## 1 - empty pattern
+@pytest.mark.parametrize("pattern, error", [("/", NotImplementedError), ("", ValueError)])
+def test_unsupported_pattern(index_site_dir: Path, pattern: str, error):
+    with pytest.raises(error):
+        FileIndex(index_site_dir).glob(pattern)
@@ -0,0 +1,68 @@
+from src import json_stream
+from src.json_stream import DuplicateKeyError, transform_json_stream
+from src.expressions import evaluate_expressions
+import pytest
+from io import StringIO
+from json import JSONDecodeError, dumps, loads
+
+
+def walk(obj):
+    if isinstance(obj, dict):
+        return {key: walk(value) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [walk(value) for value in obj]
+    if isinstance(obj, str):
+        return evaluate_expressions(obj)
+    return obj
+
+def stream(text: str) -> str:
+    dest = StringIO()
+    transform_json_stream(StringIO(text), dest, evaluate_expressions)
+    return dest.getvalue()
+
+# Actual testing
+
+## test cases
+## 0 - empty object
+## 1 - empty array
+## 2 - top-level scalar
+## 3 - nested objects and arrays, including empty ones
+## 4 - numbers, constants and escaped strings
+## 5 - strings that are numerical expressions
+## 6 - compact input with extra whitespace around the document
+@pytest.mark.parametrize("json_text", [
+    '{}',
+    '[]',
+    '"100-.5*5"',
+    '{"a": {"b": [1, [], {}, [2, {"c": "d"}]]}, "e": {}}',
+    '[-0.5e-3, 1E+2, 12, true, false, null, NaN, -Infinity, "\\u00e9\\n\\"x\\"", "\\ud83d\\ude00"]',
+    '{"cmd": "2.5*4", "avr": ["100-.5*5*(12000+50)", "set 100-.5*5 percent"], "name": "ess_01"}',
+    '  \n{"a":[1,2,{"b":"c"}],"d":"e"}\n  ',
+])
+@pytest.mark.parametrize("chunk_size", [1, 3, 1 << 16])
+def test_matches_in_memory_parsing(monkeypatch, json_text: str, chunk_size: int):
+    monkeypatch.setattr(json_stream, "CHUNK_SIZE", chunk_size)
+    assert stream(json_text) == dumps(walk(loads(json_text)), indent=4)
+
+## test cases
+## 0 - missing delimiter
+## 1 - trailing comma
+## 2 - unquoted key
+## 3 - extra data after the document
+## 4 - unterminated string
+## 5 - empty document
+@pytest.mark.parametrize("json_text", [
+    '{"a" 1}',
+    '[1, 2,]',
+    '{a: 1}',
+    '{} {}',
+    '["abc',
+    '',
+])
+def test_invalid_json(json_text: str):
+    with pytest.raises(JSONDecodeError):
+        stream(json_text)
+
+def test_duplicate_key():
+    with pytest.raises(DuplicateKeyError):
+        stream('{"a": 1, "b": {"a": 2}, "a": 3}')
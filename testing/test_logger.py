@@ -0,0 +1,24 @@
+from src.logger import logger, set_console_level, set_file_logging
+from logging import DEBUG, INFO, WARNING
+from pathlib import Path
+
+
+# check that the log file only gets records of its level and that filtered records are dropped up front
+def test_set_file_logging(tmp_path: Path):
+    console_level = logger.handlers[0].level
+    set_console_level(WARNING)
+    set_file_logging(tmp_path / "info.log", INFO)
+    assert not logger.isEnabledFor(DEBUG)
+    logger.debug("debug record %s", 1)
+    logger.info("info record %s", 2)
+    # switching files waits for the queued records to be written
+    set_file_logging(tmp_path / "debug.log", DEBUG)
+    assert logger.isEnabledFor(DEBUG)
+    logger.debug("debug record %s", 3)
+    set_file_logging(Path("variance.log"), DEBUG)
+    set_console_level(console_level)
+
+    info_log = (tmp_path / "info.log").read_text()
+    assert "info record 2" in info_log
+    assert "debug record" not in info_log
+    assert "debug record 3" in (tmp_path / "debug.log").read_text()
@@ -0,0 +1,80 @@
+from src.manifest import Manifest, MANIFEST_FILENAME
+import pytest
+from pathlib import Path
+
+
+# Fixtures
+@pytest.fixture
+def manifest_site_dir(tmp_path: Path) -> Path:
+    site_dir = tmp_path / "manifest_site"
+    (site_dir / "site-controller" / "config").mkdir(parents=True)
+    with open(site_dir / "variance.yml", "w") as config_file:
+        config_file.write("replacements: []")
+    return site_dir
+
+@pytest.fixture
+def site_cfg() -> dict:
+    return {"replacements": [{"target": "{{SITE_ID}}", "value": "test_site"}]}
+
+# Actual testing
+
+def test_hash_device_inputs_stable(manifest_site_dir: Path, site_cfg: dict):
+    first_hash = Manifest(manifest_site_dir).hash_device_inputs("site-controller", "root", site_cfg)
+    second_hash = Manifest(manifest_site_dir).hash_device_inputs("site-controller", "root", site_cfg)
+    assert first_hash == second_hash
+
+## test cases
+## 0 - different variant
+## 1 - different templates
+## 2 - different replacements
+@pytest.mark.parametrize("device_type, variant, changed_cfg", [
+    ("ess-controller" , "test_type_1", {}                                                             ),
+    ("site-controller", "root"       , {"site-controller_templates": [{"path": "sc_template.json"}]} ),
+    ("site-controller", "root"       , {"replacements": [{"target": "{{SITE_ID}}", "value": "other"}]}),
+])
+def test_hash_device_inputs_changes(manifest_site_dir: Path, site_cfg: dict, device_type: str, variant: str, changed_cfg: dict):
+    manifest = Manifest(manifest_site_dir)
+    original_hash = manifest.hash_device_inputs(device_type, "root", site_cfg)
+    assert manifest.hash_device_inputs(device_type, variant, dict(site_cfg, **changed_cfg)) != original_hash
+
+# check that the link mode is part of a device's inputs, since it changes what is in its directories
+def test_hash_device_inputs_link_mode(manifest_site_dir: Path, site_cfg: dict):
+    manifest = Manifest(manifest_site_dir)
+    copy_hash = manifest.hash_device_inputs("site-controller", "root", site_cfg)
+    assert manifest.hash_device_inputs("site-controller", "root", site_cfg, "copy") == copy_hash
+    assert manifest.hash_device_inputs("site-controller", "root", site_cfg, "symlink") != copy_hash
+
+# check that a device recorded in a saved manifest is reported as unchanged on the next run
+def test_is_device_unchanged(manifest_site_dir: Path, site_cfg: dict):
+    device_dir = manifest_site_dir / "site-controller"
+    manifest = Manifest(manifest_site_dir)
+    manifest.hash_config_file()
+    inputs_hash = manifest.hash_device_inputs("site-controller", "root", site_cfg)
+    assert not manifest.is_device_unchanged(device_dir, inputs_hash)
+    manifest.record_device("site-controller", inputs_hash, ["config/file.json"])
+    manifest.save()
+    assert (manifest_site_dir / MANIFEST_FILENAME).is_file()
+
+    next_manifest = Manifest(manifest_site_dir)
+    next_manifest.hash_config_file()
+    assert next_manifest.is_config_unchanged()
+    assert next_manifest.is_device_unchanged(device_dir, inputs_hash)
+    assert not next_manifest.is_device_unchanged(device_dir, "different inputs")
+    assert next_manifest.get_generated_files("site-controller") == ["config/file.json"]
+    assert next_manifest.get_generated_files("twins") is None
+
+# check that a device is regenerated if its output directory was removed
+def test_is_device_unchanged_outputs_removed(manifest_site_dir: Path, site_cfg: dict):
+    device_dir = manifest_site_dir / "site-controller"
+    manifest = Manifest(manifest_site_dir)
+    inputs_hash = manifest.hash_device_inputs("site-controller", "root", site_cfg)
+    manifest.record_device("site-controller", inputs_hash, ["config/file.json"])
+    manifest.save()
+    (device_dir / "config").rmdir()
+    assert not Manifest(manifest_site_dir).is_device_unchanged(device_dir, inputs_hash)
+
+def test_discard(manifest_site_dir: Path):
+    manifest = Manifest(manifest_site_dir)
+    manifest.save()
+    manifest.discard()
+    assert not (manifest_site_dir / MANIFEST_FILENAME).exists()
@@ -180,6 +180,13 @@ def test_initialize_target_replacement(tmp_dir: Path, target_replacement_test_di
             assert False, f" looking for {(tmp_dir / target_replacement_test_dir_name / item)}"
     assert True
 
+# check that a value variance.yml holds as a number is written the way str() writes it
+@pytest.mark.parametrize("value, expected_value", [(502, "502"), (0.5, "0.5")])
+def test_target_replacement_number_value(tmp_dir: Path, target_replacement_test_dir_name: str, value, expected_value: str):
+    replacement = TargetReplacement({"target": "{{TEST_7}}", "value": value, "include": ["target_i*"]},
+                                    (tmp_dir / target_replacement_test_dir_name))
+    assert replacement.values == [expected_value]
+
 ## test cases
 ## 0 - replacement config replaces in one file
 ## 1 - replacement config has a target that doesn't exist in the file
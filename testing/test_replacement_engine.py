@@ -0,0 +1,137 @@
+from src.replacement import TargetReplacement
+from src.replacement_engine import ReplacementEngine, is_literal_target
+from src.staging import StagingTree
+import pytest
+from pathlib import Path
+
+
+# Fixtures
+@pytest.fixture
+def replacement_site_dir(tmp_path: Path) -> Path:
+    site_dir = tmp_path / "replacement_engine_site"
+    site_dir.mkdir()
+    return site_dir
+
+def write_files(site_dir: Path, file_contents: "dict[str, str]") -> None:
+    for filename, contents in file_contents.items():
+        with open(site_dir / filename, "w") as file:
+            file.write(contents)
+
+def read_files(site_dir: Path, filenames: "list[str]") -> "dict[str, str]":
+    contents = {}
+    for filename in filenames:
+        with open(site_dir / filename, "r") as file:
+            contents[filename] = file.read()
+    return contents
+
+# Actual testing
+
+## test cases
+## 0 - '{{...}}' style target
+## 1 - plain word target
+## 2 - target with a regex character class
+## 3 - target with a regex repetition
+## 4 - target with an escaped character
+@pytest.mark.parametrize("target, expected_result", [
+    ("{{SITE_ID}}"        , True ),
+    ("\"{{LOWER_MAX}}\""  , True ),
+    ("VAL_[0-9]+"         , False),
+    ("{{ID{2}}}"          , False),
+    ("\\{\\{SITE_ID\\}\\}", False)
+])
+def test_is_literal_target(target: str, expected_result: bool):
+    assert is_literal_target(target) == expected_result
+
+## test cases
+## 0 - independent literal targets
+## 1 - a value containing a later target (chained replacement)
+## 2 - overlapping targets
+## 3 - repeated target with a different value
+## 4 - regex target between literal targets
+## 5 - value that joins surrounding text into a later target
+## 6 - value with a group reference
+@pytest.mark.parametrize("replacement_dicts, file_contents", [
+    (
+        [{"target": "{{SITE_ID}}", "value": "site"}, {"target": "{{EMC_ID}}", "value": "emc"}],
+        "{{SITE_ID}} {{EMC_ID}} {{SITE_ID}}_{{OTHER}}"
+    ),
+    (
+        [{"target": "{{A}}", "value": "x{{B}}"}, {"target": "{{B}}", "value": "bee"}],
+        "{{A}} and {{B}}"
+    ),
+    (
+        [{"target": "bc", "value": "BC"}, {"target": "ab", "value": "AB"}],
+        "abc ab bc"
+    ),
+    (
+        [{"target": "{{IP}}", "value": "1.1.1.1"}, {"target": "{{IP}}", "value": "0.0.0.0"}],
+        "{{IP}}:{{IP}}"
+    ),
+    (
+        [{"target": "{{ID}}", "value": "VAL_1"}, {"target": "VAL_[0-9]+", "value": "num"}, {"target": "{{NAME}}", "value": "name"}],
+        "{{ID}} VAL_22 {{NAME}}"
+    ),
+    (
+        [{"target": "{{GAP}}", "value": ""}, {"target": "ab", "value": "AB"}],
+        "a{{GAP}}b"
+    ),
+    (
+        [{"target": "{{QUOTE}}", "value": "\\g<0>!"}, {"target": "{{OTHER}}", "value": "other"}],
+        "{{QUOTE}} {{OTHER}}"
+    )
+])
+def test_process_replacements_matches_sequential(replacement_site_dir: Path, replacement_dicts: "list[dict]", file_contents: str):
+    for replacement_dict in replacement_dicts:
+        replacement_dict["include"] = ["*.json"]
+    filenames = ["sequential.json", "engine.json"]
+    write_files(replacement_site_dir, {filename: file_contents for filename in filenames})
+
+    sequential_replacements = [TargetReplacement(dict(replacement_dict, include=["sequential.json"]), replacement_site_dir)
+                               for replacement_dict in replacement_dicts]
+    for replacement in sequential_replacements:
+        replacement.process_replacements()
+    engine_replacements = [TargetReplacement(dict(replacement_dict, include=["engine.json"]), replacement_site_dir)
+                           for replacement_dict in replacement_dicts]
+    ReplacementEngine(engine_replacements).process_replacements()
+
+    results = read_files(replacement_site_dir, filenames)
+    assert results["engine.json"] == results["sequential.json"]
+
+# check that each file only receives the replacements whose include/exclude fields select it
+def test_process_replacements_per_file(replacement_site_dir: Path):
+    write_files(replacement_site_dir, {"a.json": "{{X}} {{Y}}", "b.json": "{{X}} {{Y}}"})
+    replacements = [
+        TargetReplacement({"target": "{{X}}", "value": "x", "include": ["*.json"], "exclude": ["b.json"]}, replacement_site_dir),
+        TargetReplacement({"target": "{{Y}}", "value": "y", "include": ["b.json"]}, replacement_site_dir)
+    ]
+    ReplacementEngine(replacements).process_replacements()
+    assert read_files(replacement_site_dir, ["a.json", "b.json"]) == {"a.json": "x {{Y}}", "b.json": "{{X}} y"}
+
+# check that the replacements made are counted for each replacement, including ones made in the same pass
+def test_process_replacements_counts_substitutions(replacement_site_dir: Path):
+    write_files(replacement_site_dir, {"a.json": "{{X}} {{Y}} {{X}} VAL_1 VAL_22"})
+    replacements = [
+        TargetReplacement({"target": "{{X}}", "value": "x", "include": ["*.json"]}, replacement_site_dir),
+        TargetReplacement({"target": "{{Y}}", "value": "y", "include": ["*.json"]}, replacement_site_dir),
+        TargetReplacement({"target": "VAL_[0-9]+", "value": "v", "include": ["*.json"]}, replacement_site_dir),
+        TargetReplacement({"target": "{{Z}}", "value": "z", "include": ["*.json"]}, replacement_site_dir)
+    ]
+    ReplacementEngine(replacements).process_replacements()
+    assert [replacement.substitutions for replacement in replacements] == [2, 1, 2, 0]
+
+# check that files without any of their literal targets and binary files are left unread, while files with a regex
+# target are still read
+def test_process_replacements_skips_files_without_targets(replacement_site_dir: Path):
+    write_files(replacement_site_dir, {"a.json": "{{X}}", "b.json": "nothing to replace", "c.json": "VAL_1"})
+    (replacement_site_dir / "d.bin").write_bytes(b"{{X}} VAL_1 \0\xff")
+    replacements = [
+        TargetReplacement({"target": "{{X}}", "value": "x", "include": ["*"]}, replacement_site_dir),
+        TargetReplacement({"target": "VAL_[0-9]+", "value": "v", "include": ["c.json", "d.bin"]}, replacement_site_dir)
+    ]
+    staging = StagingTree()
+    ReplacementEngine(replacements).process_replacements(staging)
+    staging.flush()
+    assert read_files(replacement_site_dir, ["a.json", "b.json", "c.json"]) == {"a.json": "x", "b.json": "nothing to replace", "c.json": "v"}
+    assert (replacement_site_dir / "d.bin").read_bytes() == b"{{X}} VAL_1 \0\xff"
+    assert staging.counters["files_scanned"] == 4
+    assert staging.counters["files_read"] == 2
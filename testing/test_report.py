@@ -0,0 +1,39 @@
+from src.report import SiteReport, timed, write_report
+from json import load
+from pathlib import Path
+
+
+# check that stage times go to the site or the device they were measured for
+def test_timed():
+    site_report = SiteReport("test_site")
+    site_report.add_device("twins")
+    with timed(site_report, "copy_root", "twins"):
+        pass
+    with timed(site_report, "replacements"):
+        pass
+    with timed(None, "replacements"):
+        pass
+    report = site_report.to_dict()
+    assert report["devices"]["twins"]["stages"]["copy_root"] > 0
+    assert report["devices"]["twins"]["stages"]["clear"] == 0
+    assert report["stages"]["replacements"] > 0
+
+# check that the totals add up every site that did not fail
+def test_write_report(tmp_path: Path):
+    site_reports = []
+    for site_id in ["site_a", "site_b"]:
+        site_report = SiteReport(site_id)
+        site_report.add_device("twins")
+        site_report.add_time("clear", 1.0, "twins")
+        site_report.add_time("write", 2.0)
+        site_report.count({"files_read": 3, "bytes_read": 100, "bytes_written": 50})
+        site_reports.append(site_report.to_dict())
+    site_reports.append({"site": "site_c", "failed": True})
+    write_report(tmp_path / "report.json", site_reports, 10.0, 2)
+    with open(tmp_path / "report.json") as report_file:
+        report = load(report_file)
+    assert report["totals"]["stages"]["clear"] == 2.0
+    assert report["totals"]["stages"]["write"] == 4.0
+    assert report["totals"]["counters"]["files_read"] == 6
+    assert report["totals"]["counters"]["bytes_moved"] == 300
+    assert [site_report["site"] for site_report in report["sites"]] == ["site_a", "site_b", "site_c"]
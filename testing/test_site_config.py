@@ -0,0 +1,91 @@
+import src.site_config as site_config
+from src.site_config import CONFIG_CACHE_DIR, CONFIG_CACHE_FILENAME, get_invalid_keys, load_config, save_config_cache, validate_config
+import pytest
+from pathlib import Path
+
+
+# Fixtures
+@pytest.fixture
+def config_site_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    monkeypatch.chdir(tmp_path)
+    # every test starts without a cache loaded in memory
+    monkeypatch.setattr(site_config, "_config_cache", None)
+    monkeypatch.setattr(site_config, "_config_cache_changed", False)
+    site_dir = Path("config") / "site_1"
+    site_dir.mkdir(parents=True)
+    return site_dir
+
+# Actual testing
+
+## test cases
+## 0 - valid config
+## 1 - the config is not a mapping
+## 2 - a variant is not a string
+## 3 - a replacement is missing its value and has a non-string include
+## 4 - a template's pattern type is not supported
+## 5 - a sequential template is missing 'to' and a templated replacement is missing its target
+## 6 - replacements is empty (null)
+## 7 - a replacement's value is a boolean
+@pytest.mark.parametrize("config, errors", [
+    ({"twins_variant": "v1", "ess-controller_variant": 2, "unknown_key": [1],
+      "twins_templates": [{"path": "t.json", "filename_pattern": {"type": "list", "filename_template": "c_{{target}}.json", "list": ["a", 1]},
+                           "templated_replacements": [{"target": "{{ID}}", "list": [1, "b"]}]}],
+      "replacements": [{"target": "{{SITE}}", "value": "site", "include": ["**/*.json"], "exclude": "tests"},
+                       {"target": "{{PORT}}", "value": 502}, {"target": "{{GAIN}}", "value": 0.5}]}, []),
+    ("", ["variance.yml does not hold a mapping of settings"]),
+    ({"twins_variant": True}, ["twins_variant must be a string or an integer, not True"]),
+    ({"replacements": [{"target": "{{SITE}}", "include": [1]}]}, ["replacements[0] is missing 'value'",
+                                                                 "replacements[0].include[0] must be a string, not 1"]),
+    ({"twins_templates": [{"path": "t.json", "filename_pattern": {"type": "random", "filename_template": "c.json"}}]},
+     ["twins_templates[0].filename_pattern.type 'random' is not supported, must be one of ['sequential', 'list']"]),
+    ({"twins_templates": [{"path": "t.json", "filename_pattern": {"type": "sequential", "filename_template": "c.json", "from": 1},
+                           "templated_replacements": [{"list": [1]}]}]},
+     ["twins_templates[0].filename_pattern is missing 'to'", "twins_templates[0].templated_replacements[0] is missing 'target'"]),
+    ({"replacements": None}, ["replacements must be a list, not null"]),
+    ({"replacements": [{"target": "{{ENABLED}}", "value": True}]},
+     ["replacements[0].value must be a string or an integer or a number, not True"]),
+])
+def test_validate_config(config, errors: "list[str]"):
+    assert validate_config(config) == errors
+
+def test_get_invalid_keys():
+    errors = validate_config({"twins_variant": [], "twins_templates": [{"path": "t.json"}], "replacements": [{"value": "v"}],
+                              "ess-controller_variant": "v1"})
+    assert get_invalid_keys(errors) == {"twins_variant", "twins_templates", "replacements"}
+
+# check that a config is parsed once, and read from the cache by later runs until its file changes
+def test_load_config_cache(config_site_dir: Path, monkeypatch: pytest.MonkeyPatch):
+    (config_site_dir / "variance.yml").write_text("twins_variant: v1\nreplacements:\n  - target: '{{SITE}}'\n")
+    config, errors = load_config(config_site_dir)
+    assert config == {"twins_variant": "v1", "replacements": [{"target": "{{SITE}}"}]}
+    assert errors == ["replacements[0] is missing 'value'"]
+    save_config_cache()
+    assert (CONFIG_CACHE_DIR / CONFIG_CACHE_FILENAME).is_file()
+
+    # a later run
+    monkeypatch.setattr(site_config, "_config_cache", None)
+    def parse_config(config_data: bytes):
+        raise AssertionError("the config should come from the cache")
+    monkeypatch.setattr(site_config, "_parse_config", parse_config)
+    assert load_config(config_site_dir) == (config, errors)
+    (config_site_dir / "variance.yml").write_text("twins_variant: v2\n")
+    with pytest.raises(AssertionError):
+        load_config(config_site_dir)
+
+# check that configs JSON can't hold as they are are still loaded, but not cached
+def test_load_config_not_cached(config_site_dir: Path):
+    (config_site_dir / "variance.yml").write_text("twins_variant: v1\ncommissioned: 2024-01-01\n")
+    config, errors = load_config(config_site_dir)
+    assert str(config["commissioned"]) == "2024-01-01" and errors == []
+    save_config_cache()
+    assert not CONFIG_CACHE_DIR.exists()
+
+# check that a replacement's single include or exclude pattern is loaded as a list of one pattern, also from the cache
+def test_load_config_single_patterns(config_site_dir: Path, monkeypatch: pytest.MonkeyPatch):
+    (config_site_dir / "variance.yml").write_text("replacements:\n  - target: '{{SITE}}'\n    value: site\n"
+                                                  "    include: 'twins/**/*.json'\n    exclude: tests\n")
+    expected_config = {"replacements": [{"target": "{{SITE}}", "value": "site", "include": ["twins/**/*.json"], "exclude": ["tests"]}]}
+    assert load_config(config_site_dir) == (expected_config, [])
+    save_config_cache()
+    monkeypatch.setattr(site_config, "_config_cache", None)
+    assert load_config(config_site_dir) == (expected_config, [])
@@ -0,0 +1,275 @@
+import src.staging as staging_module
+from src.staging import StagingTree, staged, wait_for_removals
+import pytest
+from pathlib import Path
+import os
+
+
+# Fixtures
+@pytest.fixture
+def staging_src_dir(tmp_path: Path) -> Path:
+    src_dir = tmp_path / "src"
+    for filepath in ["a.json", "sub/b.json", "sub/deeper/c.json", "tests/test_1.json", ".hidden.json", "notes.txt"]:
+        (src_dir / filepath).parent.mkdir(parents=True, exist_ok=True)
+        with open(src_dir / filepath, "w") as file:
+            file.write(f"{{{{SITE_ID}}}} {filepath}")
+    (src_dir / "empty_dir").mkdir()
+    return src_dir
+
+@pytest.fixture
+def staging_dest_dir(tmp_path: Path) -> Path:
+    return tmp_path / "dest"
+
+# Actual testing
+
+# check that staged files only reach the disk once the tree is flushed
+def test_flush(staging_src_dir: Path, staging_dest_dir: Path):
+    staging = StagingTree()
+    staging.copy_tree(staging_src_dir, staging_dest_dir)
+    staging.write(staging_dest_dir / "a.json", "replaced")
+    assert not staging_dest_dir.exists()
+    assert staging.is_file(staging_dest_dir / "sub" / "deeper" / "c.json")
+    assert staging.is_dir(staging_dest_dir / "empty_dir")
+    staging.flush()
+    expected_files = sorted(path.relative_to(staging_src_dir) for path in staging_src_dir.rglob("*"))
+    assert sorted(path.relative_to(staging_dest_dir) for path in staging_dest_dir.rglob("*")) == expected_files
+    assert (staging_dest_dir / "a.json").read_text() == "replaced"
+    assert (staging_dest_dir / "sub" / "b.json").read_text() == "{{SITE_ID}} sub/b.json"
+
+def test_move_tree(staging_src_dir: Path, staging_dest_dir: Path):
+    staging = StagingTree()
+    staging.copy_tree(staging_src_dir, staging_dest_dir / "config")
+    staging.move_tree(staging_dest_dir / "config" / "tests", staging_dest_dir / "tests")
+    assert staging.is_file(staging_dest_dir / "tests" / "test_1.json")
+    assert not staging.is_file(staging_dest_dir / "config" / "tests" / "test_1.json")
+    assert not staging.is_dir(staging_dest_dir / "config" / "tests")
+
+# check that copies of a removed file are still written while the removed file is deleted from disk
+def test_copy_and_remove(staging_src_dir: Path):
+    template_path = staging_src_dir / "a.json"
+    copies = [staging_src_dir / "a-1.json", staging_src_dir / "a-2.json"]
+    with staged(None) as staging:
+        for copy_path in copies:
+            staging.copy(template_path, copy_path)
+        staging.write(copies[1], staging.read(copies[1]).replace("{{SITE_ID}}", "site"))
+        staging.remove(template_path)
+        assert not staging.is_file(template_path)
+        with pytest.raises(FileNotFoundError):
+            staging.read(template_path)
+    assert not template_path.exists()
+    assert copies[0].read_text() == "{{SITE_ID}} a.json"
+    assert copies[1].read_text() == "site a.json"
+
+def test_iterdir(staging_src_dir: Path):
+    staging = StagingTree()
+    staging.write(staging_src_dir / "tests" / "test_2.json", "new test")
+    staging.remove(staging_src_dir / "tests" / "test_1.json")
+    assert staging.iterdir(staging_src_dir / "tests") == [staging_src_dir / "tests" / "test_2.json"]
+
+## test cases
+## 0 - single wildcard
+## 1 - recursive wildcard
+## 2 - recursive wildcard in the middle of the pattern
+## 3 - exact filename
+## 4 - character ranges
+## 5 - trailing recursive wildcard (directories only)
+## 6 - wildcard directories
+@pytest.mark.parametrize("pattern", [("*.json"), ("**/*.json"), ("sub/**/*.json"), ("sub/b.json"), ("[ab].json"), ("sub/**"), ("*/*")])
+def test_glob_matches_pathlib(staging_src_dir: Path, staging_dest_dir: Path, pattern: str):
+    staging = StagingTree()
+    staging.copy_tree(staging_src_dir, staging_dest_dir)
+    staged_matches = {path.relative_to(staging_dest_dir) for path in staging.glob(staging_dest_dir, pattern) if staging.is_file(path)}
+    disk_matches = {path.relative_to(staging_src_dir) for path in staging_src_dir.glob(pattern) if path.is_file()}
+    assert staged_matches == disk_matches
+
+def test_transform(staging_src_dir: Path, staging_dest_dir: Path):
+    def upper_case(open_source, dest_file):
+        with open_source() as source_file:
+            dest_file.write(source_file.read().upper())
+    staging = StagingTree()
+    staging.copy_tree(staging_src_dir, staging_dest_dir)
+    staging.write(staging_dest_dir / "a.json", "replaced")
+    staging.transform(staging_dest_dir / "a.json", upper_case)
+    staging.transform(staging_dest_dir / "notes.txt", upper_case)
+    # files can also be transformed in place
+    staging.transform(staging_src_dir / "sub" / "b.json", upper_case)
+    staging.flush()
+    assert (staging_dest_dir / "a.json").read_text() == "REPLACED"
+    assert (staging_dest_dir / "notes.txt").read_text() == "{{SITE_ID}} NOTES.TXT"
+    assert (staging_src_dir / "sub" / "b.json").read_text() == "{{SITE_ID}} SUB/B.JSON"
+    assert not list(staging_src_dir.glob("**/*.variance-tmp"))
+
+def test_counters(staging_src_dir: Path, staging_dest_dir: Path):
+    staging = StagingTree()
+    staging.copy_tree(staging_src_dir, staging_dest_dir)
+    staging.write(staging_dest_dir / "a.json", staging.read(staging_dest_dir / "a.json").upper())
+    staging.flush()
+    source_bytes = sum(path.stat().st_size for path in staging_src_dir.rglob("*") if path.is_file())
+    assert staging.counters["files_read"] == 1
+    assert staging.counters["bytes_read"] == (staging_src_dir / "a.json").stat().st_size
+    assert staging.counters["files_written"] == 6
+    assert staging.counters["bytes_written"] == source_bytes
+
+# check that only the files that may hold a target are found, and that the ones on disk are scanned without being read
+def test_find_containing(staging_src_dir: Path, staging_dest_dir: Path):
+    staging = StagingTree(io_workers=2)
+    staging.copy_tree(staging_src_dir, staging_dest_dir)
+    staging.write(staging_dest_dir / "a.json", "written")
+    (staging_src_dir / "empty.json").touch()
+    (staging_src_dir / "binary.bin").write_bytes(b"{{SITE_ID}}\0\xff")
+    found_paths = staging.find_containing({
+        staging_dest_dir / "a.json": ["{{SITE_ID}}"],
+        staging_dest_dir / "sub" / "b.json": ["sub/b"],
+        staging_dest_dir / "sub" / "deeper" / "c.json": ["{{OTHER}}", "{{SITE"],
+        staging_dest_dir / "notes.txt": ["{{OTHER}}"],
+        staging_dest_dir / ".hidden.json": None,
+        staging_dest_dir / "tests" / "test_1.json": ["line\nbreak"],
+        staging_src_dir / "empty.json": ["{{SITE_ID}}"],
+        staging_src_dir / "binary.bin": None,
+        staging_src_dir / "missing.json": ["{{SITE_ID}}"],
+    })
+    assert found_paths == {staging_dest_dir / "sub" / "b.json", staging_dest_dir / "sub" / "deeper" / "c.json",
+                           staging_dest_dir / ".hidden.json", staging_dest_dir / "tests" / "test_1.json",
+                           staging_src_dir / "missing.json"}
+    assert staging.counters["files_read"] == 0
+    # one scan of every file that exists, plus a search for the targets that aren't tokens
+    assert staging.counters["files_scanned"] == 9
+
+# check that a file's tokens are found the same way in its bytes as in its text
+def test_get_scan(staging_src_dir: Path):
+    staging = StagingTree()
+    (staging_src_dir / "tokens.json").write_text('{"{{A}}": "{{\u00e9t\u00e9}} {{B C}} {{{C_1}}}", "d": "\\u007b"}', encoding="utf-8")
+    file_scan = staging.get_scan(staging_src_dir / "tokens.json")
+    assert file_scan.tokens == {"{{A}}", "{{\u00e9t\u00e9}}", "{{C_1}}"}
+    assert file_scan.escaped and not file_scan.binary
+    staging.read(staging_src_dir / "tokens.json", encoding="utf-8")
+    assert staging.get_scan(staging_src_dir / "tokens.json").tokens == file_scan.tokens
+    assert staging.is_binary(staging_src_dir / "a.json") is False
+
+# check that reading and writing files from several threads gives the same files and counters as one at a time
+def test_io_workers(staging_src_dir: Path, staging_dest_dir: Path, tmp_path: Path):
+    counters = []
+    for io_workers, dest_dir in [(1, staging_dest_dir), (4, tmp_path / "threaded")]:
+        staging = StagingTree(io_workers=io_workers)
+        staging.copy_tree(staging_src_dir, dest_dir)
+        staged_files = sorted(path for path in staging_src_dir.rglob("*") if path.is_file())
+        staging.prefetch([dest_dir / path.relative_to(staging_src_dir) for path in staged_files])
+        assert staging.counters["files_read"] == len(staged_files)
+        staging.write(dest_dir / "a.json", staging.read(dest_dir / "a.json").upper())
+        staging.flush()
+        counters.append(staging.counters)
+    assert counters[0] == counters[1]
+    assert sorted(path.relative_to(staging_dest_dir) for path in staging_dest_dir.rglob("*")) == \
+           sorted(path.relative_to(tmp_path / "threaded") for path in (tmp_path / "threaded").rglob("*"))
+    assert (tmp_path / "threaded" / "a.json").read_text() == (staging_dest_dir / "a.json").read_text()
+
+# check that regenerating the same files leaves them untouched and only removes what isn't generated again
+def test_flush_skips_unchanged_files(staging_src_dir: Path, staging_dest_dir: Path):
+    staging = StagingTree()
+    staging.copy_tree(staging_src_dir, staging_dest_dir)
+    staging.write(staging_dest_dir / "a.json", "replaced")
+    staging.flush()
+    mtimes = {path: path.stat().st_mtime_ns for path in staging_dest_dir.rglob("*") if path.is_file()}
+    for path in mtimes:
+        os.utime(path, ns=(mtimes[path] - 10**9, mtimes[path] - 10**9))
+
+    (staging_dest_dir / "stale").mkdir()
+    (staging_dest_dir / "stale" / "old.json").write_text("old")
+
+    staging = StagingTree()
+    staging.remove_tree(staging_dest_dir)
+    assert not staging.is_dir(staging_dest_dir / "sub")
+    assert staging.iterdir(staging_dest_dir) == []
+    staging.copy_tree(staging_src_dir, staging_dest_dir)
+    staging.write(staging_dest_dir / "a.json", "replaced")
+    staging.write(staging_dest_dir / "sub" / "b.json", "changed")
+    staging.remove(staging_dest_dir / "sub" / "deeper" / "c.json")
+    staging.flush()
+    assert staging.counters["files_written"] == 1
+    assert staging.counters["files_unchanged"] == 4
+    assert (staging_dest_dir / "sub" / "b.json").read_text() == "changed"
+    assert not (staging_dest_dir / "sub" / "deeper" / "c.json").exists()
+    assert not (staging_dest_dir / "stale").exists()
+    for path, mtime in mtimes.items():
+        if path.exists() and path.name != "b.json":
+            assert path.stat().st_mtime_ns == mtime - 10**9
+
+## test cases
+## 0 - hard links
+## 1 - symbolic links
+@pytest.mark.parametrize("link_mode", [("hardlink"), ("symlink")])
+def test_link_mode(staging_src_dir: Path, staging_dest_dir: Path, link_mode: str):
+    staging = StagingTree(link_mode)
+    staging.copy_tree(staging_src_dir, staging_dest_dir)
+    staging.write(staging_dest_dir / "a.json", "replaced")
+    staging.flush()
+    assert staging.counters["files_linked"] == 5
+    assert (staging_dest_dir / "sub" / "b.json").samefile(staging_src_dir / "sub" / "b.json")
+    assert not (staging_dest_dir / "a.json").samefile(staging_src_dir / "a.json")
+
+    # a file modified later gets its own copy and the linked source stays the same
+    staging = StagingTree(link_mode)
+    staging.copy_tree(staging_src_dir, staging_dest_dir)
+    staging.write(staging_dest_dir / "sub" / "b.json", "changed")
+    staging.flush()
+    assert (staging_dest_dir / "sub" / "b.json").read_text() == "changed"
+    assert (staging_src_dir / "sub" / "b.json").read_text() == "{{SITE_ID}} sub/b.json"
+    assert staging.counters["files_unchanged"] == 4
+
+    # switching back to copies replaces the links
+    staging = StagingTree()
+    staging.copy_tree(staging_src_dir, staging_dest_dir)
+    staging.flush()
+    assert not (staging_dest_dir / "notes.txt").is_symlink()
+    assert not (staging_dest_dir / "notes.txt").samefile(staging_src_dir / "notes.txt")
+    assert (staging_dest_dir / "notes.txt").read_text() == "{{SITE_ID}} notes.txt"
+
+# check that a swapped directory is replaced whole: files open in the old one keep their contents, unchanged files
+# are carried over instead of copied, files Variance doesn't stage are kept, and nothing is left next to it
+
+## test cases
+## 0 - swapped in one step with renameat2() where it is available
+## 1 - swapped with two renames
+@pytest.mark.parametrize("exchange", [(True), (False)])
+def test_swap_dir(staging_src_dir: Path, staging_dest_dir: Path, monkeypatch: pytest.MonkeyPatch, exchange: bool):
+    if not exchange:
+        monkeypatch.setattr(staging_module, "_renameat2", False)
+    staging = StagingTree()
+    staging.copy_tree(staging_src_dir, staging_dest_dir / "config")
+    staging.flush()
+    (staging_dest_dir / "config" / "user.json").write_text("kept")
+    unchanged_inode = (staging_dest_dir / "config" / "notes.txt").stat().st_ino
+    # an interrupted run left half a directory behind
+    (staging_dest_dir / ".config.variance-new").mkdir()
+    (staging_dest_dir / ".config.variance-new" / "partial.json").write_text("")
+
+    staging = StagingTree()
+    staging.swap_dir(staging_dest_dir / "config")
+    staging.swap_dir(staging_dest_dir / "tests")
+    assert not (staging_dest_dir / ".config.variance-new").exists()
+    staging.copy_tree(staging_src_dir, staging_dest_dir / "config")
+    staging.write(staging_dest_dir / "config" / "a.json", "replaced")
+    staging.remove(staging_dest_dir / "config" / "sub" / "deeper" / "c.json")
+    staging.move_tree(staging_dest_dir / "config" / "tests", staging_dest_dir / "tests")
+    old_config_dir_inode = (staging_dest_dir / "config").stat().st_ino
+    with open(staging_dest_dir / "config" / "a.json") as old_file:
+        staging.flush()
+        assert old_file.read() == "{{SITE_ID}} a.json"
+    wait_for_removals()
+    assert (staging_dest_dir / "config").stat().st_ino != old_config_dir_inode
+    assert sorted(path.name for path in staging_dest_dir.iterdir()) == ["config", "tests"]
+    assert (staging_dest_dir / "config" / "a.json").read_text() == "replaced"
+    assert (staging_dest_dir / "config" / "user.json").read_text() == "kept"
+    assert (staging_dest_dir / "config" / "empty_dir").is_dir()
+    assert not (staging_dest_dir / "config" / "sub" / "deeper" / "c.json").exists()
+    assert (staging_dest_dir / "tests" / "test_1.json").is_file()
+    assert (staging_dest_dir / "config" / "notes.txt").stat().st_ino == unchanged_inode
+    assert staging.counters["files_unchanged"] == 3
+
+    # a swapped directory everything was removed from is removed too
+    staging = StagingTree()
+    staging.swap_dir(staging_dest_dir / "tests")
+    staging.remove_tree(staging_dest_dir / "tests")
+    staging.flush()
+    wait_for_removals()
+    assert sorted(path.name for path in staging_dest_dir.iterdir()) == ["config"]
@@ -0,0 +1,43 @@
+from src.variant_overlay import get_root_layer, get_source_texts, get_variant_layer
+from src.staging import StagingTree
+import pytest
+from pathlib import Path
+
+
+# Fixtures
+@pytest.fixture
+def variants_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    monkeypatch.chdir(tmp_path)
+    variants_dir = Path("overlay-test_variants")
+    for filepath in ["root/modbus/a.json", "root/tests/test_a.json", "variant_1/modbus/b.json", "variant_1/tests/test_b.json"]:
+        (variants_dir / filepath).parent.mkdir(parents=True, exist_ok=True)
+        (variants_dir / filepath).write_text(f'{{"file": "{filepath}"}}')
+    return variants_dir
+
+# Actual testing
+
+# check that root tests go next to 'config' and that each layer is only listed once
+def test_layers(variants_dir: Path):
+    root_layer = get_root_layer("overlay-test")
+    assert root_layer.files == {
+        Path("config/modbus/a.json"): variants_dir / "root" / "modbus" / "a.json",
+        Path("tests/test_a.json"): variants_dir / "root" / "tests" / "test_a.json",
+    }
+    assert sorted(root_layer.dirs) == [Path("config"), Path("config/modbus"), Path("tests")]
+    variant_layer = get_variant_layer("overlay-test", "variant_1")
+    assert variant_layer.files == {
+        Path("config/modbus/b.json"): variants_dir / "variant_1" / "modbus" / "b.json",
+        Path("tests/test_b.json"): variants_dir / "variant_1" / "tests" / "test_b.json",
+    }
+    assert get_root_layer("overlay-test") is root_layer
+    assert get_variant_layer("overlay-test", "variant_1") is variant_layer
+
+# check that a root file staged for several sites is only read from disk once
+def test_shared_source_texts(variants_dir: Path):
+    root_layer = get_root_layer("overlay-test")
+    staging_trees = [StagingTree(source_texts=get_source_texts()) for _ in range(2)]
+    for site_index, staging in enumerate(staging_trees):
+        staging.copy_files(Path(f"config/site_{site_index}/overlay-test"), root_layer.files, root_layer.dirs, shared=True)
+        assert staging.read(Path(f"config/site_{site_index}/overlay-test/config/modbus/a.json")) == '{"file": "root/modbus/a.json"}'
+    assert staging_trees[0].counters["files_read"] == 1
+    assert staging_trees[1].counters["files_read"] == 0
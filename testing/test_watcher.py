@@ -0,0 +1,68 @@
+from src.watcher import InotifyWatcher, PollingWatcher, create_watcher
+import pytest
+from pathlib import Path
+from threading import Timer
+
+
+# Fixtures
+@pytest.fixture
+def watched_dirs(tmp_path: Path) -> "tuple[Path, Path]":
+    variant_dir = tmp_path / "twins_variants" / "root" / "modbus"
+    variant_dir.mkdir(parents=True)
+    (variant_dir / "a.json").write_text("{}")
+    site_dir = tmp_path / "config" / "site_1"
+    (site_dir / "twins").mkdir(parents=True)
+    (site_dir / "variance.yml").write_text("twins_variant: root\n")
+    return tmp_path / "twins_variants", site_dir
+
+def make_watcher(kind: str, watched_dirs: "tuple[Path, Path]"):
+    variants_dir, site_dir = watched_dirs
+    if kind == "inotify":
+        try:
+            return InotifyWatcher([variants_dir], [site_dir])
+        except (OSError, AttributeError):
+            pytest.skip("inotify is not available")
+    return PollingWatcher([variants_dir], [site_dir], poll_interval=0.05)
+
+# Actual testing
+
+## test cases
+## 0 - inotify
+## 1 - polling
+@pytest.mark.parametrize("kind", ["inotify", "polling"])
+def test_wait_for_changes(watched_dirs: "tuple[Path, Path]", kind: str):
+    variants_dir, site_dir = watched_dirs
+    watcher = make_watcher(kind, watched_dirs)
+    modified = variants_dir / "root" / "modbus" / "a.json"
+    added = variants_dir / "root" / "modbus" / "b.json"
+    # a burst of changes is reported together
+    Timer(0.1, lambda: (modified.write_text('{"a": 1}'), added.write_text("{}"), (site_dir / "variance.yml").write_text("x: 1\n"))).start()
+    changes = watcher.wait_for_changes(debounce=0.3)
+    assert {modified, added, site_dir / "variance.yml"} <= changes
+    watcher.close()
+
+## test cases
+## 0 - inotify
+## 1 - polling
+@pytest.mark.parametrize("kind", ["inotify", "polling"])
+def test_wait_for_changes_ignores_device_dirs(watched_dirs: "tuple[Path, Path]", kind: str):
+    variants_dir, site_dir = watched_dirs
+    watcher = make_watcher(kind, watched_dirs)
+    new_file = variants_dir / "root" / "new_dir" / "c.json"
+
+    def make_changes():
+        # the site directory is watched flat, so Variance's output in its device directories is not a change
+        (site_dir / "twins" / "out.json").write_text("{}")
+        new_file.parent.mkdir()
+        new_file.write_text("{}")
+    Timer(0.1, make_changes).start()
+    changes = watcher.wait_for_changes(debounce=0.3)
+    assert new_file in changes
+    assert site_dir / "twins" / "out.json" not in changes
+    watcher.close()
+
+def test_create_watcher(watched_dirs: "tuple[Path, Path]"):
+    variants_dir, site_dir = watched_dirs
+    watcher = create_watcher([variants_dir], [site_dir])
+    assert isinstance(watcher, (InotifyWatcher, PollingWatcher))
+    watcher.close()